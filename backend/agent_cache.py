@@ -0,0 +1,138 @@
+"""Process-local read-through cache of agent documents.
+
+Agent configs rarely change once created, but the run path, ``get_agent``
+and friends load them from Postgres on every call. ``AgentCache`` keeps
+them per ``agent_id`` with an LRU bound and a TTL, and remembers misses
+(404s) for ``negative_ttl`` seconds so unknown ids don't hit the database
+each time.
+
+Each entry carries its version: ``(metadata_hash, version)``, where
+``version`` is the agents row's update counter, bumped by every config or
+flag write. Cached documents leave out the counters, which change on every
+run and would otherwise evict the hottest agents (see agent_rows).
+Writers call ``invalidate`` with the version they produced. Another
+worker's invalidation (delivered over NOTIFY, possibly late) is ignored if
+the cached copy is already that new. Loads are fenced exactly as in
+SecretCache (global invalidation sequence, pruned per-key map, ``_floor``),
+so a load that was in flight during a write or a ``clear`` can't put the
+stale row back.
+
+Cached dicts are shared between callers; treat them as read-only.
+"""
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+Version = Tuple[Optional[str], int]
+Loaded = Tuple[Optional[Dict[str, Any]], int]
+
+
+class AgentCache:
+    def __init__(self, max_entries: int = 10000, ttl: float = 300.0, negative_ttl: float = 5.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        # agent_id -> (agent or None for a cached 404, version, expires_at)
+        self._entries: "OrderedDict[str, Tuple[Optional[Dict[str, Any]], Version, float]]" = OrderedDict()
+        # agent_id -> sequence number of its last invalidation
+        self._seq = 0
+        self._invalidated: Dict[str, int] = {}
+        self._floor = 0
+        self._loading: Dict[str, int] = {}
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.stale_invalidations = 0
+
+    def _lookup(self, agent_id: str):
+        entry = self._entries.get(agent_id)
+        if entry is None:
+            return None
+        if entry[2] <= time.monotonic():
+            del self._entries[agent_id]
+            return None
+        self._entries.move_to_end(agent_id)
+        return entry
+
+    def put(self, agent_id: str, agent: Optional[Dict[str, Any]], version: int = 0, generation: Optional[int] = None):
+        if generation is not None and (generation < self._floor or self._invalidated.get(agent_id, -1) > generation):
+            return
+        current = self._entries.get(agent_id)
+        if current is not None and current[0] is not None and current[1][1] > version:
+            return
+        ttl = self.ttl if agent is not None else self.negative_ttl
+        stamp = ((agent or {}).get("metadata_hash"), version)
+        self._entries[agent_id] = (agent, stamp, time.monotonic() + ttl)
+        self._entries.move_to_end(agent_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    async def get_or_load(self, agent_id: str, loader: Callable[[], Awaitable[Loaded]]) -> Optional[Dict[str, Any]]:
+        """The cached agent, or ``loader()`` -> ``(agent or None, version)`` cached; None means not found."""
+        entry = self._lookup(agent_id)
+        if entry is not None:
+            if entry[0] is None:
+                self.negative_hits += 1
+            else:
+                self.hits += 1
+            return entry[0]
+        self.misses += 1
+        generation = self._seq
+        self._loading[agent_id] = self._loading.get(agent_id, 0) + 1
+        try:
+            agent, version = await loader()
+        finally:
+            if self._loading[agent_id] == 1:
+                del self._loading[agent_id]
+            else:
+                self._loading[agent_id] -= 1
+        self.put(agent_id, agent, version, generation)
+        return agent
+
+    def version(self, agent_id: str) -> Optional[Version]:
+        entry = self._entries.get(agent_id)
+        return entry[1] if entry else None
+
+    def invalidate(self, agent_id: str, version: Optional[int] = None):
+        """Drop ``agent_id`` unless the cached copy is already at ``version`` or newer."""
+        entry = self._entries.get(agent_id)
+        if version is not None and entry is not None and entry[0] is not None and entry[1][1] >= version:
+            self.stale_invalidations += 1
+            return
+        self._seq += 1
+        self._invalidated[agent_id] = self._seq
+        if self._entries.pop(agent_id, None) is not None:
+            self.invalidations += 1
+        if len(self._invalidated) > 2 * self.max_entries:
+            self._prune()
+
+    def _prune(self):
+        for agent_id in [a for a in self._invalidated if a not in self._entries and a not in self._loading]:
+            self._floor = max(self._floor, self._invalidated.pop(agent_id))
+
+    def clear(self):
+        # every load in flight predates this
+        self._seq += 1
+        self._floor = self._seq
+        self._invalidated.clear()
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.negative_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+            "negative_ttl": self.negative_ttl,
+            "hits": self.hits,
+            "negative_hits": self.negative_hits,
+            "misses": self.misses,
+            "hit_ratio": round((self.hits + self.negative_hits) / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "stale_invalidations": self.stale_invalidations,
+            "tracked_invalidations": len(self._invalidated),
+        }
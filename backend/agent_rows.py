@@ -0,0 +1,151 @@
+"""Layout of the ``agents`` table: typed hot columns plus a cold JSONB document.
+
+Counters (action_count, proof_count, revenue, subscribers) and the fields
+the marketplace and owner queries filter on (status, visibility,
+marketplace_listed) are columns; everything else stays in ``data``.
+Counters only ever change through ``INCREMENT_AGENT_COUNTERS_SQL``, an
+atomic ``col = col + $n`` that needs no read first and loses nothing when
+runs race. Document writes (``UPDATE_AGENT_SQL``) never touch them, and a
+counter bump doesn't rewrite the TOASTed document.
+
+``agent_documents`` is the compatibility view: ``data`` with the columns
+merged back in, i.e. the agent dict the API has always returned. Reads go
+through it.
+
+``version`` counts config and flag writes to the row. Document writes bump
+it and return the new value, which versions the process-local AgentCache.
+Counter bumps leave it alone: the cache holds the document without its
+counters (``CACHED_DOCUMENT_SQL``), so a run or a subscribe doesn't evict
+the agents being served hardest. Readers that show counters read the
+columns fresh (``AGENT_COUNTERS_SQL``).
+"""
+from typing import Any, Dict, Optional, Tuple
+
+COUNTER_FIELDS = ("action_count", "proof_count", "revenue", "subscribers")
+FLAG_FIELDS = ("status", "visibility", "marketplace_listed")
+HOT_FIELDS = COUNTER_FIELDS + FLAG_FIELDS
+
+AGENT_COLUMNS_SQL = [
+    """
+    ALTER TABLE agents
+        ADD COLUMN IF NOT EXISTS action_count BIGINT NOT NULL DEFAULT 0,
+        ADD COLUMN IF NOT EXISTS proof_count BIGINT NOT NULL DEFAULT 0,
+        ADD COLUMN IF NOT EXISTS revenue DOUBLE PRECISION NOT NULL DEFAULT 0,
+        ADD COLUMN IF NOT EXISTS subscribers INT NOT NULL DEFAULT 0,
+        ADD COLUMN IF NOT EXISTS visibility TEXT,
+        ADD COLUMN IF NOT EXISTS marketplace_listed BOOLEAN NOT NULL DEFAULT false;
+    """,
+    # move existing values out of the document
+    """
+    UPDATE agents SET
+        action_count = COALESCE((data->>'action_count')::bigint, action_count),
+        proof_count = COALESCE((data->>'proof_count')::bigint, proof_count),
+        revenue = COALESCE((data->>'revenue')::double precision, revenue),
+        subscribers = COALESCE((data->>'subscribers')::int, subscribers),
+        status = COALESCE(data->>'status', status),
+        visibility = COALESCE(data->>'visibility', visibility),
+        marketplace_listed = COALESCE((data->>'marketplace_listed')::boolean, marketplace_listed),
+        data = data - ARRAY['action_count', 'proof_count', 'revenue', 'subscribers', 'status', 'visibility', 'marketplace_listed']
+    WHERE data ?| ARRAY['action_count', 'proof_count', 'revenue', 'subscribers', 'status', 'visibility', 'marketplace_listed'];
+    """,
+    "CREATE INDEX IF NOT EXISTS agents_owner_created_idx ON agents (owner, created_at DESC);",
+    # only listed public agents are indexed, newest first
+    """
+    CREATE INDEX IF NOT EXISTS agents_marketplace_idx ON agents (created_at DESC)
+        WHERE marketplace_listed AND visibility = 'public';
+    """,
+    """
+    CREATE OR REPLACE VIEW agent_documents AS
+    SELECT id, owner, created_at, status, visibility, marketplace_listed,
+           data || jsonb_strip_nulls(jsonb_build_object(
+               'action_count', action_count,
+               'proof_count', proof_count,
+               'revenue', revenue,
+               'subscribers', subscribers,
+               'status', status,
+               'visibility', visibility,
+               'marketplace_listed', marketplace_listed
+           )) AS data
+    FROM agents;
+    """,
+]
+
+AGENT_VERSION_SQL = [
+    "ALTER TABLE agents ADD COLUMN IF NOT EXISTS version BIGINT NOT NULL DEFAULT 0;",
+    # same columns as before, version appended (CREATE OR REPLACE VIEW can only add at the end)
+    """
+    CREATE OR REPLACE VIEW agent_documents AS
+    SELECT id, owner, created_at, status, visibility, marketplace_listed,
+           data || jsonb_strip_nulls(jsonb_build_object(
+               'action_count', action_count,
+               'proof_count', proof_count,
+               'revenue', revenue,
+               'subscribers', subscribers,
+               'status', status,
+               'visibility', visibility,
+               'marketplace_listed', marketplace_listed
+           )) AS data,
+           version
+    FROM agents;
+    """,
+]
+
+INSERT_AGENT_SQL = """
+INSERT INTO agents (id, owner, data, created_at, status, visibility, marketplace_listed,
+                    action_count, proof_count, revenue, subscribers)
+VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11)
+ON CONFLICT (id) DO UPDATE SET
+    data = EXCLUDED.data, status = EXCLUDED.status, visibility = EXCLUDED.visibility,
+    marketplace_listed = EXCLUDED.marketplace_listed, version = agents.version + 1
+RETURNING version
+"""
+
+UPDATE_AGENT_SQL = """
+UPDATE agents SET data = $2, status = $3, visibility = $4, marketplace_listed = $5, version = version + 1
+WHERE id = $1
+RETURNING version
+"""
+
+INCREMENT_AGENT_COUNTERS_SQL = """
+UPDATE agents SET
+    action_count = action_count + $2,
+    proof_count = proof_count + $3,
+    revenue = revenue + $4,
+    subscribers = subscribers + $5
+WHERE id = $1
+RETURNING action_count, proof_count, revenue, subscribers
+"""
+
+# agent_documents.data minus the counters, i.e. what AgentCache holds
+CACHED_DOCUMENT_SQL = "data - '{action_count,proof_count,revenue,subscribers}'::text[]"
+
+# hot columns only: a heap fetch by primary key that never detoasts the document
+AGENT_COUNTERS_SQL = "SELECT action_count, proof_count, revenue, subscribers FROM agents WHERE id = $1"
+
+
+def split_agent(agent: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """(cold document, hot fields) of an agent dict."""
+    cold = {k: v for k, v in agent.items() if k not in HOT_FIELDS}
+    hot = {k: agent.get(k) for k in HOT_FIELDS}
+    return cold, hot
+
+
+def insert_agent_args(agent: Dict[str, Any], owner: str, created_at) -> tuple:
+    cold, hot = split_agent(agent)
+    return (
+        agent["id"], owner, cold, created_at, hot["status"], hot["visibility"], bool(hot["marketplace_listed"]),
+        int(hot["action_count"] or 0), int(hot["proof_count"] or 0), float(hot["revenue"] or 0), int(hot["subscribers"] or 0),
+    )
+
+
+def update_agent_args(agent: Dict[str, Any]) -> tuple:
+    """Document and flags only; counters keep their stored values."""
+    cold, hot = split_agent(agent)
+    return agent["id"], cold, hot["status"], hot["visibility"], bool(hot["marketplace_listed"])
+
+
+async def increment_agent_counters(conn, agent_id: str, action_count: int = 0, proof_count: int = 0,
+                                   revenue: float = 0.0, subscribers: int = 0) -> Optional[Dict[str, Any]]:
+    """Atomically add to the agent's counters; their new values, or None if there is no such agent."""
+    row = await conn.fetchrow(INCREMENT_AGENT_COUNTERS_SQL, agent_id, action_count, proof_count, float(revenue), subscribers)
+    return dict(row) if row else None
@@ -0,0 +1,351 @@
+"""Incrementally maintained per-agent analytics rollups.
+
+Every action, proof and revenue event updates per-agent totals and
+minute/hour/day buckets (runs, proofs, revenue and a fixed latency
+histogram), so ``/analytics/agent/{id}`` reads a bounded amount of
+precomputed data instead of counting ``actions`` rows.
+
+In-memory mode reads the local rollups directly. With Postgres, the local
+deltas are also upserted into ``agent_rollups`` every ``flush_interval``
+seconds (additive, so several workers can share the table) and reads come
+from there. ``backfill_*`` rebuild runs, proofs and latency from existing
+rows; ``backfill_db`` must run while writers are quiesced (see there).
+"""
+import asyncio
+import logging
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Upper edges (ms) of the latency histogram buckets; the last bucket is overflow.
+LATENCY_EDGES_MS = [10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000]
+HIST_SIZE = len(LATENCY_EDGES_MS) + 1
+
+# granularity -> (bucket width, buckets kept, buckets returned by snapshot)
+GRANULARITIES = {
+    "minute": (timedelta(minutes=1), 120, 60),
+    "hour": (timedelta(hours=1), 48, 24),
+    "day": (timedelta(days=1), 90, 30),
+}
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+CREATE_ROLLUPS_SQL = """
+CREATE TABLE IF NOT EXISTS agent_rollups (
+    agent_id TEXT NOT NULL,
+    granularity TEXT NOT NULL,
+    bucket_start TIMESTAMP WITH TIME ZONE NOT NULL,
+    runs BIGINT NOT NULL DEFAULT 0,
+    proofs BIGINT NOT NULL DEFAULT 0,
+    revenue DOUBLE PRECISION NOT NULL DEFAULT 0,
+    latency_hist INT[] NOT NULL,
+    PRIMARY KEY (agent_id, granularity, bucket_start)
+);
+"""
+
+UPSERT_SQL = """
+INSERT INTO agent_rollups (agent_id, granularity, bucket_start, runs, proofs, revenue, latency_hist)
+VALUES ($1, $2, $3, $4, $5, $6, $7)
+ON CONFLICT (agent_id, granularity, bucket_start) DO UPDATE SET
+    runs = agent_rollups.runs + EXCLUDED.runs,
+    proofs = agent_rollups.proofs + EXCLUDED.proofs,
+    revenue = agent_rollups.revenue + EXCLUDED.revenue,
+    latency_hist = (
+        SELECT array_agg(a + b ORDER BY i)
+        FROM unnest(agent_rollups.latency_hist, EXCLUDED.latency_hist) WITH ORDINALITY AS t(a, b, i)
+    )
+"""
+
+
+def latency_bucket(latency_ms: float) -> int:
+    for i, edge in enumerate(LATENCY_EDGES_MS):
+        if latency_ms <= edge:
+            return i
+    return len(LATENCY_EDGES_MS)
+
+
+def hist_percentile(hist: List[int], pct: float) -> Optional[float]:
+    """Upper edge of the bucket holding the ``pct`` quantile (None if empty/overflow)."""
+    total = sum(hist)
+    if not total:
+        return None
+    rank = pct * total
+    seen = 0
+    for i, count in enumerate(hist):
+        seen += count
+        if seen >= rank:
+            return LATENCY_EDGES_MS[i] if i < len(LATENCY_EDGES_MS) else None
+    return None
+
+
+def bucket_start(at: datetime, granularity: str) -> datetime:
+    if granularity == "total":
+        return EPOCH
+    if granularity == "minute":
+        return at.replace(second=0, microsecond=0)
+    if granularity == "hour":
+        return at.replace(minute=0, second=0, microsecond=0)
+    return at.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def _as_utc(at: Optional[datetime]) -> datetime:
+    if at is None:
+        return datetime.now(timezone.utc)
+    if at.tzinfo is None:
+        return at.replace(tzinfo=timezone.utc)
+    return at
+
+
+class _Cell:
+    __slots__ = ("runs", "proofs", "revenue", "hist")
+
+    def __init__(self):
+        self.runs = 0
+        self.proofs = 0
+        self.revenue = 0.0
+        self.hist = [0] * HIST_SIZE
+
+    def add(self, runs: int, proofs: int, revenue: float, latency_ms: Optional[float]):
+        self.runs += runs
+        self.proofs += proofs
+        self.revenue += revenue
+        if latency_ms is not None:
+            self.hist[latency_bucket(latency_ms)] += 1
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "runs": self.runs,
+            "proofs": self.proofs,
+            "revenue": round(self.revenue, 2),
+            "latency_ms": {p: hist_percentile(self.hist, q) for p, q in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99))},
+        }
+
+
+class AgentRollups:
+    def __init__(self, flush_interval: float = 1.0):
+        self.flush_interval = flush_interval
+        self._totals: Dict[str, _Cell] = {}
+        self._buckets: Dict[Tuple[str, str], "OrderedDict[datetime, _Cell]"] = {}
+        self._pending: Dict[Tuple[str, str, datetime], _Cell] = {}
+        self._pool = None
+        self._task: Optional[asyncio.Task] = None
+
+    # recording ------------------------------------------------------------
+
+    def record(self, agent_id: str, at: Optional[datetime] = None, runs: int = 0, proofs: int = 0, revenue: float = 0.0, latency_ms: Optional[float] = None):
+        """Fold one event into the agent's totals and time buckets."""
+        at = _as_utc(at)
+        self._totals.setdefault(agent_id, _Cell()).add(runs, proofs, revenue, latency_ms)
+        for granularity, (_, keep, _) in GRANULARITIES.items():
+            buckets = self._buckets.setdefault((agent_id, granularity), OrderedDict())
+            start = bucket_start(at, granularity)
+            cell = buckets.get(start)
+            if cell is None:
+                last = next(reversed(buckets), None)
+                cell = buckets[start] = _Cell()
+                if last is not None and start < last:
+                    # out-of-order (backfilled) bucket: restore time order
+                    for key in sorted(buckets):
+                        buckets.move_to_end(key)
+                while len(buckets) > keep:
+                    buckets.popitem(last=False)
+            cell.add(runs, proofs, revenue, latency_ms)
+        if self._pool is not None:
+            for granularity in ("total", *GRANULARITIES):
+                key = (agent_id, granularity, bucket_start(at, granularity))
+                self._pending.setdefault(key, _Cell()).add(runs, proofs, revenue, latency_ms)
+
+    # snapshots ------------------------------------------------------------
+
+    def _series(self, cells: Iterable[Tuple[datetime, _Cell]], granularity: str, now: datetime) -> List[Dict[str, Any]]:
+        width, _, shown = GRANULARITIES[granularity]
+        since = bucket_start(now, granularity) - width * (shown - 1)
+        return [{"t": start.isoformat(), **cell.to_dict()} for start, cell in cells if start >= since]
+
+    def snapshot(self, agent_id: str) -> Dict[str, Any]:
+        """Totals plus recent minute/hour/day series from local state."""
+        now = datetime.now(timezone.utc)
+        totals = self._totals.get(agent_id) or _Cell()
+        result = {"totals": totals.to_dict()}
+        for granularity in GRANULARITIES:
+            buckets = self._buckets.get((agent_id, granularity)) or {}
+            result[granularity] = self._series(buckets.items(), granularity, now)
+        return result
+
+    async def load(self, agent_id: str) -> Dict[str, Any]:
+        """Snapshot from ``agent_rollups`` (Postgres mode) or local state."""
+        if self._pool is None:
+            return self.snapshot(agent_id)
+        now = datetime.now(timezone.utc)
+        oldest = {g: bucket_start(now, g) - width * (shown - 1) for g, (width, _, shown) in GRANULARITIES.items()}
+        async with self._pool.acquire() as conn:
+            rows = await conn.fetch(
+                "SELECT granularity, bucket_start, runs, proofs, revenue, latency_hist FROM agent_rollups "
+                "WHERE agent_id = $1 AND (granularity = 'total' "
+                "OR (granularity = 'minute' AND bucket_start >= $2) "
+                "OR (granularity = 'hour' AND bucket_start >= $3) "
+                "OR (granularity = 'day' AND bucket_start >= $4)) "
+                "ORDER BY granularity, bucket_start",
+                agent_id, oldest["minute"], oldest["hour"], oldest["day"],
+            )
+        totals = _Cell()
+        series: Dict[str, List[Tuple[datetime, _Cell]]] = {g: [] for g in GRANULARITIES}
+        for row in rows:
+            cell = _Cell()
+            cell.runs, cell.proofs, cell.revenue = row["runs"], row["proofs"], row["revenue"]
+            cell.hist = list(row["latency_hist"])
+            if row["granularity"] == "total":
+                totals = cell
+            else:
+                series[row["granularity"]].append((row["bucket_start"], cell))
+        result = {"totals": totals.to_dict()}
+        for granularity, cells in series.items():
+            result[granularity] = self._series(cells, granularity, now)
+        return result
+
+    # persistence ----------------------------------------------------------
+
+    async def start(self, pool):
+        """Switch to Postgres-backed rollups and start the delta flusher."""
+        self._pool = pool
+        async with pool.acquire() as conn:
+            await conn.execute(CREATE_ROLLUPS_SQL)
+        self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        flushes = 0
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+                flushes += 1
+                if flushes % 60 == 0:
+                    await self.prune()
+            except Exception:
+                logger.exception("analytics rollup flush failed; will retry")
+
+    async def flush(self):
+        if not self._pending or self._pool is None:
+            return
+        pending, self._pending = self._pending, {}
+        try:
+            async with self._pool.acquire() as conn:
+                async with conn.transaction():
+                    await self._upsert(conn, pending)
+        except Exception:
+            self._restore(pending)
+            raise
+
+    @staticmethod
+    async def _upsert(conn, pending: Dict[Tuple[str, str, datetime], _Cell]):
+        args = [(a, g, start, c.runs, c.proofs, c.revenue, c.hist) for (a, g, start), c in pending.items()]
+        await conn.executemany(UPSERT_SQL, args)
+
+    def _restore(self, pending: Dict[Tuple[str, str, datetime], _Cell]):
+        # merge the deltas back so nothing is lost
+        for key, cell in pending.items():
+            merged = self._pending.setdefault(key, _Cell())
+            merged.add(cell.runs, cell.proofs, cell.revenue, None)
+            merged.hist = [a + b for a, b in zip(merged.hist, cell.hist)]
+
+    async def prune(self):
+        """Drop buckets older than their retention window."""
+        now = datetime.now(timezone.utc)
+        async with self._pool.acquire() as conn:
+            for granularity, (width, keep, _) in GRANULARITIES.items():
+                await conn.execute(
+                    "DELETE FROM agent_rollups WHERE granularity = $1 AND bucket_start < $2",
+                    granularity, bucket_start(now, granularity) - width * keep,
+                )
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._pool is not None:
+            await self.flush()
+
+    # backfill -------------------------------------------------------------
+
+    def reset(self):
+        self._totals.clear()
+        self._buckets.clear()
+        self._pending.clear()
+
+    def backfill_memory(self, actions: Iterable[Dict[str, Any]], proofs: Iterable[Dict[str, Any]], agents: Iterable[Dict[str, Any]] = ()):
+        """Rebuild local rollups from in-memory action/proof records."""
+        self.reset()
+        for action in actions:
+            at = action.get("created_at") or action.get("timestamp")
+            self.record(
+                action["agent_id"],
+                at=datetime.fromisoformat(at) if at else None,
+                runs=1,
+                latency_ms=action.get("latency_ms"),
+            )
+        for proof in proofs:
+            at = proof.get("created_at")
+            self.record(proof["agent_id"], at=datetime.fromisoformat(at) if at else None, proofs=1)
+        # revenue accrued before rollups existed only survives as a running total
+        for agent in agents:
+            if agent.get("revenue"):
+                self._totals.setdefault(agent["id"], _Cell()).revenue += float(agent["revenue"])
+
+    async def backfill_db(self, write_buffer=None):
+        """Recompute runs, proofs and latency histograms in ``agent_rollups`` with set-based SQL.
+
+        Rows are upserted, never deleted: revenue has no source table and
+        keeps its accumulated value. Latency comes from the ``latency_ms``
+        each run stores in ``actions.payload``; runs without one only count
+        towards ``runs``.
+
+        ``write_buffer`` is flushed first so journaled rows are counted, and
+        this worker's pending deltas are written in the same transaction as
+        the rebuild (their revenue survives, their counts are superseded).
+        Run it only while writers are quiesced: another worker's unflushed
+        deltas, or a run recorded while the rebuild executes, would be
+        counted twice.
+        """
+        now = datetime.now(timezone.utc)
+        since = {g: bucket_start(now, g) - width * keep for g, (width, keep, _) in GRANULARITIES.items()}
+        # histogram slot of each action: how many bucket edges its latency exceeds
+        slot = f"(SELECT count(*) FROM unnest(ARRAY{LATENCY_EDGES_MS}::float8[]) AS e WHERE e < (payload->>'latency_ms')::float8)"
+        hist = "ARRAY[" + ", ".join(f"count(*) FILTER (WHERE payload->>'latency_ms' IS NOT NULL AND {slot} = {i})::int" for i in range(HIST_SIZE)) + "]"
+        rebuilds = (
+            ("actions", "runs, latency_hist", f"count(*), {hist}",
+             "runs = EXCLUDED.runs, latency_hist = EXCLUDED.latency_hist"),
+            ("proofs", "proofs, latency_hist", f"count(*), array_fill(0, ARRAY[{HIST_SIZE}])",
+             "proofs = EXCLUDED.proofs"),
+        )
+        if write_buffer is not None:
+            await write_buffer.flush()
+        pending, self._pending = self._pending, {}
+        try:
+            async with self._pool.acquire() as conn:
+                async with conn.transaction():
+                    if pending:
+                        await self._upsert(conn, pending)
+                    for table, columns, values, updates in rebuilds:
+                        await conn.execute(
+                            f"""
+                            INSERT INTO agent_rollups (agent_id, granularity, bucket_start, {columns})
+                            SELECT agent_id, g.granularity,
+                                   CASE WHEN g.granularity = 'total' THEN $1 ELSE date_trunc(g.granularity, created_at) END,
+                                   {values}
+                            FROM {table}
+                            CROSS JOIN (VALUES ('total'), ('minute'), ('hour'), ('day')) AS g(granularity)
+                            WHERE agent_id IS NOT NULL AND (
+                                g.granularity = 'total'
+                                OR (g.granularity = 'minute' AND created_at >= $2)
+                                OR (g.granularity = 'hour' AND created_at >= $3)
+                                OR (g.granularity = 'day' AND created_at >= $4))
+                            GROUP BY 1, 2, 3
+                            ON CONFLICT (agent_id, granularity, bucket_start) DO UPDATE SET {updates}
+                            """,
+                            EPOCH, since["minute"], since["hour"], since["day"],
+                        )
+        except Exception:
+            self._restore(pending)
+            raise
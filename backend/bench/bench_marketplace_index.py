@@ -0,0 +1,114 @@
+"""Marketplace search: MarketplaceIndex vs a scan of every agent.
+
+The scan is what ``GET /api/marketplace/agents`` used to cost, plus the
+filtering and sorting the endpoint now offers: walk ``agents_db``, keep the
+listed public agents that match, sort, slice a page. The index answers the
+same query from its posting sets and sorted views. Both must return the
+same ids. Times are microseconds per query. Run from the backend folder:
+
+    python bench/bench_marketplace_index.py --agents 20000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from marketplace_index import SORTS, MarketplaceIndex, is_listed, sort_values, tokenize  # noqa: E402
+from memory_store import IndexedTable  # noqa: E402
+
+WORDS = ["alpha", "oracle", "trader", "signal", "governance", "yield", "sentiment", "arbitrage", "research", "delegate"]
+CAPABILITIES = ["Predict", "Signal", "Transaction", "Vote", "Publish"]
+
+
+def make_agents(count: int, seed: int = 7):
+    rng = random.Random(seed)
+    for i in range(count):
+        yield {
+            "id": f"agent_{i:06d}",
+            "name": f"{rng.choice(WORDS).title()} {rng.choice(WORDS).title()} {i}",
+            "description": " ".join(rng.choice(WORDS) for _ in range(8)),
+            "capabilities": rng.sample(CAPABILITIES, rng.randint(1, 3)),
+            "visibility": "public" if rng.random() < 0.8 else "private",
+            "marketplace_listed": rng.random() < 0.6,
+            "price": rng.randint(0, 200),
+            "rating": round(rng.uniform(1, 5), 1),
+            "subscribers": rng.randint(0, 5000),
+            "revenue": round(rng.uniform(0, 50000), 2),
+            "created_at": f"2025-01-01T00:00:{i:06d}",
+        }
+
+
+def scan(agents, tokens, capabilities, min_price, max_price, sort, limit):
+    _, descending = SORTS[sort]
+    hits = []
+    for agent_id, agent in agents.items():
+        if not is_listed(agent):
+            continue
+        words = set(tokenize(f"{agent.get('name', '')} {agent.get('description', '')}"))
+        if not set(tokens) <= words or not set(capabilities) <= set(agent.get("capabilities") or []):
+            continue
+        values = sort_values(agent)
+        if (min_price is not None and values["price"] < min_price) or (max_price is not None and values["price"] > max_price):
+            continue
+        hits.append((values[sort], agent_id))
+    hits.sort(reverse=descending)
+    return [agent_id for _, agent_id in hits[:limit]]
+
+
+QUERIES = [
+    ("browse newest", dict(sort="newest")),
+    ("top rated", dict(sort="rating")),
+    ("cheapest Vote agents", dict(capabilities=["Vote"], sort="price")),
+    ("text + price range", dict(tokens=["oracle", "yield"], min_price=20, max_price=80, sort="subscribers")),
+    ("rare text", dict(tokens=["arbitrage", "delegate", "sentiment"], capabilities=["Publish", "Vote"], sort="revenue")),
+]
+
+
+def timed(fn, runs: int) -> float:
+    fn()
+    started = time.perf_counter()
+    for _ in range(runs):
+        fn()
+    return (time.perf_counter() - started) / runs * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--agents", type=int, default=20000)
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--runs", type=int, default=50)
+    args = parser.parse_args()
+
+    agents = IndexedTable()
+    index = agents.attach_index("marketplace", MarketplaceIndex())
+    started = time.perf_counter()
+    for agent in make_agents(args.agents):
+        agents[agent["id"]] = agent
+    print(f"indexed {len(index)} listed of {len(agents)} agents in {(time.perf_counter() - started) * 1000:.0f} ms")
+
+    print(f"{'us per query':<24} {'scan':>10} {'index':>10} {'speedup':>9}")
+    for label, query in QUERIES:
+        full = dict(tokens=[], capabilities=[], min_price=None, max_price=None)
+        full.update(query)
+        expected = scan(agents, limit=args.limit, **full)
+        got, _ = index.search(limit=args.limit, **query)
+        assert got == expected, label
+        before = timed(lambda: scan(agents, limit=args.limit, **full), max(1, args.runs // 10))
+        after = timed(lambda: index.search(limit=args.limit, **query), args.runs)
+        print(f"{label:<24} {before:>10.1f} {after:>10.1f} {before / after:>8.1f}x")
+
+    agent_id = next(iter(index.entries))
+    agent = agents[agent_id]
+
+    def subscribe():
+        agent["subscribers"] += 1
+        agents.reindex(agent_id)
+
+    print(f"incremental update (subscribe + reindex): {timed(subscribe, args.runs * 10):.1f} us")
+
+
+if __name__ == "__main__":
+    main()
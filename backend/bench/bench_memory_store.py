@@ -0,0 +1,63 @@
+"""Indexed vs full-scan lookups over the in-memory stores as they grow.
+
+Run from the backend folder:
+
+    python bench/bench_memory_store.py --sizes 1000 10000 100000 1000000
+
+The probed agent always owns the same 50 actions, so an O(matches) lookup
+should stay flat while the linear scan grows with the table.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from memory_store import IndexedTable  # noqa: E402
+
+PROBE_AGENT = "agent_probe"
+PROBE_ACTIONS = 50
+
+
+def build(size: int) -> IndexedTable:
+    actions = IndexedTable()
+    actions.add_index("agent", lambda a: a.get("agent_id"), sort_fn=lambda a: a.get("created_at") or "")
+    for i in range(size - PROBE_ACTIONS):
+        actions[f"a{i}"] = {"id": f"a{i}", "agent_id": f"agent_{i % 1000}", "created_at": f"2025-01-01T00:{i % 60:02d}:00"}
+    for i in range(PROBE_ACTIONS):
+        actions[f"p{i}"] = {"id": f"p{i}", "agent_id": PROBE_AGENT, "created_at": f"2025-01-02T00:00:{i:02d}"}
+    return actions
+
+
+def timed(fn, repeat: int) -> float:
+    started = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - started) / repeat * 1e6
+
+
+def main(args):
+    rows = []
+    for size in args.sizes:
+        started = time.perf_counter()
+        actions = build(size)
+        build_s = time.perf_counter() - started
+        indexed = timed(lambda: actions.lookup("agent", PROBE_AGENT, newest_first=True), args.repeat)
+        scan_repeat = max(1, args.repeat // max(1, size // 10000))
+        scan = timed(lambda: [a for a in actions.values() if a["agent_id"] == PROBE_AGENT], scan_repeat)
+        rows.append({
+            "size": size,
+            "build_s": round(build_s, 2),
+            "indexed_lookup_us": round(indexed, 2),
+            "scan_lookup_us": round(scan, 2),
+        })
+    print(json.dumps(rows, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--repeat", type=int, default=200)
+    main(parser.parse_args())
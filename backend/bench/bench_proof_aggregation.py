@@ -0,0 +1,85 @@
+"""Per-proof vs Merkle-aggregated proof submission against the simulated chain.
+
+Run from the backend folder:
+
+    python bench/bench_proof_aggregation.py --proofs 2000 --batch-size 256
+
+Each transaction is one on-chain verification, so ``txs`` is the number of
+verifier calls paid for; blocks hold ``--block-capacity`` transactions.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chain import SimulatedChain  # noqa: E402
+from proof_batches import ProofAggregator, verify_inclusion  # noqa: E402
+
+VERIFIER = "0xverifier"
+
+
+def make_chain(args) -> SimulatedChain:
+    return SimulatedChain(
+        block_time=args.block_time,
+        latency_mean=args.latency,
+        latency_jitter=args.latency / 4,
+        block_capacity=args.block_capacity,
+        seed=1,
+    )
+
+
+def proof_hashes(n: int):
+    return [hashlib.sha256(f"proof{i}".encode()).hexdigest() for i in range(n)]
+
+
+async def per_proof(args) -> dict:
+    chain = make_chain(args)
+    started = time.perf_counter()
+    pending = [await chain.submit(VERIFIER, "submit_action_proof", {"proof_hash": h}) for h in proof_hashes(args.proofs)]
+    await asyncio.gather(*[p.wait() for p in pending])
+    elapsed = time.perf_counter() - started
+    await chain.close()
+    return {"txs": len(pending), "seconds": round(elapsed, 3), "proofs_per_sec": round(args.proofs / elapsed, 1)}
+
+
+async def aggregated(args) -> dict:
+    chain = make_chain(args)
+    aggregator = ProofAggregator(chain, VERIFIER, batch_size=args.batch_size, max_age=60, per_agent=False)
+    loop = asyncio.get_running_loop()
+    done = [loop.create_future() for _ in range(args.proofs)]
+    started = time.perf_counter()
+    for i, h in enumerate(proof_hashes(args.proofs)):
+        await aggregator.add(f"p{i}", h, f"agent{i % 8}", on_verified=lambda r, f=done[i]: f.set_result(r))
+    await aggregator.flush()
+    await asyncio.gather(*done)
+    elapsed = time.perf_counter() - started
+    sample = aggregator.inclusion_proof("p0")
+    assert verify_inclusion(sample["leaf"], sample["path"], sample["root"])
+    await chain.close()
+    return {
+        "txs": len(aggregator.batches),
+        "seconds": round(elapsed, 3),
+        "proofs_per_sec": round(args.proofs / elapsed, 1),
+        "inclusion_path_len": len(sample["path"]),
+    }
+
+
+async def main(args):
+    results = {"per_proof": await per_proof(args), "aggregated": await aggregated(args)}
+    results["speedup"] = round(results["aggregated"]["proofs_per_sec"] / results["per_proof"]["proofs_per_sec"], 1)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--proofs", type=int, default=2000)
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--block-time", type=float, default=0.1, help="Simulated block time (s)")
+    parser.add_argument("--block-capacity", type=int, default=100, help="Max txs per block")
+    parser.add_argument("--latency", type=float, default=0.01, help="Mean mempool latency (s)")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,141 @@
+"""JSON encode/decode cost of one agent run: stdlib json vs the orjson layer.
+
+One run (``POST /agents/{id}/run`` with Postgres) does this JSON work:
+
+- decode the agent row's ``data`` JSONB
+- hash the canonical proof input (stdlib json on both paths, so stored
+  hashes keep their bytes)
+- encode the action, proof and event JSONB parameters
+- render the HTTP response: FastAPI's jsonable_encoder then JSONResponse
+  before; the run endpoint now returns an ORJSONResponse directly
+
+"stdlib" is the path before serialization.py: json.dumps/loads, a text
+JSONB codec and JSONResponse. "orjson" is the current path. Times are
+microseconds per run. ``--dsn`` adds a Postgres round trip (executemany
+insert + fetch of action rows) under each codec. Run from the backend
+folder:
+
+    python bench/bench_serialization.py --runs 20000
+    python bench/bench_serialization.py --dsn postgresql://localhost/phantom
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+from starlette.responses import JSONResponse  # noqa: E402
+
+import serialization  # noqa: E402
+from llm_providers import LocalProvider  # noqa: E402
+
+
+def fixtures():
+    import main
+
+    main.initialize_mock_data()
+    agent = dict(main.agents_db["agent_crypto_trader"])
+    words, _ = LocalProvider(output_tokens=256)._generate("What is the BTC outlook?", "local-sim")
+    result = "".join(words)
+    proof = main.generate_noir_proof_mock(agent, result, "predict")
+    proof_input = {"agent_id": agent["id"], "config_hash": agent["metadata_hash"], "action_type": "predict",
+                   "action_payload_hash": proof["action_payload_hash"], "timestamp": "2025-01-01T00:00:00"}
+    action = {"id": "a" * 16, "agent_id": agent["id"], "user_id": "bench", "payload": {"prompt": "What is the BTC outlook?"},
+              "result": result, "proof_hash": proof["proof_hash"], "latency_ms": 12.5, "created_at": "2025-01-01T00:00:00"}
+    event = {"action_id": action["id"], "agent_id": agent["id"]}
+    response = {"action_id": action["id"], "result": result, "proof": proof, "proof_batch": None,
+                "tx": {"transaction_hash": "0x" + "ab" * 32, "status": "ACCEPTED_ON_L2", "block_number": 1}}
+    return agent, proof_input, action, proof, event, response
+
+
+def stdlib_run(agent_text, proof_input, action, proof, event, response):
+    json.loads(agent_text)
+    json.dumps(proof_input, sort_keys=True)
+    for value in (action, proof, event):
+        json.dumps(value)
+    JSONResponse(jsonable_encoder(response))
+
+
+def orjson_run(agent_jsonb, proof_input, action, proof, event, response):
+    serialization._decode_jsonb(agent_jsonb)
+    serialization.canonical(proof_input)
+    for value in (action, proof, event):
+        serialization._encode_jsonb(value)
+    serialization.ORJSONResponse(response)
+
+
+def timed(fn, args, runs: int) -> float:
+    for _ in range(min(runs, 1000)):
+        fn(*args)
+    started = time.perf_counter()
+    for _ in range(runs):
+        fn(*args)
+    return (time.perf_counter() - started) / runs * 1e6
+
+
+def compare(label: str, before: float, after: float):
+    print(f"{label:<28} {before:>10.2f} {after:>10.2f} {before / after:>8.2f}x")
+
+
+def offline(runs: int):
+    agent, proof_input, action, proof, event, response = fixtures()
+    agent_text = json.dumps(agent)
+    agent_jsonb = serialization._encode_jsonb(agent)
+    print(f"{'us per run':<28} {'stdlib':>10} {'orjson':>10} {'speedup':>9}")
+    compare("decode agent row", timed(json.loads, (agent_text,), runs), timed(serialization._decode_jsonb, (agent_jsonb,), runs))
+    compare("proof hash input", timed(lambda v: json.dumps(v, sort_keys=True), (proof_input,), runs),
+            timed(serialization.canonical, (proof_input,), runs))
+    compare("encode action/proof/event", timed(lambda *v: [json.dumps(x) for x in v], (action, proof, event), runs),
+            timed(lambda *v: [serialization._encode_jsonb(x) for x in v], (action, proof, event), runs))
+    compare("render response", timed(lambda r: JSONResponse(jsonable_encoder(r)), (response,), runs),
+            timed(serialization.ORJSONResponse, (response,), runs))
+    args = (agent_text, proof_input, action, proof, event, response)
+    compare("total per run", timed(stdlib_run, args, runs), timed(orjson_run, (agent_jsonb,) + args[1:], runs))
+
+
+async def stdlib_codecs(conn):
+    for type_name in ("jsonb", "json"):
+        await conn.set_type_codec(type_name, encoder=json.dumps, decoder=json.loads, schema="pg_catalog")
+
+
+async def round_trip(dsn: str, rows: int, repeat: int):
+    import asyncpg
+
+    _, _, action, _, _, _ = fixtures()
+    print(f"\nPostgres: insert + fetch {rows} action rows, ms per batch (best of {repeat})")
+    results = {}
+    for label, init in (("stdlib", stdlib_codecs), ("orjson", serialization.register_json_codecs)):
+        conn = await asyncpg.connect(dsn)
+        await init(conn)
+        await conn.execute("CREATE TEMP TABLE bench_actions (id SERIAL PRIMARY KEY, payload JSONB)")
+        best = float("inf")
+        for _ in range(repeat):
+            await conn.execute("TRUNCATE bench_actions")
+            started = time.perf_counter()
+            await conn.executemany("INSERT INTO bench_actions (payload) VALUES ($1)", [(action,)] * rows)
+            fetched = await conn.fetch("SELECT payload FROM bench_actions")
+            best = min(best, time.perf_counter() - started)
+            assert fetched[0]["payload"] == action
+        await conn.close()
+        results[label] = best * 1000
+    compare("round trip", results["stdlib"], results["orjson"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=20000)
+    parser.add_argument("--dsn", help="also time a Postgres round trip under each codec")
+    parser.add_argument("--rows", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    offline(args.runs)
+    if args.dsn:
+        asyncio.run(round_trip(args.dsn, args.rows, args.repeat))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+"""Exercise ProviderGuard against a local mock provider.
+
+Starts a scripted OpenAI-style endpoint on 127.0.0.1 with uvicorn and
+checks Retry-After handling, backoff on 5xx, herd parking on 429s,
+header-driven throttling and the circuit breaker. Exits non-zero if any
+scenario fails. Run from the backend folder:
+
+    python bench/harness_llm_guard.py
+"""
+import asyncio
+import os
+import socket
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import uvicorn  # noqa: E402
+from fastapi import FastAPI  # noqa: E402
+from fastapi.responses import JSONResponse  # noqa: E402
+
+from llm_clients import LLMClientRegistry, ProviderPoolConfig  # noqa: E402
+from llm_guard import CircuitOpenError, ProviderGuard, Quota, RateLimitedError, UpstreamError  # noqa: E402
+
+URL = "/openai/v1/chat/completions"
+OK_BODY = {"choices": [{"message": {"content": "ok"}}], "usage": {"total_tokens": 42}}
+
+
+class MockProvider:
+    """Scripted responses: ``script`` is consumed first, then ``default``; optional window limit."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self, script=None, default=(200, {}), window_limit=None):
+        with self.lock:
+            self.script = list(script or [])
+            self.default = default
+            self.window_limit = window_limit
+            self.window = []
+            self.hits = 0
+            self.rejected = 0
+            self.retry_deadline = 0.0
+            self.issued_at = 0.0
+            self.early = 0
+
+    def respond(self):
+        with self.lock:
+            self.hits += 1
+            if self.window_limit:
+                now = time.monotonic()
+                # a request sent well after a 429 but before its Retry-After ran out
+                if now - self.issued_at > 0.05 and now < self.retry_deadline - 0.01:
+                    self.early += 1
+                self.window = [t for t in self.window if now - t < 1.0]
+                if len(self.window) >= self.window_limit:
+                    self.rejected += 1
+                    retry = 1.0 - (now - self.window[0])
+                    self.issued_at = now
+                    self.retry_deadline = max(self.retry_deadline, now + retry)
+                    return 429, {"retry-after": f"{retry:.3f}"}
+                self.window.append(now)
+            return self.script.pop(0) if self.script else self.default
+
+
+mock = MockProvider()
+app = FastAPI()
+
+
+@app.post(URL)
+async def completions():
+    status, headers = mock.respond()
+    body = OK_BODY if status == 200 else {"error": {"message": f"mock {status}"}}
+    return JSONResponse(body, status_code=status, headers=headers)
+
+
+def start_server() -> str:
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return f"http://127.0.0.1:{port}"
+
+
+def make_guard(base_url: str, **kwargs) -> ProviderGuard:
+    clients = LLMClientRegistry({"mock": ProviderPoolConfig(base_url=base_url, timeout=5.0, http2=False)})
+    defaults = dict(max_retries=3, backoff_base=0.05, backoff_max=0.5, breaker_threshold=3, breaker_reset=0.5)
+    defaults.update(kwargs)
+    return ProviderGuard(clients, **defaults)
+
+
+async def call(guard: ProviderGuard, key: str = "k1"):
+    return await guard.post("mock", key, URL, est_tokens=10, json={"messages": []})
+
+
+async def scenario_retry_after(base_url):
+    mock.reset(script=[(429, {"retry-after": "0.5"}), (429, {"retry-after": "0.5"})])
+    guard = make_guard(base_url)
+    started = time.monotonic()
+    response = await call(guard)
+    elapsed = time.monotonic() - started
+    assert response.status_code == 200, response.status_code
+    assert mock.hits == 3, mock.hits
+    assert elapsed >= 1.0, f"Retry-After not honoured ({elapsed:.2f}s)"
+    return f"3 attempts, {elapsed:.2f}s"
+
+
+async def scenario_retry_after_too_long(base_url):
+    mock.reset(script=[(429, {"retry-after": "120"})])
+    guard = make_guard(base_url, max_retry_after=10)
+    try:
+        await call(guard)
+    except RateLimitedError as e:
+        assert e.retry_after and e.retry_after > 100
+        assert mock.hits == 1
+        return f"gave up immediately, retry_after={e.retry_after:.0f}s"
+    raise AssertionError("expected RateLimitedError")
+
+
+async def scenario_5xx_backoff(base_url):
+    mock.reset(script=[(503, {}), (500, {})])
+    guard = make_guard(base_url)
+    response = await call(guard)
+    assert response.status_code == 200 and mock.hits == 3, (response.status_code, mock.hits)
+    assert guard.breaker("mock").state == "closed"
+    return "recovered after 2 server errors"
+
+
+async def scenario_herd(base_url):
+    # provider allows 5 req/s; 20 callers on one key must all get through
+    mock.reset(window_limit=5)
+    guard = make_guard(base_url, max_retries=6)
+    started = time.monotonic()
+    results = await asyncio.gather(*(call(guard) for _ in range(20)), return_exceptions=True)
+    elapsed = time.monotonic() - started
+    failures = [r for r in results if isinstance(r, Exception)]
+    assert not failures, failures[:3]
+    # once parked, nobody on the key goes back before Retry-After
+    assert mock.early == 0, f"{mock.early} requests ignored Retry-After"
+    return f"20/20 ok in {elapsed:.2f}s, {mock.rejected} provider 429s, 0 early retries"
+
+
+async def scenario_header_throttle(base_url):
+    mock.reset(script=[(200, {"x-ratelimit-remaining-requests": "0", "x-ratelimit-reset-requests": "800ms"})])
+    guard = make_guard(base_url)
+    await call(guard)
+    started = time.monotonic()
+    await call(guard)
+    waited = time.monotonic() - started
+    assert waited >= 0.7, f"did not wait for quota reset ({waited:.2f}s)"
+    assert mock.rejected == 0 and mock.hits == 2
+    return f"waited {waited:.2f}s for the advertised reset, no 429s"
+
+
+async def scenario_configured_quota(base_url):
+    mock.reset()
+    guard = make_guard(base_url, quotas={"mock": Quota(rpm=120)})
+    limiter = guard.limiter("mock", "k1")
+    limiter.requests.tokens = 0  # start from an empty bucket: 2 requests/s
+    started = time.monotonic()
+    for _ in range(3):
+        await call(guard)
+    elapsed = time.monotonic() - started
+    assert 1.2 <= elapsed < 3.0, elapsed
+    return f"3 calls paced over {elapsed:.2f}s at 120 rpm"
+
+
+async def scenario_circuit_breaker(base_url):
+    mock.reset(default=(503, {}))
+    guard = make_guard(base_url, max_retries=1)
+    for _ in range(2):
+        try:
+            await call(guard)
+        except (UpstreamError, CircuitOpenError):
+            pass
+    assert guard.breaker("mock").state == "open", guard.breaker("mock").state
+    hits = mock.hits
+    try:
+        await call(guard)
+        raise AssertionError("expected fast failure")
+    except CircuitOpenError:
+        pass
+    assert mock.hits == hits, "open circuit still hit the provider"
+    mock.reset()
+    await asyncio.sleep(0.6)
+    response = await call(guard)
+    assert response.status_code == 200 and guard.breaker("mock").state == "closed"
+    return "opened after 3 failures, failed fast, closed after a healthy probe"
+
+
+SCENARIOS = [
+    scenario_retry_after,
+    scenario_retry_after_too_long,
+    scenario_5xx_backoff,
+    scenario_herd,
+    scenario_header_throttle,
+    scenario_configured_quota,
+    scenario_circuit_breaker,
+]
+
+
+async def main():
+    base_url = start_server()
+    failed = 0
+    for scenario in SCENARIOS:
+        name = scenario.__name__.replace("scenario_", "")
+        try:
+            detail = await scenario(base_url)
+            print(f"PASS {name}: {detail}")
+        except Exception as e:
+            failed += 1
+            print(f"FAIL {name}: {type(e).__name__}: {e}")
+    return failed
+
+
+if __name__ == "__main__":
+    sys.exit(1 if asyncio.run(main()) else 0)
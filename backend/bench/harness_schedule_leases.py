@@ -0,0 +1,197 @@
+"""Multi-process check that leased scheduling fires each tick exactly once.
+
+Starts ``--nodes`` processes, each running a Scheduler plus a
+ScheduleLeaseManager against the same Postgres, over ``--schedules``
+interval schedules. Every won claim is written to a fires table. Part way
+through, one node is SIGKILLed so its leases have to expire and move.
+The harness then reports duplicate ticks (must be zero), per-schedule fire
+counts and the worst gap between consecutive fires.
+
+It resets the lease tables and writes to ``schedules``, so point it at a
+scratch database. Run from the backend folder:
+
+    DATABASE_URL=postgresql://... python bench/harness_schedule_leases.py --nodes 4 --duration 20
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import signal
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import asyncpg  # noqa: E402
+
+from schedule_leases import CREATE_LEASE_TABLES_SQL, ScheduleLeaseManager, claim_tick, fetch_schedules, partition_sql  # noqa: E402
+from scheduler import Scheduler  # noqa: E402
+
+PREFIX = "lease-harness-"
+
+SETUP_SQL = [
+    """
+    CREATE TABLE IF NOT EXISTS schedules (
+        id TEXT PRIMARY KEY,
+        owner TEXT,
+        cron TEXT,
+        data JSONB,
+        next_run_at TIMESTAMP WITH TIME ZONE,
+        created_at TIMESTAMP WITH TIME ZONE DEFAULT now()
+    );
+    """,
+    "ALTER TABLE schedules ADD COLUMN IF NOT EXISTS next_run_at TIMESTAMP WITH TIME ZONE;",
+    *CREATE_LEASE_TABLES_SQL,
+    """
+    CREATE TABLE IF NOT EXISTS schedule_lease_harness_fires (
+        schedule_id TEXT NOT NULL,
+        due TIMESTAMP WITH TIME ZONE NOT NULL,
+        node TEXT NOT NULL,
+        fired_at TIMESTAMP WITH TIME ZONE DEFAULT now()
+    );
+    """,
+]
+
+
+async def setup(args):
+    conn = await asyncpg.connect(args.dsn)
+    try:
+        for sql in SETUP_SQL:
+            await conn.execute(sql)
+        await conn.execute("DELETE FROM schedules WHERE id LIKE $1", PREFIX + "%")
+        await conn.execute("TRUNCATE schedule_leases, scheduler_nodes, schedule_lease_harness_fires")
+        now = datetime.now(timezone.utc)
+        rows = []
+        for i in range(args.schedules):
+            sid = f"{PREFIX}{i}"
+            record = {"id": sid, "agent_id": f"agent_{i}", "owner": "harness", "interval": args.interval}
+            rows.append((sid, json.dumps(record), now + timedelta(seconds=random.uniform(0, args.interval))))
+        await conn.executemany(
+            f"INSERT INTO schedules (id, owner, data, next_run_at, partition) "
+            f"VALUES ($1, 'harness', $2, $3, {partition_sql('$1', args.partitions)})",
+            rows,
+        )
+    finally:
+        await conn.close()
+
+
+async def node_main(args, index: int):
+    pool = await asyncpg.create_pool(args.dsn, min_size=2, max_size=8)
+    node = f"node-{index}"
+
+    async def fire(record):
+        pass
+
+    async def claim(entry, due):
+        won = await claim_tick(pool, scheduler, entry, due)
+        if won:
+            async with pool.acquire() as conn:
+                await conn.execute(
+                    "INSERT INTO schedule_lease_harness_fires (schedule_id, due, node) VALUES ($1, $2, $3)",
+                    entry.id, datetime.fromtimestamp(due, timezone.utc), node,
+                )
+        return won
+
+    async def on_acquire(partitions):
+        for record in await fetch_schedules(pool, partitions):
+            if record["id"].startswith(PREFIX):
+                scheduler.add(record)
+
+    async def on_release(partitions):
+        for sid, entry in list(scheduler.entries.items()):
+            if entry.record.get("partition") in partitions:
+                scheduler.remove(sid)
+
+    scheduler = Scheduler(fire, claim, max_concurrent=64, min_interval=0.05)
+    await scheduler.start()
+    leases = ScheduleLeaseManager(
+        pool, on_acquire, on_release,
+        partitions=args.partitions, lease_ttl=args.lease_ttl, renew_interval=args.renew, node_id=node,
+    )
+    await leases.start()
+    stop = asyncio.Event()
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stop.set)
+    await stop.wait()
+    await leases.close()
+    await scheduler.close()
+    await pool.close()
+
+
+def run_node(args, index: int):
+    asyncio.run(node_main(args, index))
+
+
+async def report(args, killed: str) -> dict:
+    conn = await asyncpg.connect(args.dsn)
+    try:
+        duplicates = await conn.fetchval(
+            "SELECT count(*) FROM (SELECT 1 FROM schedule_lease_harness_fires GROUP BY schedule_id, due HAVING count(*) > 1) d"
+        )
+        per_schedule = await conn.fetch(
+            "SELECT schedule_id, count(*) AS fires, "
+            "max(gap) AS max_gap FROM ("
+            "  SELECT schedule_id, extract(epoch FROM due - lag(due) OVER (PARTITION BY schedule_id ORDER BY due)) AS gap"
+            "  FROM schedule_lease_harness_fires) g GROUP BY schedule_id"
+        )
+        by_node = await conn.fetch("SELECT node, count(*) AS fires FROM schedule_lease_harness_fires GROUP BY node ORDER BY node")
+        await conn.execute("DELETE FROM schedules WHERE id LIKE $1", PREFIX + "%")
+    finally:
+        await conn.close()
+    fires = sorted(r["fires"] for r in per_schedule)
+    return {
+        "nodes": args.nodes,
+        "schedules": args.schedules,
+        "interval": args.interval,
+        "duration": args.duration,
+        "killed": killed,
+        "duplicate_ticks": duplicates,
+        "schedules_fired": len(per_schedule),
+        "fires_total": sum(fires),
+        "fires_per_schedule": {"min": fires[0] if fires else 0, "median": fires[len(fires) // 2] if fires else 0, "max": fires[-1] if fires else 0},
+        "max_gap_s": round(max((float(r["max_gap"] or 0) for r in per_schedule), default=0.0), 3),
+        "fires_by_node": {r["node"]: r["fires"] for r in by_node},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--dsn", default=os.getenv("DATABASE_URL"))
+    parser.add_argument("--nodes", type=int, default=4)
+    parser.add_argument("--schedules", type=int, default=200)
+    parser.add_argument("--interval", type=float, default=1.0)
+    parser.add_argument("--duration", type=float, default=20.0)
+    parser.add_argument("--kill-after", type=float, default=8.0, help="SIGKILL node-0 after this many seconds (0 = never)")
+    parser.add_argument("--partitions", type=int, default=32)
+    parser.add_argument("--lease-ttl", type=float, default=3.0)
+    parser.add_argument("--renew", type=float, default=1.0)
+    args = parser.parse_args()
+    if not args.dsn:
+        parser.error("--dsn or DATABASE_URL is required")
+
+    asyncio.run(setup(args))
+    ctx = multiprocessing.get_context("spawn")
+    procs = [ctx.Process(target=run_node, args=(args, i)) for i in range(args.nodes)]
+    for p in procs:
+        p.start()
+    started = time.monotonic()
+    killed = None
+    while time.monotonic() - started < args.duration:
+        time.sleep(0.2)
+        if args.kill_after and killed is None and time.monotonic() - started >= args.kill_after:
+            os.kill(procs[0].pid, signal.SIGKILL)
+            killed = "node-0"
+    for p in procs[1:]:
+        p.terminate()
+    for p in procs:
+        p.join(timeout=10)
+
+    result = asyncio.run(report(args, killed))
+    print(json.dumps(result, indent=2))
+    sys.exit(1 if result["duplicate_ticks"] else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""Check that identical concurrent /api/llm/execute calls share one upstream call.
+
+Starts a slow stub provider on 127.0.0.1, points the app at it and fires
+``--requests`` identical requests at ``/api/llm/execute`` concurrently
+(in-process, over ASGI). Exactly one upstream call must be made and every
+request must get the same completion. Also checks SingleFlight's
+cancellation rules: the shared call survives while any waiter is left and
+is cancelled once the last one goes. Exits non-zero on failure. Run from
+the backend folder:
+
+    python bench/harness_single_flight.py --requests 1000
+"""
+import argparse
+import asyncio
+import os
+import socket
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx  # noqa: E402
+import uvicorn  # noqa: E402
+from fastapi import FastAPI  # noqa: E402
+
+from single_flight import SingleFlight  # noqa: E402
+
+URL = "/openai/v1/chat/completions"
+stub = FastAPI()
+upstream_calls = 0
+
+
+@stub.post(URL)
+async def completions():
+    global upstream_calls
+    upstream_calls += 1
+    await asyncio.sleep(0.5)
+    return {"choices": [{"message": {"content": f"stub completion #{upstream_calls}"}}], "usage": {"total_tokens": 12}}
+
+
+def start_stub() -> str:
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    server = uvicorn.Server(uvicorn.Config(stub, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return f"http://127.0.0.1:{port}"
+
+
+async def check_fan_out(requests: int) -> str:
+    import main
+
+    body = {"agent_id": "agent_crypto_trader", "prompt": "What is the BTC outlook?", "provider": "groqcloud"}
+    async with main.app.router.lifespan_context(main.app):
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://app", timeout=60) as client:
+            await client.post("/api/keys/store", json={"provider": "groqcloud", "api_key": "stub"})
+            started = time.monotonic()
+            responses = await asyncio.gather(*(client.post("/api/llm/execute", json=body) for _ in range(requests)))
+            elapsed = time.monotonic() - started
+    statuses = {r.status_code for r in responses}
+    texts = {r.json()["response"] for r in responses if r.status_code == 200}
+    assert statuses == {200}, statuses
+    assert upstream_calls == 1, f"{upstream_calls} upstream calls"
+    assert len(texts) == 1, texts
+    return f"{requests} requests, 1 upstream call, {elapsed:.2f}s, {main.llm_flights.stats()}"
+
+
+async def check_cancellation() -> str:
+    flights = SingleFlight()
+    state = {"started": 0, "cancelled": False}
+
+    async def slow():
+        state["started"] += 1
+        try:
+            await asyncio.sleep(0.3)
+            return "done"
+        except asyncio.CancelledError:
+            state["cancelled"] = True
+            raise
+
+    waiters = [asyncio.create_task(flights.do("k", slow)) for _ in range(10)]
+    await asyncio.sleep(0.05)
+    for task in waiters[:-1]:
+        task.cancel()
+    assert await waiters[-1] == "done" and not state["cancelled"], "shared call died with a waiter still attached"
+
+    waiters = [asyncio.create_task(flights.do("k", slow)) for _ in range(10)]
+    await asyncio.sleep(0.05)
+    for task in waiters:
+        task.cancel()
+    await asyncio.gather(*waiters, return_exceptions=True)
+    await asyncio.sleep(0)
+    assert state["cancelled"], "shared call kept running with no waiters"
+    assert state["started"] == 2 and flights.stats()["in_flight"] == 0, (state, flights.stats())
+    return "survives partial cancellation, cancelled with the last waiter"
+
+
+async def run(args) -> int:
+    failed = 0
+    for name, check in (("cancellation", check_cancellation), ("fan_out", lambda: check_fan_out(args.requests))):
+        try:
+            print(f"PASS {name}: {await check()}")
+        except Exception as e:
+            failed += 1
+            print(f"FAIL {name}: {type(e).__name__}: {e}")
+    return failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=1000)
+    args = parser.parse_args()
+    os.environ["GROQCLOUD_BASE_URL"] = start_stub()
+    sys.exit(1 if asyncio.run(run(args)) else 0)
+
+
+if __name__ == "__main__":
+    main()
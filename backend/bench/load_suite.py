@@ -0,0 +1,335 @@
+"""End-to-end load benchmark for the FastAPI backend.
+
+Runs the app in-process (ASGI, no sockets) with the offline ``local`` LLM
+provider and the simulated chain, then drives a weighted mix of traffic
+from ``--concurrency`` virtual users for ``--duration`` seconds:
+
+    register agent, run agent, LLM execute, list actions, agent analytics,
+    marketplace browse/purchase, scheduler set/list
+
+Reports throughput, p50/p95/p99 latency and errors per endpoint, then a
+separate sequential pass under tracemalloc for per-request allocations
+(kept out of the timed pass so tracing doesn't skew latency).
+
+``--save`` writes the report as JSON; ``--baseline`` compares against a
+saved report and exits non-zero if any endpoint's p95 or throughput
+regressed past ``--threshold``. Baselines are machine specific: record
+one per machine/CI runner. Run from the backend folder:
+
+    python bench/load_suite.py --duration 20 --save bench/baselines/local.json
+    python bench/load_suite.py --duration 20 --baseline bench/baselines/local.json
+
+``--dsn`` sets DATABASE_URL for the app (stores are in-memory otherwise);
+the report's ``store`` field says which one was actually used. Stub
+latencies come from the usual settings (LOCAL_LLM_*, CHAIN_*), defaulted
+here to small values.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx  # noqa: E402
+
+Request = Tuple[str, str, str, Optional[Dict[str, Any]]]  # (label, method, url, json)
+
+
+class Context:
+    """Ids created during the run that later requests pick from."""
+
+    def __init__(self, rng: random.Random):
+        self.rng = rng
+        self.agents: List[str] = []
+        self.listings: List[str] = []
+        self.created = 0
+
+    def agent(self) -> str:
+        return self.rng.choice(self.agents)
+
+
+def op_register(ctx: Context) -> Request:
+    ctx.created += 1
+    body = {
+        "name": f"Bench Agent {ctx.created}",
+        "description": "load test agent",
+        "personality": "terse",
+        "capabilities": ["analysis"],
+        "visibility": "public",
+    }
+    return "POST /agents/register", "POST", "/agents/register", body
+
+
+def op_run(ctx: Context) -> Request:
+    body = {"provider": "local", "prompt": f"status check {ctx.rng.randrange(50)}"}
+    return "POST /agents/{id}/run", "POST", f"/agents/{ctx.agent()}/run", body
+
+
+def op_execute(ctx: Context) -> Request:
+    body = {"agent_id": ctx.agent(), "prompt": f"summarise {ctx.rng.randrange(50)}", "provider": "local"}
+    return "POST /api/llm/execute", "POST", "/api/llm/execute", body
+
+
+def op_actions(ctx: Context) -> Request:
+    return "GET /agents/{id}/actions", "GET", f"/agents/{ctx.agent()}/actions?limit=20", None
+
+
+def op_analytics(ctx: Context) -> Request:
+    return "GET /analytics/agent/{id}", "GET", f"/analytics/agent/{ctx.agent()}", None
+
+
+def op_marketplace(ctx: Context) -> Request:
+    return "GET /api/marketplace/agents", "GET", "/api/marketplace/agents", None
+
+
+def op_purchase(ctx: Context) -> Request:
+    listing = ctx.rng.choice(ctx.listings)
+    return "POST /marketplace/{id}/purchase", "POST", f"/marketplace/{listing}/purchase", None
+
+
+def op_schedule_set(ctx: Context) -> Request:
+    # long interval: measures schedule churn, not scheduled runs
+    body = {"agent_id": ctx.agent(), "interval": 3600 + ctx.rng.randrange(3600)}
+    return "POST /scheduler/set", "POST", "/scheduler/set", body
+
+
+def op_schedule_list(ctx: Context) -> Request:
+    return "GET /scheduler/{agent_id}", "GET", f"/scheduler/{ctx.agent()}", None
+
+
+MIX: List[Tuple[Callable[[Context], Request], int]] = [
+    (op_run, 25),
+    (op_execute, 10),
+    (op_actions, 20),
+    (op_analytics, 15),
+    (op_marketplace, 10),
+    (op_purchase, 5),
+    (op_register, 5),
+    (op_schedule_set, 5),
+    (op_schedule_list, 5),
+]
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(q / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+async def send(client: httpx.AsyncClient, request: Request, user: str) -> httpx.Response:
+    _, method, url, body = request
+    return await client.request(method, url, json=body, headers={"Authorization": f"Bearer {user}"})
+
+
+async def setup(client: httpx.AsyncClient, ctx: Context, agents: int, pool=None):
+    for _ in range(agents):
+        response = await send(client, op_register(ctx), "bench-owner")
+        response.raise_for_status()
+        ctx.agents.append(response.json()["agent_id"])
+    if pool:
+        # the demo listings only exist in memory; give Postgres some to buy
+        async with pool.acquire() as conn:
+            await conn.executemany(
+                "INSERT INTO listings (id, seller, data) VALUES ($1, $2, $3) ON CONFLICT (id) DO NOTHING",
+                [(agent_id, "bench-owner", {"agent_id": agent_id, "price": 10}) for agent_id in ctx.agents[:5]],
+            )
+        ctx.listings.extend(ctx.agents[:5])
+        return
+    # listings share their agent's id; the demo user's agents are the listed ones
+    response = await client.get("/api/agents")
+    response.raise_for_status()
+    for agent in response.json()["agents"]:
+        if (await client.get(f"/api/marketplace/{agent['id']}")).status_code == 200:
+            ctx.listings.append(agent["id"])
+    if not ctx.listings:
+        raise RuntimeError("no marketplace listings to purchase")
+
+
+async def load_pass(client: httpx.AsyncClient, ctx: Context, args) -> Dict[str, Dict[str, Any]]:
+    ops, weights = zip(*MIX)
+    latencies: Dict[str, List[float]] = defaultdict(list)
+    errors: Dict[str, int] = defaultdict(int)
+    deadline = time.monotonic() + args.duration
+
+    async def user(index: int):
+        rng = random.Random(args.seed * 1000 + index)
+        while time.monotonic() < deadline:
+            request = rng.choices(ops, weights)[0](ctx)
+            started = time.perf_counter()
+            try:
+                response = await send(client, request, f"bench-user-{index}")
+                failed = response.status_code >= 400
+            except Exception:
+                failed = True
+            latencies[request[0]].append((time.perf_counter() - started) * 1000)
+            if failed:
+                errors[request[0]] += 1
+
+    started = time.monotonic()
+    await asyncio.gather(*(user(i) for i in range(args.concurrency)))
+    elapsed = time.monotonic() - started
+    results = {}
+    for label, values in sorted(latencies.items()):
+        values.sort()
+        results[label] = {
+            "count": len(values),
+            "errors": errors[label],
+            "rps": round(len(values) / elapsed, 2),
+            "p50_ms": round(percentile(values, 50), 3),
+            "p95_ms": round(percentile(values, 95), 3),
+            "p99_ms": round(percentile(values, 99), 3),
+            "max_ms": round(values[-1], 3),
+        }
+    return results
+
+
+async def allocation_pass(client: httpx.AsyncClient, ctx: Context, samples: int) -> Dict[str, Dict[str, float]]:
+    """Mean traced allocation per request: peak growth and what is still held afterwards."""
+    results = {}
+    tracemalloc.start()
+    try:
+        for op, _ in MIX:
+            peaks, retained = [], []
+            for _ in range(samples):
+                request = op(ctx)
+                before = tracemalloc.get_traced_memory()[0]
+                tracemalloc.reset_peak()
+                await send(client, request, "bench-alloc")
+                current, peak = tracemalloc.get_traced_memory()
+                peaks.append(peak - before)
+                retained.append(current - before)
+            results[request[0]] = {
+                "alloc_peak_kib": round(sum(peaks) / len(peaks) / 1024, 2),
+                "alloc_retained_kib": round(sum(retained) / len(retained) / 1024, 2),
+            }
+    finally:
+        tracemalloc.stop()
+    return results
+
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any], threshold: float, min_delta_ms: float) -> List[str]:
+    """Endpoints whose p95 grew or throughput fell by more than ``threshold``."""
+    regressions = []
+    for label, old in baseline.get("endpoints", {}).items():
+        new = report["endpoints"].get(label)
+        if new is None:
+            regressions.append(f"{label}: missing from this run")
+            continue
+        if new["p95_ms"] > old["p95_ms"] * (1 + threshold) and new["p95_ms"] - old["p95_ms"] >= min_delta_ms:
+            regressions.append(f"{label}: p95 {old['p95_ms']}ms -> {new['p95_ms']}ms")
+        if old["rps"] and new["rps"] < old["rps"] * (1 - threshold):
+            regressions.append(f"{label}: throughput {old['rps']} -> {new['rps']} req/s")
+        if new["errors"] > old["errors"]:
+            regressions.append(f"{label}: errors {old['errors']} -> {new['errors']}")
+    return regressions
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL, text=True).strip()
+    except Exception:
+        return None
+
+
+async def run(args) -> Dict[str, Any]:
+    import main
+
+    ctx = Context(random.Random(args.seed))
+    async with main.app.router.lifespan_context(main.app):
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+            await setup(client, ctx, args.agents, main.db_pool)
+            for _ in range(args.warmup):
+                await send(client, op_run(ctx), "bench-warmup")
+            endpoints = await load_pass(client, ctx, args)
+            if args.alloc_samples:
+                for label, alloc in (await allocation_pass(client, ctx, args.alloc_samples)).items():
+                    endpoints.setdefault(label, {}).update(alloc)
+            store = "postgres" if main.db_pool else "memory"
+    total = sum(e.get("count", 0) for e in endpoints.values())
+    return {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "git": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "store": store,
+            "concurrency": args.concurrency,
+            "duration": args.duration,
+            "agents": args.agents,
+            "seed": args.seed,
+            "total_requests": total,
+            "total_rps": round(total / args.duration, 2),
+        },
+        "endpoints": endpoints,
+    }
+
+
+def print_table(report: Dict[str, Any]):
+    print(f"{'endpoint':34} {'count':>7} {'err':>5} {'rps':>9} {'p50':>8} {'p95':>8} {'p99':>8} {'peakKiB':>8}")
+    for label, e in report["endpoints"].items():
+        print(
+            f"{label:34} {e.get('count', 0):>7} {e.get('errors', 0):>5} {e.get('rps', 0):>9} "
+            f"{e.get('p50_ms', 0):>8} {e.get('p95_ms', 0):>8} {e.get('p99_ms', 0):>8} {e.get('alloc_peak_kib', '-'):>8}"
+        )
+    meta = report["meta"]
+    print(f"store={meta['store']} total={meta['total_requests']} requests, {meta['total_rps']} req/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--duration", type=float, default=15.0)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--agents", type=int, default=20, help="agents registered before the timed pass")
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--alloc-samples", type=int, default=20, help="requests per endpoint in the allocation pass (0 = skip)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--dsn", help="run against Postgres (sets DATABASE_URL)")
+    parser.add_argument("--save", help="write the report JSON here")
+    parser.add_argument("--baseline", help="compare with a saved report")
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed relative regression")
+    parser.add_argument("--min-delta-ms", type=float, default=1.0, help="ignore p95 changes smaller than this")
+    args = parser.parse_args()
+
+    if args.dsn:
+        os.environ["DATABASE_URL"] = args.dsn
+    for name, value in {
+        "LOCAL_LLM_LATENCY_MS": "20",
+        "LOCAL_LLM_TOKENS_PER_SEC": "0",
+        "CHAIN_LATENCY_MEAN": "0.05",
+        "CHAIN_BLOCK_TIME": "0.5",
+        "CHAIN_SEED": str(args.seed),
+        "RUN_PER_USER": str(max(4, args.concurrency)),
+    }.items():
+        os.environ.setdefault(name, value)
+
+    report = asyncio.run(run(args))
+    print_table(report)
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save)), exist_ok=True)
+        with open(args.save, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"saved {args.save}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.threshold, args.min_delta_ms)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            sys.exit(1)
+        print(f"no regressions against {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
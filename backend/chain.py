@@ -0,0 +1,255 @@
+"""Starknet transaction submitters.
+
+Endpoints hand calls to a ``ChainSubmitter`` and get a ``PendingTx`` back
+straight away; the receipt resolves in the background, so request latency
+does not depend on block time. ``SimulatedChain`` is the in-process default;
+a starknet-py backend can implement the same interface.
+"""
+import asyncio
+import hashlib
+import inspect
+import json
+import logging
+import os
+import random
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from dataclasses import asdict, dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Union
+
+logger = logging.getLogger(__name__)
+
+EXPLORER_TX_URL = "https://sepolia.starkscan.co/tx/{}"
+# receipt statuses meaning the transaction executed; anything else (REVERTED, REJECTED) did not
+ACCEPTED_STATUSES = ("ACCEPTED_ON_L2", "ACCEPTED_ON_L1")
+
+ReceiptCallback = Callable[["TxReceipt"], Union[None, Awaitable[None]]]
+
+
+@dataclass
+class TxReceipt:
+    transaction_hash: str
+    contract_address: str
+    function: str
+    status: str
+    block_number: Optional[int]
+    submitted_at: float
+    accepted_at: Optional[float] = None
+    error: Optional[str] = None
+
+    @property
+    def accepted(self) -> bool:
+        return self.status in ACCEPTED_STATUSES
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = asdict(self)
+        data["explorer_url"] = EXPLORER_TX_URL.format(self.transaction_hash)
+        return data
+
+
+class PendingTx:
+    """Handle to a submitted transaction whose receipt may not exist yet."""
+
+    def __init__(self, tx_hash: str, contract_address: str, function: str):
+        self.tx_hash = tx_hash
+        self.contract_address = contract_address
+        self.function = function
+        self.submitted_at = time.time()
+        self._future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self._callbacks: List[ReceiptCallback] = []
+        # callbacks registered after resolution run as tasks; held here so they aren't collected mid-run
+        self._late_callbacks: Set[asyncio.Task] = set()
+
+    @property
+    def done(self) -> bool:
+        return self._future.done()
+
+    @property
+    def receipt(self) -> Optional[TxReceipt]:
+        if self._future.done() and not self._future.cancelled():
+            return self._future.result()
+        return None
+
+    def on_receipt(self, callback: ReceiptCallback):
+        """Run ``callback`` (sync or async) once the receipt is available, or right away if it already is."""
+        receipt = self.receipt
+        if receipt is None:
+            self._callbacks.append(callback)
+            return
+        task = asyncio.get_running_loop().create_task(self._run_callback(callback, receipt))
+        self._late_callbacks.add(task)
+        task.add_done_callback(self._late_callbacks.discard)
+
+    async def _run_callback(self, callback: ReceiptCallback, receipt: TxReceipt):
+        try:
+            result = callback(receipt)
+            if inspect.isawaitable(result):
+                await result
+        except Exception:
+            logger.exception("receipt callback failed for %s", self.tx_hash)
+
+    async def wait(self, timeout: Optional[float] = None) -> TxReceipt:
+        return await asyncio.wait_for(asyncio.shield(self._future), timeout)
+
+    async def resolve(self, receipt: TxReceipt):
+        if self._future.done():
+            return
+        self._future.set_result(receipt)
+        callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            await self._run_callback(callback, receipt)
+
+    def to_dict(self) -> Dict[str, Any]:
+        receipt = self.receipt
+        if receipt is not None:
+            return receipt.to_dict()
+        return {
+            "transaction_hash": self.tx_hash,
+            "contract_address": self.contract_address,
+            "function": self.function,
+            "status": "PENDING",
+            "block_number": None,
+            "submitted_at": self.submitted_at,
+            "explorer_url": EXPLORER_TX_URL.format(self.tx_hash),
+        }
+
+
+class ChainSubmitter(ABC):
+    """Interface for anything that can submit contract calls."""
+
+    @abstractmethod
+    async def submit(self, contract_address: str, function: str, calldata: Dict[str, Any]) -> PendingTx:
+        """Send a transaction and return its handle without waiting for inclusion."""
+
+    @abstractmethod
+    def get(self, tx_hash: str) -> Optional[PendingTx]:
+        """Look up a previously submitted transaction."""
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+
+class SimulatedChain(ChainSubmitter):
+    """In-process stand-in for Starknet with a block clock and receipts.
+
+    Each transaction spends a sampled network latency in the mempool and is
+    then included in the next block boundary that still has room (blocks
+    hold at most ``block_capacity`` transactions; ``None`` is unbounded).
+    ``latency_dist`` is one of ``fixed``, ``uniform`` or ``lognormal``
+    around ``latency_mean`` seconds.
+    """
+
+    def __init__(
+        self,
+        block_time: float = 2.0,
+        latency_mean: float = 0.3,
+        latency_jitter: float = 0.1,
+        latency_dist: str = "lognormal",
+        start_block: int = 500000,
+        block_capacity: Optional[int] = None,
+        max_receipts: int = 10000,
+        seed: Optional[int] = None,
+    ):
+        if latency_dist not in ("fixed", "uniform", "lognormal"):
+            raise ValueError(f"Unknown latency distribution: {latency_dist}")
+        self.block_time = block_time
+        self.latency_mean = latency_mean
+        self.latency_jitter = latency_jitter
+        self.latency_dist = latency_dist
+        self.start_block = start_block
+        self.block_capacity = block_capacity
+        self.max_receipts = max_receipts
+        self.genesis = time.time()
+        self._rng = random.Random(seed)
+        self._txs: "OrderedDict[str, PendingTx]" = OrderedDict()
+        self._tasks: set = set()
+        self._nonce = 0
+        self._block_fill: Dict[int, int] = {}
+
+    @property
+    def block_number(self) -> int:
+        """Current head of the simulated chain."""
+        if self.block_time <= 0:
+            return self.start_block
+        return self.start_block + int((time.time() - self.genesis) / self.block_time)
+
+    def sample_latency(self) -> float:
+        if self.latency_dist == "fixed":
+            return self.latency_mean
+        if self.latency_dist == "uniform":
+            return max(0.0, self._rng.uniform(self.latency_mean - self.latency_jitter, self.latency_mean + self.latency_jitter))
+        if self.latency_mean <= 0:
+            return 0.0
+        # lognormal with the requested mean; jitter is the relative spread
+        sigma = self.latency_jitter / self.latency_mean
+        mu = -0.5 * sigma * sigma
+        return self.latency_mean * self._rng.lognormvariate(mu, sigma)
+
+    def _tx_hash(self, function: str, calldata: Dict[str, Any]) -> str:
+        self._nonce += 1
+        data = f"{function}{json.dumps(calldata, sort_keys=True, default=str)}{self._nonce}{time.time()}"
+        return "0x" + hashlib.sha256(data.encode()).hexdigest()
+
+    async def submit(self, contract_address: str, function: str, calldata: Dict[str, Any]) -> PendingTx:
+        pending = PendingTx(self._tx_hash(function, calldata), contract_address, function)
+        self._txs[pending.tx_hash] = pending
+        while len(self._txs) > self.max_receipts:
+            self._txs.popitem(last=False)
+        task = asyncio.create_task(self._include(pending))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return pending
+
+    async def _include(self, pending: PendingTx):
+        await asyncio.sleep(self.sample_latency())
+        block = self.block_number + 1 if self.block_time > 0 else self.start_block
+        if self.block_capacity:
+            while self._block_fill.get(block, 0) >= self.block_capacity:
+                block += 1
+            self._block_fill[block] = self._block_fill.get(block, 0) + 1
+            for old in [b for b in self._block_fill if b < block - 16]:
+                del self._block_fill[old]
+        if self.block_time > 0:
+            # wait for the chosen block to be produced
+            produced_at = self.genesis + (block - self.start_block) * self.block_time
+            await asyncio.sleep(max(0.0, produced_at - time.time()))
+        receipt = TxReceipt(
+            transaction_hash=pending.tx_hash,
+            contract_address=pending.contract_address,
+            function=pending.function,
+            status="ACCEPTED_ON_L2",
+            block_number=block,
+            submitted_at=pending.submitted_at,
+            accepted_at=time.time(),
+        )
+        await pending.resolve(receipt)
+
+    def get(self, tx_hash: str) -> Optional[PendingTx]:
+        return self._txs.get(tx_hash)
+
+    async def close(self):
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def create_submitter() -> ChainSubmitter:
+    """Build the submitter selected by ``CHAIN_BACKEND`` (default ``simulated``)."""
+    backend = os.getenv("CHAIN_BACKEND", "simulated").lower()
+    if backend == "simulated":
+        seed = os.getenv("CHAIN_SEED")
+        capacity = os.getenv("CHAIN_BLOCK_CAPACITY")
+        return SimulatedChain(
+            block_time=float(os.getenv("CHAIN_BLOCK_TIME", "2.0")),
+            latency_mean=float(os.getenv("CHAIN_LATENCY_MEAN", "0.3")),
+            latency_jitter=float(os.getenv("CHAIN_LATENCY_JITTER", "0.1")),
+            latency_dist=os.getenv("CHAIN_LATENCY_DIST", "lognormal"),
+            block_capacity=int(capacity) if capacity else None,
+            seed=int(seed) if seed else None,
+        )
+    raise ValueError(f"Unsupported CHAIN_BACKEND: {backend}")
@@ -0,0 +1,155 @@
+"""Postgres data access for the agent run path.
+
+``run_agent_action`` used to check out a pool connection for each lookup
+and each INSERT. ``AgentRunStore`` loads the agent and the caller's
+encrypted key in one query and writes the action, proof and event rows in
+a single statement, with per-query timings to confirm the saving. Both
+statements take bind parameters, so asyncpg prepares them once per
+connection and reuses them from its statement cache.
+"""
+import time
+from contextlib import asynccontextmanager
+from typing import Any, Dict, Optional, Tuple
+
+from agent_rows import CACHED_DOCUMENT_SQL
+
+
+class QueryTimings:
+    """Count / total / max wall time per named query."""
+
+    def __init__(self):
+        self._stats: Dict[str, Dict[str, float]] = {}
+
+    @asynccontextmanager
+    async def measure(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started)
+
+    def observe(self, name: str, seconds: float):
+        stat = self._stats.setdefault(name, {"count": 0, "total": 0.0, "max": 0.0})
+        stat["count"] += 1
+        stat["total"] += seconds
+        stat["max"] = max(stat["max"], seconds)
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        return {
+            name: {
+                "count": int(s["count"]),
+                "avg_ms": round(s["total"] / s["count"] * 1000, 3) if s["count"] else 0.0,
+                "max_ms": round(s["max"] * 1000, 3),
+                "total_ms": round(s["total"] * 1000, 3),
+            }
+            for name, s in self._stats.items()
+        }
+
+
+# Agent row plus the caller's key for the requested provider, in one round trip.
+LOAD_AGENT_AND_KEY_SQL = f"""
+SELECT a.{CACHED_DOCUMENT_SQL} AS data, a.version, k.encrypted_key
+FROM agent_documents a
+LEFT JOIN api_keys k ON k.user_id = $2 AND k.provider = $3
+WHERE a.id = $1
+"""
+
+# Action, proof and event written atomically by one statement (one round trip).
+RECORD_RUN_SQL = """
+WITH ins_action AS (
+    INSERT INTO actions (agent_id, user_id, action_type, payload)
+    VALUES ($1, $2, $3, $4)
+    RETURNING id
+), ins_proof AS (
+    INSERT INTO proofs (proof_hash, agent_id, action_payload_hash, proof)
+    VALUES ($5, $1, $6, $7)
+    ON CONFLICT (proof_hash) DO NOTHING
+)
+INSERT INTO events (type, payload) VALUES ('action', $8)
+"""
+
+# Columns recording that a proof's Merkle batch root was accepted on chain.
+PROOF_VERIFICATION_SQL = [
+    "ALTER TABLE proofs ADD COLUMN IF NOT EXISTS verified BOOLEAN NOT NULL DEFAULT false;",
+    "ALTER TABLE proofs ADD COLUMN IF NOT EXISTS tx_hash TEXT;",
+    "ALTER TABLE proofs ADD COLUMN IF NOT EXISTS block_number BIGINT;",
+    "ALTER TABLE proofs ADD COLUMN IF NOT EXISTS batch_id TEXT;",
+    "ALTER TABLE proofs ADD COLUMN IF NOT EXISTS verified_at TIMESTAMP WITH TIME ZONE;",
+]
+
+MARK_PROOF_VERIFIED_SQL = """
+UPDATE proofs
+SET verified = true, tx_hash = $2, block_number = $3, batch_id = $4, verified_at = now()
+WHERE proof_hash = $1
+"""
+
+
+class AgentRunStore:
+    """Agent run reads/writes; writes go through ``write_buffer`` when one is given."""
+
+    def __init__(self, pool, timings: Optional[QueryTimings] = None, write_buffer=None):
+        self.pool = pool
+        self.timings = timings or QueryTimings()
+        self.write_buffer = write_buffer
+
+    async def load_agent_and_key(self, agent_id: str, user_id: str, provider: str) -> Tuple[Optional[Dict[str, Any]], int, Optional[str]]:
+        """Return ``(agent_data, row version, encrypted_key)``; agent is None if it doesn't exist."""
+        async with self.timings.measure("load_agent_and_key"):
+            async with self.pool.acquire() as conn:
+                row = await conn.fetchrow(LOAD_AGENT_AND_KEY_SQL, agent_id, user_id, provider)
+        if row is None:
+            return None, 0, None
+        return row["data"], row["version"], row["encrypted_key"]
+
+    @staticmethod
+    def _run_args(action: Dict[str, Any], proof: Dict[str, Any]) -> tuple:
+        return (
+            action["agent_id"],
+            action["user_id"],
+            action["payload"].get("action_type", "run"),
+            action,
+            proof["proof_hash"],
+            proof["action_payload_hash"],
+            proof,
+            {"action_id": action["id"], "agent_id": action["agent_id"]},
+        )
+
+    async def record_run(self, action: Dict[str, Any], proof: Dict[str, Any]):
+        """Persist one run's action, proof and event rows atomically."""
+        if self.write_buffer:
+            async with self.timings.measure("record_run_buffered"):
+                # three journal lines, one fsync
+                await self.write_buffer.put_many([
+                    ("actions", {
+                        "agent_id": action["agent_id"],
+                        "user_id": action["user_id"],
+                        "action_type": action["payload"].get("action_type", "run"),
+                        "payload": action,
+                    }),
+                    ("proofs", {
+                        "proof_hash": proof["proof_hash"],
+                        "agent_id": action["agent_id"],
+                        "action_payload_hash": proof["action_payload_hash"],
+                        "proof": proof,
+                    }),
+                    ("events", {
+                        "type": "action",
+                        "payload": {"action_id": action["id"], "agent_id": action["agent_id"]},
+                    }),
+                ])
+            return
+        async with self.timings.measure("record_run"):
+            async with self.pool.acquire() as conn:
+                await conn.execute(RECORD_RUN_SQL, *self._run_args(action, proof))
+
+    async def mark_proof_verified(self, proof_hash: str, tx_hash: str, block_number: Optional[int], batch_id: Optional[str]) -> bool:
+        """Record an accepted batch root on the proof row; False if the row doesn't exist."""
+        async with self.timings.measure("mark_proof_verified"):
+            async with self.pool.acquire() as conn:
+                status = await conn.execute(MARK_PROOF_VERIFIED_SQL, proof_hash, tx_hash, block_number, batch_id)
+            if status == "UPDATE 0" and self.write_buffer:
+                # the row may still be waiting in the write-behind journal
+                await self.write_buffer.flush()
+                async with self.pool.acquire() as conn:
+                    status = await conn.execute(MARK_PROOF_VERIFIED_SQL, proof_hash, tx_hash, block_number, batch_id)
+        return status != "UPDATE 0"
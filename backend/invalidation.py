@@ -0,0 +1,114 @@
+"""Cross-worker cache invalidation over Postgres LISTEN/NOTIFY.
+
+Each uvicorn worker keeps its own in-process caches; when one worker writes,
+it publishes the affected key on a channel and every worker (itself
+included) drops its local copy.
+
+If the LISTEN connection drops (server restart, failover, idle-connection
+reaper) it is re-acquired with exponential backoff. Messages published
+while it was down are lost, so ``on_reconnect`` runs after every reconnect
+for the caller to resynchronise (typically by clearing its cache).
+"""
+import asyncio
+import inspect
+import logging
+import random
+from typing import Any, Awaitable, Callable, Dict, Optional, Union
+
+from serialization import dumps, loads
+
+logger = logging.getLogger(__name__)
+
+
+class PgNotifyChannel:
+    """Publish/subscribe JSON messages on one Postgres NOTIFY channel."""
+
+    def __init__(self, pool, channel: str, reconnect_base: float = 0.5, reconnect_max: float = 30.0):
+        self.pool = pool
+        self.channel = channel
+        self.reconnect_base = reconnect_base
+        self.reconnect_max = reconnect_max
+        self.reconnects = 0
+        self._conn = None
+        self._handler: Optional[Callable[[Dict[str, Any]], None]] = None
+        self._on_reconnect: Optional[Callable[[], Union[None, Awaitable[None]]]] = None
+        self._reconnect_task: Optional[asyncio.Task] = None
+        self._closing = False
+
+    async def start(
+        self,
+        handler: Callable[[Dict[str, Any]], None],
+        on_reconnect: Optional[Callable[[], Union[None, Awaitable[None]]]] = None,
+    ):
+        """Hold a dedicated connection that LISTENs and dispatches to ``handler``."""
+        self._handler = handler
+        self._on_reconnect = on_reconnect
+        self._closing = False
+        await self._listen()
+
+    async def _listen(self):
+        conn = await self.pool.acquire()
+        try:
+            await conn.add_listener(self.channel, self._on_notify)
+            conn.add_termination_listener(self._on_terminated)
+        except BaseException:
+            await self.pool.release(conn)
+            raise
+        self._conn = conn
+
+    def _on_terminated(self, connection):
+        if self._closing or connection is not self._conn:
+            return
+        logger.warning("LISTEN connection for %s lost; reconnecting", self.channel)
+        self._conn = None
+        self._reconnect_task = asyncio.get_running_loop().create_task(self._reconnect(connection))
+
+    async def _reconnect(self, lost):
+        try:
+            await self.pool.release(lost)
+        except Exception:
+            logger.debug("releasing dead LISTEN connection for %s failed", self.channel, exc_info=True)
+        delay = self.reconnect_base
+        while not self._closing:
+            try:
+                await self._listen()
+            except Exception as exc:
+                logger.warning("LISTEN reconnect for %s failed (%s); retrying in %.1fs", self.channel, exc, delay)
+                # jittered so workers that lost the server together don't reconnect in lockstep
+                await asyncio.sleep(delay * random.uniform(0.5, 1.0))
+                delay = min(delay * 2, self.reconnect_max)
+                continue
+            self.reconnects += 1
+            logger.info("LISTEN connection for %s restored", self.channel)
+            if self._on_reconnect is not None:
+                try:
+                    result = self._on_reconnect()
+                    if inspect.isawaitable(result):
+                        await result
+                except Exception:
+                    logger.exception("on_reconnect for %s failed", self.channel)
+            return
+
+    def _on_notify(self, connection, pid, channel, payload):
+        try:
+            self._handler(loads(payload))
+        except Exception:
+            logger.exception("bad invalidation message on %s: %r", channel, payload)
+
+    async def publish(self, message: Dict[str, Any]):
+        async with self.pool.acquire() as conn:
+            await conn.execute("SELECT pg_notify($1, $2)", self.channel, dumps(message))
+
+    async def close(self):
+        self._closing = True
+        if self._reconnect_task is not None:
+            self._reconnect_task.cancel()
+            await asyncio.gather(self._reconnect_task, return_exceptions=True)
+            self._reconnect_task = None
+        if self._conn is not None:
+            try:
+                self._conn.remove_termination_listener(self._on_terminated)
+                await self._conn.remove_listener(self.channel, self._on_notify)
+            finally:
+                await self.pool.release(self._conn)
+                self._conn = None
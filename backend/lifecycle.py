@@ -0,0 +1,69 @@
+"""Ordered startup and shutdown of the app's background components.
+
+Each ``step`` starts a component, records how long it took and remembers
+how to stop it. ``drain`` stops components in reverse start order, so
+producers (scheduler, run engine) stop before the things they write to
+(write-behind buffer, rollups, pool) are flushed and closed. Every stop
+gets ``drain_timeout`` seconds; a stop that fails or hangs is logged and
+the drain carries on, so one stuck component can't keep the rest from
+flushing.
+"""
+import asyncio
+import inspect
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+Hook = Callable[[], Union[Awaitable[Any], Any]]
+
+
+async def _call(hook: Hook) -> Any:
+    result = hook()
+    if inspect.isawaitable(result):
+        result = await result
+    return result
+
+
+class Lifecycle:
+    def __init__(self, drain_timeout: float = 30.0):
+        self.drain_timeout = drain_timeout
+        self.startup_ms: Dict[str, float] = {}
+        self.shutdown_ms: Dict[str, float] = {}
+        self.ready = False
+        self._stops: List[Tuple[str, Hook]] = []
+        self._started = 0.0
+
+    async def step(self, name: str, start: Optional[Hook] = None, stop: Optional[Hook] = None) -> Any:
+        """Run ``start`` (timed as ``name``) and register ``stop`` for the drain."""
+        if not self._started:
+            self._started = time.perf_counter()
+        began = time.perf_counter()
+        result = await _call(start) if start else None
+        self.startup_ms[name] = round((time.perf_counter() - began) * 1000, 3)
+        if stop:
+            self._stops.append((name, stop))
+        return result
+
+    def mark_ready(self):
+        self.startup_ms["total"] = round((time.perf_counter() - self._started) * 1000, 3)
+        self.ready = True
+
+    async def drain(self):
+        self.ready = False
+        began = time.perf_counter()
+        while self._stops:
+            name, stop = self._stops.pop()
+            started = time.perf_counter()
+            try:
+                await asyncio.wait_for(_call(stop), self.drain_timeout)
+            except asyncio.TimeoutError:
+                logger.error("shutdown of %s timed out after %.0fs", name, self.drain_timeout)
+            except Exception:
+                logger.exception("shutdown of %s failed", name)
+            self.shutdown_ms[name] = round((time.perf_counter() - started) * 1000, 3)
+        self.shutdown_ms["total"] = round((time.perf_counter() - began) * 1000, 3)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"ready": self.ready, "startup_ms": self.startup_ms, "shutdown_ms": self.shutdown_ms}
@@ -0,0 +1,221 @@
+"""Process-wide pooled HTTP clients for LLM providers.
+
+One keep-alive ``httpx.AsyncClient`` is kept per provider so repeated calls
+reuse TCP/TLS connections (and multiplex over HTTP/2 when ``h2`` is
+installed) instead of paying a fresh handshake on every request.
+"""
+import importlib.util
+import os
+import time
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Callable, Dict, Optional
+
+import httpx
+
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+
+@dataclass
+class ProviderPoolConfig:
+    """Connection pool and timeout settings for a single provider."""
+    base_url: str
+    timeout: float = 30.0
+    connect_timeout: float = 5.0
+    max_connections: int = 100
+    max_keepalive_connections: int = 20
+    keepalive_expiry: float = 30.0
+    http2: bool = True
+
+
+def _env_int(name: str, default: int) -> int:
+    value = os.getenv(name)
+    return int(value) if value else default
+
+
+def _env_float(name: str, default: float) -> float:
+    value = os.getenv(name)
+    return float(value) if value else default
+
+
+def load_provider_configs() -> Dict[str, ProviderPoolConfig]:
+    """Build per-provider pool settings from the environment.
+
+    Global limits use ``LLM_MAX_CONNECTIONS``, ``LLM_MAX_KEEPALIVE``,
+    ``LLM_KEEPALIVE_EXPIRY``, ``LLM_CONNECT_TIMEOUT`` and ``LLM_HTTP2``; the
+    read timeout is per provider (``GROQCLOUD_TIMEOUT``, ``GEMINI_TIMEOUT``),
+    as is the endpoint (``GROQCLOUD_BASE_URL``, ``GEMINI_BASE_URL``, e.g. to
+    point at a local mock provider).
+    """
+    http2 = os.getenv("LLM_HTTP2", "true").lower() == "true"
+    common = {
+        "connect_timeout": _env_float("LLM_CONNECT_TIMEOUT", 5.0),
+        "max_connections": _env_int("LLM_MAX_CONNECTIONS", 100),
+        "max_keepalive_connections": _env_int("LLM_MAX_KEEPALIVE", 20),
+        "keepalive_expiry": _env_float("LLM_KEEPALIVE_EXPIRY", 30.0),
+        "http2": http2,
+    }
+    return {
+        "groqcloud": ProviderPoolConfig(
+            base_url=os.getenv("GROQCLOUD_BASE_URL", "https://api.groq.com"),
+            timeout=_env_float("GROQCLOUD_TIMEOUT", 30.0),
+            **common,
+        ),
+        "gemini": ProviderPoolConfig(
+            base_url=os.getenv("GEMINI_BASE_URL", "https://generativelanguage.googleapis.com"),
+            timeout=_env_float("GEMINI_TIMEOUT", 30.0),
+            **common,
+        ),
+    }
+
+
+class _PoolCounters:
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.total_latency = 0.0
+
+    def begin(self) -> float:
+        self.requests += 1
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        return time.perf_counter()
+
+    def end(self, started: float):
+        self.in_flight -= 1
+        self.total_latency += time.perf_counter() - started
+
+
+class _CountedStream(httpx.AsyncByteStream):
+    """Response body that runs ``on_close`` once, when the caller closes the response."""
+
+    def __init__(self, stream: httpx.AsyncByteStream, on_close: Callable[[], None]):
+        self._stream = stream
+        self._on_close: Optional[Callable[[], None]] = on_close
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self):
+        try:
+            await self._stream.aclose()
+        finally:
+            on_close, self._on_close = self._on_close, None
+            if on_close is not None:
+                on_close()
+
+
+class LLMClientRegistry:
+    """Owns one pooled AsyncClient per provider for the process lifetime."""
+
+    def __init__(self, configs: Dict[str, ProviderPoolConfig]):
+        self.configs = configs
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+        self._counters: Dict[str, _PoolCounters] = {p: _PoolCounters() for p in configs}
+
+    def _build_client(self, config: ProviderPoolConfig) -> httpx.AsyncClient:
+        limits = httpx.Limits(
+            max_connections=config.max_connections,
+            max_keepalive_connections=config.max_keepalive_connections,
+            keepalive_expiry=config.keepalive_expiry,
+        )
+        timeout = httpx.Timeout(config.timeout, connect=config.connect_timeout)
+        return httpx.AsyncClient(
+            base_url=config.base_url,
+            limits=limits,
+            timeout=timeout,
+            http2=config.http2 and HTTP2_AVAILABLE,
+        )
+
+    async def start(self):
+        """Create the provider clients (called once at app startup)."""
+        for provider, config in self.configs.items():
+            if provider not in self._clients:
+                self._clients[provider] = self._build_client(config)
+
+    async def close(self):
+        """Close every pooled client (called at app shutdown)."""
+        clients, self._clients = self._clients, {}
+        for client in clients.values():
+            await client.aclose()
+
+    def configure(self, provider: str, config: ProviderPoolConfig):
+        """Add a pool for a provider (e.g. an HTTP provider plugin) unless one exists."""
+        if provider not in self.configs:
+            self.configs[provider] = config
+            self._counters[provider] = _PoolCounters()
+
+    def get(self, provider: str) -> httpx.AsyncClient:
+        """Return the pooled client for ``provider``, creating it lazily."""
+        client = self._clients.get(provider)
+        if client is None:
+            if provider not in self.configs:
+                raise KeyError(f"No client configured for provider: {provider}")
+            client = self._clients[provider] = self._build_client(self.configs[provider])
+        return client
+
+    async def post(self, provider: str, url: str, **kwargs: Any) -> httpx.Response:
+        """POST through the provider's pool, recording utilization counters."""
+        client = self.get(provider)
+        counters = self._counters.setdefault(provider, _PoolCounters())
+        started = counters.begin()
+        try:
+            return await client.post(url, **kwargs)
+        except Exception:
+            counters.errors += 1
+            raise
+        finally:
+            counters.end(started)
+
+    async def send_stream(self, provider: str, url: str, **kwargs: Any) -> httpx.Response:
+        """POST and return once headers arrive; the caller reads and closes the body.
+
+        The request counts as in flight until ``aclose()``, since the
+        connection stays checked out while the body streams.
+        """
+        client = self.get(provider)
+        counters = self._counters.setdefault(provider, _PoolCounters())
+        started = counters.begin()
+        try:
+            response = await client.send(client.build_request("POST", url, **kwargs), stream=True)
+        except BaseException as exc:
+            if isinstance(exc, Exception):
+                counters.errors += 1
+            counters.end(started)
+            raise
+        response.stream = _CountedStream(response.stream, lambda: counters.end(started))
+        return response
+
+    def _pool_connections(self, provider: str) -> Optional[Dict[str, int]]:
+        client = self._clients.get(provider)
+        # httpx does not expose pool state publicly; read httpcore's pool if present
+        pool = getattr(getattr(client, "_transport", None), "_pool", None)
+        connections = getattr(pool, "connections", None)
+        if connections is None:
+            return None
+        idle = sum(1 for c in connections if c.is_idle())
+        return {"open": len(connections), "idle": idle, "active": len(connections) - idle}
+
+    def stats(self) -> Dict[str, Any]:
+        """Per-provider pool utilization, for sizing the limits."""
+        result = {}
+        for provider, config in self.configs.items():
+            counters = self._counters[provider]
+            max_conn = config.max_connections
+            result[provider] = {
+                "started": provider in self._clients,
+                "http2": config.http2 and HTTP2_AVAILABLE,
+                "timeout": config.timeout,
+                "max_connections": max_conn,
+                "max_keepalive_connections": config.max_keepalive_connections,
+                "requests": counters.requests,
+                "errors": counters.errors,
+                "in_flight": counters.in_flight,
+                "peak_in_flight": counters.peak_in_flight,
+                "utilization": round(counters.in_flight / max_conn, 4) if max_conn else None,
+                "avg_latency_ms": round(counters.total_latency / counters.requests * 1000, 2) if counters.requests else 0.0,
+                "connections": self._pool_connections(provider),
+            }
+        return result
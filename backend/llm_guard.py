@@ -0,0 +1,431 @@
+"""Rate-limit aware, retrying access to LLM providers.
+
+``ProviderGuard`` wraps ``LLMClientRegistry.post`` (and ``send_stream``) with:
+
+* a request bucket (RPM) and a token bucket (TPM) per (provider, API key),
+  seeded from configured quotas and corrected from the provider's
+  ``x-ratelimit-*`` headers; a 429 parks every caller on that key until
+  ``Retry-After`` passes instead of letting them all retry at once;
+* retries of 429/5xx/transport errors with full-jitter exponential backoff
+  (``Retry-After`` wins when the provider sends one);
+* a per-provider circuit breaker that fails fast once a provider keeps
+  erroring, then lets one probe through after ``reset_timeout``.
+"""
+import asyncio
+import hashlib
+import random
+import re
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from email.utils import parsedate_to_datetime
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Mapping, Optional, Tuple
+
+import httpx
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+
+class ProviderError(Exception):
+    """Provider call failed after throttling/retries; ``status`` is the HTTP status to surface."""
+
+    status = 502
+
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class RateLimitedError(ProviderError):
+    status = 429
+
+
+class CircuitOpenError(ProviderError):
+    status = 503
+
+
+class UpstreamError(ProviderError):
+    status = 502
+
+
+# ---------------------------------------------------------------------------
+# header parsing
+
+
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+
+
+def parse_duration(value: Optional[str]) -> Optional[float]:
+    """Seconds from ``"12"``, ``"7.66s"``, ``"2m59.56s"`` or ``"250ms"``."""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION_PART.findall(value)
+    if not parts:
+        return None
+    scale = {"h": 3600.0, "m": 60.0, "s": 1.0, "ms": 0.001}
+    return sum(float(n) * scale[unit] for n, unit in parts)
+
+
+def parse_retry_after(headers: Mapping[str, str]) -> Optional[float]:
+    """``Retry-After`` as seconds (delta-seconds or HTTP-date)."""
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    seconds = parse_duration(value)
+    if seconds is not None:
+        return max(0.0, seconds)
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _header_float(headers: Mapping[str, str], name: str) -> Optional[float]:
+    try:
+        return float(headers[name])
+    except (KeyError, ValueError):
+        return None
+
+
+# ---------------------------------------------------------------------------
+# throttling
+
+
+class TokenBucket:
+    """Classic token bucket; ``rate=None`` means unlimited until the provider says otherwise."""
+
+    def __init__(self, rate: Optional[float] = None, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self.tokens = self.capacity if self.capacity is not None else 0.0
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float):
+        if self.rate is not None:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay_for(self, n: float, now: float) -> float:
+        self._refill(now)
+        wait = max(0.0, self.blocked_until - now)
+        if self.rate is None:
+            return wait
+        n = min(n, self.capacity)
+        if self.tokens < n:
+            wait = max(wait, (n - self.tokens) / self.rate)
+        return wait
+
+    def take(self, n: float):
+        if self.rate is not None:
+            self.tokens -= n
+
+    def observe(self, remaining: Optional[float], reset_after: Optional[float], now: float):
+        """Trust the provider's view of our remaining quota."""
+        if remaining is None:
+            return
+        self._refill(now)
+        if self.rate is not None:
+            self.tokens = min(self.tokens, remaining)
+        if remaining < 1 and reset_after:
+            self.blocked_until = max(self.blocked_until, now + reset_after)
+
+    def block(self, seconds: float, now: float):
+        self.blocked_until = max(self.blocked_until, now + seconds)
+
+
+class KeyLimiter:
+    """Request + token buckets for one (provider, API key)."""
+
+    def __init__(self, rpm: Optional[float], tpm: Optional[float]):
+        self.requests = TokenBucket(rpm / 60.0 if rpm else None, rpm)
+        self.tokens = TokenBucket(tpm / 60.0 if tpm else None, tpm)
+        self.throttled = 0
+        self.throttle_seconds = 0.0
+
+    async def acquire(self, est_tokens: float, max_wait: float):
+        waited = 0.0
+        while True:
+            now = time.monotonic()
+            delay = max(self.requests.delay_for(1, now), self.tokens.delay_for(est_tokens, now))
+            if delay <= 0:
+                self.requests.take(1)
+                self.tokens.take(est_tokens)
+                if waited:
+                    self.throttled += 1
+                    self.throttle_seconds += waited
+                return
+            if waited + delay > max_wait:
+                raise RateLimitedError("provider quota exhausted for this key", retry_after=delay)
+            await asyncio.sleep(delay)
+            waited += delay
+
+    def observe_headers(self, headers: Mapping[str, str]):
+        now = time.monotonic()
+        self.requests.observe(
+            _header_float(headers, "x-ratelimit-remaining-requests"),
+            parse_duration(headers.get("x-ratelimit-reset-requests")),
+            now,
+        )
+        self.tokens.observe(
+            _header_float(headers, "x-ratelimit-remaining-tokens"),
+            parse_duration(headers.get("x-ratelimit-reset-tokens")),
+            now,
+        )
+
+    def block(self, seconds: float):
+        now = time.monotonic()
+        self.requests.block(seconds, now)
+
+    def settle(self, estimated: float, actual: float):
+        """Charge the difference between the estimate and the reported usage."""
+        self.tokens.take(actual - estimated)
+
+
+def key_fingerprint(api_key: str) -> str:
+    """Short stable id of an API key, for maps that must not hold the secret."""
+    return hashlib.sha256(api_key.encode()).hexdigest()[:16]
+
+
+# ---------------------------------------------------------------------------
+# circuit breaker
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.opens = 0
+        self._probe_in_flight = False
+
+    def allow(self) -> bool:
+        if self.state == "closed":
+            return True
+        if self.state == "open":
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                return False
+            self.state = "half_open"
+        if self._probe_in_flight:
+            return False
+        self._probe_in_flight = True
+        return True
+
+    def rejecting(self) -> bool:
+        """Open and still inside the reset timeout; unlike ``allow`` this claims nothing."""
+        return self.state == "open" and time.monotonic() - self.opened_at < self.reset_timeout
+
+    def release_probe(self):
+        """End a probe that neither succeeded nor failed (throttled, cancelled); the next call probes again."""
+        self._probe_in_flight = False
+
+    def retry_after(self) -> float:
+        return max(0.0, self.opened_at + self.reset_timeout - time.monotonic())
+
+    def record_success(self):
+        self.failures = 0
+        self.state = "closed"
+        self._probe_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        self._probe_in_flight = False
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            if self.state != "open":
+                self.opens += 1
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+
+# ---------------------------------------------------------------------------
+# guard
+
+
+@dataclass
+class Quota:
+    rpm: Optional[float] = None
+    tpm: Optional[float] = None
+
+
+def parse_quotas(spec: str) -> Dict[str, Quota]:
+    """``"groqcloud=rpm:30,tpm:6000;gemini=rpm:15"`` -> ``{provider: Quota}``"""
+    quotas: Dict[str, Quota] = {}
+    for entry in filter(None, (e.strip() for e in spec.split(";"))):
+        provider, _, limits = entry.partition("=")
+        quota = Quota()
+        for item in filter(None, (i.strip() for i in limits.split(","))):
+            name, _, value = item.partition(":")
+            setattr(quota, name.strip(), float(value))
+        quotas[provider.strip()] = quota
+    return quotas
+
+
+class _ProviderCounters:
+    def __init__(self):
+        self.calls = 0
+        self.attempts = 0
+        self.retries = 0
+        self.rate_limited = 0
+        self.server_errors = 0
+        self.transport_errors = 0
+        self.fast_failures = 0
+
+
+class ProviderGuard:
+    def __init__(
+        self,
+        clients,
+        quotas: Optional[Dict[str, Quota]] = None,
+        max_retries: int = 3,
+        backoff_base: float = 0.5,
+        backoff_max: float = 20.0,
+        max_retry_after: float = 60.0,
+        max_queue_wait: float = 30.0,
+        breaker_threshold: int = 5,
+        breaker_reset: float = 30.0,
+        max_keys: int = 10000,
+    ):
+        self.clients = clients
+        self.quotas = quotas or {}
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_retry_after = max_retry_after
+        self.max_queue_wait = max_queue_wait
+        self.breaker_threshold = breaker_threshold
+        self.breaker_reset = breaker_reset
+        self.max_keys = max_keys
+        self._limiters: "OrderedDict[Tuple[str, str], KeyLimiter]" = OrderedDict()
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._counters: Dict[str, _ProviderCounters] = {}
+
+    def limiter(self, provider: str, api_key: str) -> KeyLimiter:
+        # keys are fingerprinted so raw secrets never sit in the map
+        key = (provider, key_fingerprint(api_key))
+        limiter = self._limiters.get(key)
+        if limiter is None:
+            quota = self.quotas.get(provider, Quota())
+            limiter = self._limiters[key] = KeyLimiter(quota.rpm, quota.tpm)
+            while len(self._limiters) > self.max_keys:
+                self._limiters.popitem(last=False)
+        else:
+            self._limiters.move_to_end(key)
+        return limiter
+
+    def breaker(self, provider: str) -> CircuitBreaker:
+        breaker = self._breakers.get(provider)
+        if breaker is None:
+            breaker = self._breakers[provider] = CircuitBreaker(self.breaker_threshold, self.breaker_reset)
+        return breaker
+
+    def _backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    async def post(self, provider: str, api_key: str, url: str, est_tokens: float = 0, **kwargs: Any) -> httpx.Response:
+        """POST with throttling, retries and the breaker; returns the final non-retryable response."""
+        return await self._send(provider, api_key, est_tokens, lambda: self.clients.post(provider, url, **kwargs))
+
+    @asynccontextmanager
+    async def stream(self, provider: str, api_key: str, url: str, est_tokens: float = 0, **kwargs: Any) -> AsyncIterator[httpx.Response]:
+        """Like ``post`` but yields the response before its body is read.
+
+        Retries only cover getting the response headers; once the body is
+        streaming to the caller a failure is the caller's to surface.
+        """
+        response = await self._send(provider, api_key, est_tokens, lambda: self.clients.send_stream(provider, url, **kwargs))
+        try:
+            yield response
+        finally:
+            await response.aclose()
+
+    async def _send(self, provider: str, api_key: str, est_tokens: float, send: Callable[[], Awaitable[httpx.Response]]) -> httpx.Response:
+        limiter = self.limiter(provider, api_key)
+        breaker = self.breaker(provider)
+        counters = self._counters.setdefault(provider, _ProviderCounters())
+        counters.calls += 1
+        attempt = 0
+        while True:
+            # fail fast instead of queueing on the limiter for a provider that is down
+            if breaker.rejecting():
+                counters.fast_failures += 1
+                raise CircuitOpenError(f"{provider} is unavailable (circuit open)", retry_after=breaker.retry_after())
+            await limiter.acquire(est_tokens, self.max_queue_wait)
+            # claims the half-open probe, so only once the request can actually go out
+            if not breaker.allow():
+                counters.fast_failures += 1
+                raise CircuitOpenError(f"{provider} is unavailable (circuit open)", retry_after=breaker.retry_after())
+            counters.attempts += 1
+            delay = None
+            try:
+                try:
+                    response = await send()
+                except (httpx.TimeoutException, httpx.TransportError):
+                    counters.transport_errors += 1
+                    breaker.record_failure()
+                    if attempt >= self.max_retries:
+                        raise
+                else:
+                    limiter.observe_headers(response.headers)
+                    if response.status_code not in RETRYABLE_STATUS:
+                        breaker.record_success()
+                        return response
+                    # drain and release the connection before retrying (no-op for buffered responses)
+                    await response.aread()
+                    await response.aclose()
+                    if response.status_code == 429:
+                        # the provider is up, just busy: don't trip the breaker
+                        counters.rate_limited += 1
+                        breaker.record_success()
+                        retry_after = parse_retry_after(response.headers)
+                        if attempt >= self.max_retries or (retry_after or 0) > self.max_retry_after:
+                            raise RateLimitedError(f"{provider} rate limit exceeded", retry_after=retry_after)
+                        # park every caller on this key, not just this one
+                        delay = retry_after if retry_after is not None else self._backoff(attempt)
+                        limiter.block(delay)
+                    else:
+                        counters.server_errors += 1
+                        breaker.record_failure()
+                        if attempt >= self.max_retries:
+                            raise UpstreamError(f"{provider} error {response.status_code}: {response.text[:500]}")
+            finally:
+                # a cancelled or otherwise unrecorded attempt must not hold the probe forever
+                breaker.release_probe()
+            counters.retries += 1
+            await asyncio.sleep(delay if delay is not None else self._backoff(attempt))
+            attempt += 1
+
+    def record_usage(self, provider: str, api_key: str, estimated: float, actual: Optional[float]):
+        if actual is not None:
+            self.limiter(provider, api_key).settle(estimated, actual)
+
+    def stats(self) -> Dict[str, Any]:
+        result = {}
+        for provider in set(self._breakers) | set(self._counters):
+            breaker = self.breaker(provider)
+            counters = self._counters.get(provider) or _ProviderCounters()
+            limiters = [l for (p, _), l in self._limiters.items() if p == provider]
+            result[provider] = {
+                "circuit": breaker.state,
+                "consecutive_failures": breaker.failures,
+                "circuit_opens": breaker.opens,
+                "calls": counters.calls,
+                "attempts": counters.attempts,
+                "retries": counters.retries,
+                "rate_limited": counters.rate_limited,
+                "server_errors": counters.server_errors,
+                "transport_errors": counters.transport_errors,
+                "fast_failures": counters.fast_failures,
+                "keys": len(limiters),
+                "throttled": sum(l.throttled for l in limiters),
+                "throttle_seconds": round(sum(l.throttle_seconds for l in limiters), 3),
+                "quota": vars(self.quotas.get(provider, Quota())),
+            }
+        return result
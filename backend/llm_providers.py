@@ -0,0 +1,252 @@
+"""LLM provider plugins.
+
+A provider turns a prompt into a completion, either whole (``complete``) or
+as a stream of ``(text, tokens)`` deltas (``stream``), and accounts for the
+tokens it used. ``HTTPProvider`` does the HTTP plumbing through
+ProviderGuard (throttling, retries, circuit breaker); subclasses only build
+the request and parse responses and stream events. Groq and Gemini are
+HTTP providers.
+
+``LocalProvider`` ("local") generates deterministic text in-process with a
+configurable first-token latency, token rate and concurrency, so agent runs
+can be load tested offline without keys (``LOCAL_LLM_*`` settings).
+
+Third-party providers call ``register_provider``; modules named in
+``LLM_PROVIDER_PLUGINS`` (comma-separated) are imported by
+``load_providers`` so they get the chance to.
+"""
+import asyncio
+import hashlib
+import importlib
+import os
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from llm_clients import ProviderPoolConfig
+from llm_guard import ProviderError, UpstreamError
+from llm_stream import Delta, gemini_delta, groq_delta, iter_sse_data
+from serialization import dumpb, loads
+
+
+class UnsupportedProviderError(ProviderError):
+    status = 400
+
+
+class LLMProvider:
+    name = ""
+    default_model = ""
+    requires_api_key = True
+    # optional connection pool for HTTP plugins, added to the client registry on load
+    pool_config: Optional[ProviderPoolConfig] = None
+
+    def __init__(self, est_output_tokens: int = 256):
+        self.est_output_tokens = est_output_tokens
+
+    def estimate_tokens(self, prompt: str) -> int:
+        """Tokens to reserve before the provider reports usage."""
+        return len(prompt) // 4 + self.est_output_tokens
+
+    async def complete(self, guard, prompt: str, api_key: str, model: Optional[str] = None) -> Tuple[str, int]:
+        """(text, tokens used)."""
+        raise NotImplementedError
+
+    def stream(self, guard, prompt: str, api_key: str, model: Optional[str] = None) -> AsyncIterator[Delta]:
+        """(text, tokens) deltas; tokens is set once the provider reports usage."""
+        raise NotImplementedError
+
+
+class HTTPProvider(LLMProvider):
+    label = ""
+
+    def build_request(self, prompt: str, api_key: str, model: str, stream: bool) -> Tuple[str, Dict[str, Any]]:
+        """(url, httpx request kwargs)."""
+        raise NotImplementedError
+
+    def parse_response(self, data: Dict[str, Any]) -> Tuple[str, Optional[int]]:
+        raise NotImplementedError
+
+    def parse_event(self, event: Dict[str, Any]) -> Delta:
+        raise NotImplementedError
+
+    async def complete(self, guard, prompt: str, api_key: str, model: Optional[str] = None) -> Tuple[str, int]:
+        est_tokens = self.estimate_tokens(prompt)
+        url, request = self.build_request(prompt, api_key, model or self.default_model, stream=False)
+        response = await guard.post(self.name, api_key, url, est_tokens, **request)
+        if response.status_code != 200:
+            raise UpstreamError(f"{self.label} API error: {response.text}")
+        text, usage = self.parse_response(loads(response.content))
+        guard.record_usage(self.name, api_key, est_tokens, usage)
+        return text, usage or est_tokens
+
+    async def stream(self, guard, prompt: str, api_key: str, model: Optional[str] = None) -> AsyncIterator[Delta]:
+        est_tokens = self.estimate_tokens(prompt)
+        url, request = self.build_request(prompt, api_key, model or self.default_model, stream=True)
+        usage = None
+        async with guard.stream(self.name, api_key, url, est_tokens, **request) as response:
+            if response.status_code != 200:
+                await response.aread()
+                raise UpstreamError(f"{self.label} API error: {response.text}")
+            async for event in iter_sse_data(response):
+                text, tokens = self.parse_event(event)
+                usage = tokens or usage
+                yield text, tokens
+        guard.record_usage(self.name, api_key, est_tokens, usage)
+
+
+class GroqProvider(HTTPProvider):
+    name = "groqcloud"
+    label = "GroqCloud"
+    default_model = "llama-3.3-70b-versatile"
+
+    def build_request(self, prompt, api_key, model, stream):
+        payload = {
+            "model": model,
+            "messages": [{"role": "user", "content": prompt}],
+            "temperature": 0.7,
+        }
+        if stream:
+            payload.update(stream=True, stream_options={"include_usage": True})
+        headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
+        return "/openai/v1/chat/completions", {"content": dumpb(payload), "headers": headers}
+
+    def parse_response(self, data):
+        return data["choices"][0]["message"]["content"], (data.get("usage") or {}).get("total_tokens")
+
+    def parse_event(self, event):
+        return groq_delta(event)
+
+
+class GeminiProvider(HTTPProvider):
+    name = "gemini"
+    label = "Gemini"
+    default_model = "gemini-1.5-flash"
+
+    def build_request(self, prompt, api_key, model, stream):
+        method = "streamGenerateContent" if stream else "generateContent"
+        params = {"key": api_key, "alt": "sse"} if stream else {"key": api_key}
+        return f"/v1beta/models/{model}:{method}", {
+            "content": dumpb({"contents": [{"parts": [{"text": prompt}]}]}),
+            "headers": {"Content-Type": "application/json"},
+            "params": params,
+        }
+
+    def parse_response(self, data):
+        return data["candidates"][0]["content"]["parts"][0]["text"], (data.get("usageMetadata") or {}).get("totalTokenCount")
+
+    def parse_event(self, event):
+        return gemini_delta(event)
+
+
+_WORDS = (
+    "agent market signal proof chain oracle price volume trend risk vote yield "
+    "order liquidity model forecast balance position hedge report threshold"
+).split()
+
+
+class LocalProvider(LLMProvider):
+    """Deterministic in-process completions with simulated latency and throughput.
+
+    The same (model, prompt) always gives the same text, token count and
+    latency. ``latency_ms`` (+ up to ``jitter_ms``) passes before the first
+    chunk, then ``output_tokens`` arrive at ``tokens_per_second`` (0 = all at
+    once). ``max_concurrency`` > 0 caps concurrent generations like a
+    provider's capacity limit; excess calls queue.
+    """
+
+    name = "local"
+    default_model = "local-sim"
+    requires_api_key = False
+
+    def __init__(self, latency_ms: float = 50.0, jitter_ms: float = 0.0, tokens_per_second: float = 200.0,
+                 output_tokens: int = 64, max_concurrency: int = 0, chunk_tokens: int = 8):
+        super().__init__(est_output_tokens=output_tokens)
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.tokens_per_second = tokens_per_second
+        self.output_tokens = output_tokens
+        self.max_concurrency = max_concurrency
+        self.chunk_tokens = max(1, chunk_tokens)
+        self._slots: Optional[asyncio.Semaphore] = None
+        self.calls = 0
+
+    @classmethod
+    def from_env(cls) -> "LocalProvider":
+        return cls(
+            latency_ms=float(os.getenv("LOCAL_LLM_LATENCY_MS", "50")),
+            jitter_ms=float(os.getenv("LOCAL_LLM_JITTER_MS", "0")),
+            tokens_per_second=float(os.getenv("LOCAL_LLM_TOKENS_PER_SEC", "200")),
+            output_tokens=int(os.getenv("LOCAL_LLM_OUTPUT_TOKENS", "64")),
+            max_concurrency=int(os.getenv("LOCAL_LLM_CONCURRENCY", "0")),
+        )
+
+    def _generate(self, prompt: str, model: str) -> Tuple[List[str], float]:
+        digest = hashlib.sha256(f"{model}\n{prompt}".encode()).digest()
+        words = [(" " if i else "") + _WORDS[(digest[i % len(digest)] + i) % len(_WORDS)] for i in range(self.output_tokens)]
+        first_token = (self.latency_ms + self.jitter_ms * digest[0] / 255) / 1000
+        return words, first_token
+
+    @asynccontextmanager
+    async def _slot(self):
+        if self.max_concurrency <= 0:
+            yield
+            return
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_concurrency)
+        async with self._slots:
+            yield
+
+    async def complete(self, guard, prompt: str, api_key: str, model: Optional[str] = None) -> Tuple[str, int]:
+        words, first_token = self._generate(prompt, model or self.default_model)
+        async with self._slot():
+            self.calls += 1
+            generation = len(words) / self.tokens_per_second if self.tokens_per_second > 0 else 0.0
+            await asyncio.sleep(first_token + generation)
+        return "".join(words), len(prompt) // 4 + len(words)
+
+    async def stream(self, guard, prompt: str, api_key: str, model: Optional[str] = None) -> AsyncIterator[Delta]:
+        words, first_token = self._generate(prompt, model or self.default_model)
+        async with self._slot():
+            self.calls += 1
+            await asyncio.sleep(first_token)
+            for i in range(0, len(words), self.chunk_tokens):
+                chunk = words[i:i + self.chunk_tokens]
+                if i and self.tokens_per_second > 0:
+                    await asyncio.sleep(len(chunk) / self.tokens_per_second)
+                yield "".join(chunk), None
+        yield None, len(prompt) // 4 + len(words)
+
+
+_providers: Dict[str, LLMProvider] = {}
+
+
+def register_provider(provider: LLMProvider):
+    _providers[provider.name] = provider
+
+
+def get_provider(name: str) -> LLMProvider:
+    provider = _providers.get(name)
+    if provider is None:
+        raise UnsupportedProviderError(f"Unsupported provider: {name}")
+    return provider
+
+
+def requires_api_key(name: str) -> bool:
+    provider = _providers.get(name)
+    return provider is None or provider.requires_api_key
+
+
+def provider_names() -> List[str]:
+    return list(_providers)
+
+
+def load_providers(clients, est_output_tokens: int = 256, plugins: str = "") -> List[str]:
+    """Register the built-in providers, import plugin modules and give HTTP plugins a client pool."""
+    register_provider(GroqProvider(est_output_tokens))
+    register_provider(GeminiProvider(est_output_tokens))
+    register_provider(LocalProvider.from_env())
+    for module in filter(None, (m.strip() for m in plugins.split(","))):
+        importlib.import_module(module)
+    for provider in _providers.values():
+        if provider.pool_config is not None:
+            clients.configure(provider.name, provider.pool_config)
+    return provider_names()
@@ -0,0 +1,76 @@
+"""Streaming completions: provider SSE parsing and SSE fan-out to clients.
+
+Groq (OpenAI-compatible ``stream: true``) and Gemini
+(``streamGenerateContent?alt=sse``) both answer with ``data: {...}`` lines.
+``iter_sse_data`` decodes them and the ``*_delta`` helpers pull out the
+text and any usage block. ``sse_events`` turns a queue of text chunks plus
+the eventual result into ``token`` / ``done`` / ``error`` events for the
+client.
+"""
+import asyncio
+from typing import Any, AsyncIterator, Awaitable, Dict, Optional, Tuple
+
+import httpx
+
+from serialization import dumps, loads
+
+Delta = Tuple[Optional[str], Optional[float]]
+
+
+async def iter_sse_data(response: httpx.Response) -> AsyncIterator[Dict[str, Any]]:
+    """JSON payloads of a provider's ``data:`` lines, until ``[DONE]``."""
+    async for line in response.aiter_lines():
+        if not line.startswith("data:"):
+            continue
+        data = line[5:].strip()
+        if not data:
+            continue
+        if data == "[DONE]":
+            return
+        yield loads(data)
+
+
+def groq_delta(event: Dict[str, Any]) -> Delta:
+    """(text, total_tokens) from an OpenAI-style chat.completion.chunk."""
+    choices = event.get("choices") or []
+    text = (choices[0].get("delta") or {}).get("content") if choices else None
+    usage = event.get("usage") or (event.get("x_groq") or {}).get("usage") or {}
+    return text, usage.get("total_tokens")
+
+
+def gemini_delta(event: Dict[str, Any]) -> Delta:
+    """(text, totalTokenCount) from one streamGenerateContent event."""
+    candidates = event.get("candidates") or []
+    parts = ((candidates[0].get("content") or {}).get("parts") or []) if candidates else []
+    text = "".join(p.get("text", "") for p in parts) or None
+    return text, (event.get("usageMetadata") or {}).get("totalTokenCount")
+
+
+def sse_event(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {dumps(data)}\n\n"
+
+
+async def sse_events(chunks: "asyncio.Queue[Optional[str]]", outcome: Awaitable[Dict[str, Any]], keepalive: float = 15.0) -> AsyncIterator[str]:
+    """Relay text chunks as ``token`` events, then the outcome as ``done`` (or ``error``).
+
+    The producer puts chunks on ``chunks``; the outcome finishing ends the
+    stream. Comment lines keep idle connections (e.g. a run still queued)
+    from being timed out by proxies.
+    """
+    outcome = asyncio.ensure_future(outcome)
+    outcome.add_done_callback(lambda _: chunks.put_nowait(None))
+    while True:
+        try:
+            chunk = await asyncio.wait_for(chunks.get(), keepalive)
+        except asyncio.TimeoutError:
+            yield ": keep-alive\n\n"
+            continue
+        if chunk is None:
+            break
+        yield sse_event("token", {"text": chunk})
+    error = outcome.exception()
+    if error is None:
+        yield sse_event("done", outcome.result())
+    else:
+        status = getattr(error, "status_code", None) or getattr(error, "status", None) or 500
+        yield sse_event("error", {"status": status, "detail": getattr(error, "detail", None) or str(error)})
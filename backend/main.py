@@ -1,31 +1,170 @@
-from fastapi import FastAPI, HTTPException, Depends, Header
+from fastapi import FastAPI, HTTPException, Depends, Header, Query
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Callable, Tuple
 import asyncio
 import asyncpg
+from contextlib import asynccontextmanager
 import hashlib
 import json
+import logging
 import os
-from datetime import datetime
+from datetime import datetime, timezone
 import httpx
 import time
 from cryptography.fernet import Fernet
+from llm_clients import LLMClientRegistry, load_provider_configs
+from llm_guard import ProviderError, ProviderGuard, key_fingerprint, parse_quotas
+from llm_stream import sse_events
+from llm_providers import get_provider, load_providers, provider_names, requires_api_key
+from chain import TxReceipt, create_submitter
+from tx_batcher import MulticallBatcher, create_batcher
+from proof_batches import ProofAggregator, verify_inclusion
+from secret_cache import SecretCache
+from agent_cache import AgentCache
+from response_cache import ResponseCache, cache_key
+from single_flight import SingleFlight
+from serialization import ORJSONResponse, canonical, register_json_codecs
+from invalidation import PgNotifyChannel
+from db_access import AgentRunStore, QueryTimings
+from agent_rows import AGENT_COUNTERS_SQL, CACHED_DOCUMENT_SQL, INSERT_AGENT_SQL, UPDATE_AGENT_SQL, increment_agent_counters, insert_agent_args, update_agent_args
+from write_behind import WriteBehindBuffer
+from memory_store import IndexedTable
+from marketplace_index import SORTS as MARKETPLACE_SORTS, MarketplaceIndex, marketplace_sql, parse_position, tokenize
+from pagination import clamp_limit, decode_cursor, encode_cursor, history_position, ndjson_line
+from analytics import AgentRollups
+from lifecycle import Lifecycle
+from migrations import migrate
+from scheduler import Scheduler
+from schedule_leases import ScheduleLeaseManager, claim_tick, fetch_schedules, partition_sql
+from run_engine import QueueFullError, RunEngine, parse_limits
+from metrics import TOKEN_BUCKETS, InstrumentedPool, MetricsRegistry, RequestMetricsMiddleware
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Start components in dependency order; drain them in reverse on shutdown.
+
+    Producers (scheduler, run engine) stop before the sinks they write to
+    (write-behind buffer, rollups, proof batches) are flushed, and the pool
+    closes last. Per-step startup and shutdown times are in /api/db/stats.
+    """
+    try:
+        await lifecycle.step("db_pool", init_db, close_db)
+        if db_pool:
+            schema = await lifecycle.step("migrations", lambda: migrate(db_pool))
+            if schema["applied"]:
+                print(f"🗄️  Applied migrations {schema['applied']} (schema v{schema['version']})")
+            await lifecycle.step("pool_warmup", warm_pool)
+        await lifecycle.step("mock_data", initialize_mock_data)
+        print("✅ Mock data initialized")
+        print(f"📊 {len(agents_db)} agents, {len(listings_db)} listings, {len(actions_db)} actions")
+        await lifecycle.step("llm_clients", llm_clients.start, llm_clients.close)
+        await lifecycle.step("chain_submitter", chain_submitter.start, chain_submitter.close)
+        await lifecycle.step("proof_aggregator", stop=drain_proof_batches)
+        global key_invalidation
+        if db_pool and SECRET_CACHE_NOTIFY:
+            key_invalidation = PgNotifyChannel(db_pool, "api_key_invalidation")
+            await lifecycle.step(
+                "key_invalidation",
+                lambda: key_invalidation.start(
+                    lambda msg: secret_cache.invalidate(msg["user_id"], msg.get("provider")),
+                    on_reconnect=secret_cache.clear,
+                ),
+                key_invalidation.close,
+            )
+        global agent_invalidation
+        if db_pool and AGENT_CACHE_NOTIFY:
+            agent_invalidation = PgNotifyChannel(db_pool, "agent_invalidation")
+            await lifecycle.step(
+                "agent_invalidation",
+                lambda: agent_invalidation.start(
+                    lambda msg: agent_cache.invalidate(msg["agent_id"], msg.get("version")),
+                    on_reconnect=agent_cache.clear,
+                ),
+                agent_invalidation.close,
+            )
+        global write_buffer
+        if db_pool and WRITE_BEHIND:
+            write_buffer = WriteBehindBuffer(
+                db_pool,
+                os.getenv("WRITE_BEHIND_DIR", "write_behind_journal"),
+                max_batch=int(os.getenv("WRITE_BEHIND_BATCH", "500")),
+                flush_interval=float(os.getenv("WRITE_BEHIND_INTERVAL", "0.2")),
+                max_queue=int(os.getenv("WRITE_BEHIND_MAX_QUEUE", "10000")),
+            )
+            await lifecycle.step("write_behind", write_buffer.start, write_buffer.close)
+        if db_pool:
+            await lifecycle.step("analytics", lambda: analytics.start(db_pool), analytics.close)
+            if ANALYTICS_BACKFILL_ON_START:
+                await lifecycle.step("analytics_backfill", lambda: analytics.backfill_db(write_buffer))
+        else:
+            await lifecycle.step(
+                "analytics",
+                lambda: analytics.backfill_memory(actions_db.values(), proofs_db.values(), agents_db.values()),
+            )
+        await lifecycle.step("response_cache", stop=response_cache.close)
+        # queued runs are rejected on shutdown, in-flight ones finish
+        await lifecycle.step("run_engine", stop=run_engine.close)
+        global schedule_leases, schedule_notify
+        if db_pool and SCHEDULER_DISTRIBUTED:
+            # each worker fires only the partitions it holds a lease on
+            await lifecycle.step("scheduler", scheduler.start, scheduler.close)
+            schedule_leases = ScheduleLeaseManager(
+                db_pool,
+                load_schedule_partitions,
+                drop_schedule_partitions,
+                partitions=SCHEDULER_PARTITIONS,
+                lease_ttl=float(os.getenv("SCHEDULER_LEASE_TTL", "15")),
+                renew_interval=float(os.getenv("SCHEDULER_LEASE_RENEW", "5")),
+            )
+            await lifecycle.step("schedule_leases", schedule_leases.start, schedule_leases.close)
+            # drained after the channel closes (stops run in reverse), so no new loads start behind it
+            await lifecycle.step("schedule_loads", stop=finish_schedule_loads)
+            schedule_notify = PgNotifyChannel(db_pool, "schedule_changes")
+            await lifecycle.step(
+                "schedule_notify",
+                lambda: schedule_notify.start(on_schedule_notice, on_reconnect=reload_owned_schedules),
+                schedule_notify.close,
+            )
+        else:
+            schedules = await lifecycle.step("load_schedules", load_schedules)
+            await lifecycle.step("scheduler", lambda: scheduler.start(schedules), scheduler.close)
+        lifecycle.mark_ready()
+        print(f"🚀 Started in {lifecycle.startup_ms['total']:.0f} ms")
+        yield
+    finally:
+        await lifecycle.drain()
 
-app = FastAPI(title="PhantomAgents Backend API")
+logger = logging.getLogger(__name__)
 
-@app.on_event("startup")
-async def startup_event():
-    """Initialize mock data on startup"""
-    initialize_mock_data()
-    print("✅ Mock data initialized")
-    print(f"📊 {len(agents_db)} agents, {len(listings_db)} listings, {len(actions_db)} actions")
+app = FastAPI(title="PhantomAgents Backend API", lifespan=lifespan, default_response_class=ORJSONResponse)
 
 # ==========================================
 # CONFIGURATION
 # ==========================================
 MOCK_BLOCKCHAIN = os.getenv("MOCK_BLOCKCHAIN", "true").lower() == "true"
 
+# Prometheus metrics at /metrics. METRICS_ENABLED=false turns them off: every
+# instrument becomes a no-op, the request middleware is skipped and /metrics 404s.
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+metrics = MetricsRegistry(enabled=METRICS_ENABLED, namespace="phantom")
+HTTP_REQUEST_SECONDS = metrics.histogram("http_request_duration_seconds", "HTTP request latency by route", ("method", "route", "status"))
+STAGE_SECONDS = metrics.histogram("stage_duration_seconds", "Time spent per stage of agent runs, LLM execute and registration", ("operation", "stage"))
+LLM_REQUEST_SECONDS = metrics.histogram("llm_request_duration_seconds", "LLM provider call latency", ("provider", "mode", "outcome"))
+LLM_FIRST_TOKEN_SECONDS = metrics.histogram("llm_first_token_seconds", "Time to the first streamed chunk", ("provider",))
+LLM_TOKENS = metrics.histogram("llm_tokens", "Tokens used per LLM call (the _sum is total tokens)", ("provider",), buckets=TOKEN_BUCKETS)
+DB_POOL_WAIT_SECONDS = metrics.histogram("db_pool_checkout_wait_seconds", "Time waiting for a Postgres connection")
+DB_POOL_IN_USE = metrics.gauge("db_pool_connections_in_use", "Postgres connections checked out")
+metrics.gauge("db_pool_connections", "Postgres connections open", collect=lambda: {(): db_pool.get_size()} if db_pool else {})
+SCHEDULER_LAG_SECONDS = metrics.histogram("scheduler_lag_seconds", "Delay between a schedule's due time and its dispatch")
+metrics.gauge("scheduler_schedules", "Schedules loaded in this worker", collect=lambda: {(): len(scheduler.entries)})
+metrics.gauge("run_queue_depth", "Agent runs waiting in the run engine", ("lane",),
+              collect=lambda: {(lane,): depth for lane, depth in run_engine.stats()["queue_depth"].items()})
+metrics.gauge("run_active", "Agent runs executing", collect=lambda: {(): run_engine.stats()["active"]})
+if METRICS_ENABLED:
+    app.add_middleware(RequestMetricsMiddleware, histogram=HTTP_REQUEST_SECONDS)
+
 # Ensure the ENCRYPTION_KEY is bytes for Fernet
 _encryption_env = os.getenv("ENCRYPTION_KEY")
 if _encryption_env:
@@ -33,16 +172,110 @@ if _encryption_env:
 else:
     ENCRYPTION_KEY = Fernet.generate_key()
 cipher = Fernet(ENCRYPTION_KEY)
+# Decrypted API keys cached per (user_id, provider); SECRET_CACHE_NOTIFY=true
+# broadcasts invalidations to other workers over Postgres NOTIFY
+secret_cache = SecretCache(
+    max_entries=int(os.getenv("SECRET_CACHE_SIZE", "10000")),
+    ttl=float(os.getenv("SECRET_CACHE_TTL", "300")),
+)
+# LLM responses cached for agents with rules.cache_responses; LLM_CACHE_DIR adds an on-disk tier
+_llm_cache_dir = os.getenv("LLM_CACHE_DIR")
+response_cache = ResponseCache(
+    max_entries=int(os.getenv("LLM_CACHE_SIZE", "10000")),
+    ttl=float(os.getenv("LLM_CACHE_TTL", "3600")),
+    disk_path=os.path.join(_llm_cache_dir, "llm_responses.sqlite3") if _llm_cache_dir else None,
+    disk_max_entries=int(os.getenv("LLM_CACHE_DISK_SIZE", "100000")),
+)
+# Concurrent identical prompts (same provider/model) share one upstream call
+LLM_SINGLE_FLIGHT = os.getenv("LLM_SINGLE_FLIGHT", "true").lower() == "true"
+llm_flights = SingleFlight()
+SECRET_CACHE_NOTIFY = os.getenv("SECRET_CACHE_NOTIFY", "false").lower() == "true"
+key_invalidation: Optional[PgNotifyChannel] = None
+# Agent documents read from Postgres are cached per worker (404s for AGENT_CACHE_NEGATIVE_TTL).
+# Writes invalidate locally; AGENT_CACHE_NOTIFY=true also tells the other workers,
+# otherwise they see a change once their copy's AGENT_CACHE_TTL runs out.
+agent_cache = AgentCache(
+    max_entries=int(os.getenv("AGENT_CACHE_SIZE", "10000")),
+    ttl=float(os.getenv("AGENT_CACHE_TTL", "300")),
+    negative_ttl=float(os.getenv("AGENT_CACHE_NEGATIVE_TTL", "5")),
+)
+AGENT_CACHE_NOTIFY = os.getenv("AGENT_CACHE_NOTIFY", "false").lower() == "true"
+agent_invalidation: Optional[PgNotifyChannel] = None
 
 STARKNET_RPC = os.getenv("STARKNET_RPC", "https://starknet-sepolia.public.blastapi.io")
 # Database (Postgres / Supabase). If None, the app uses in-memory fallback stores.
 DATABASE_URL = os.getenv("DATABASE_URL")
 # asyncpg pool (initialized on startup if DATABASE_URL provided)
 db_pool: Optional[asyncpg.pool.Pool] = None
-scheduler_task: Optional[asyncio.Task] = None
+# min_size connections are opened and warmed at startup; max_size caps the
+# connections per worker (keep workers * max_size under the server's limit).
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "5"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "20"))
+# Prepared statements cached per connection; set 0 behind a transaction-mode
+# pooler (pgbouncer, Supabase's pooler port) that can't keep them.
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "256"))
+# Idle connections above min_size are closed after this many seconds
+DB_POOL_MAX_INACTIVE = float(os.getenv("DB_POOL_MAX_INACTIVE", "300"))
+DB_COMMAND_TIMEOUT = float(os.getenv("DB_COMMAND_TIMEOUT", "30"))
+# Startup/shutdown sequencing; each component gets SHUTDOWN_DRAIN_TIMEOUT seconds to drain
+lifecycle = Lifecycle(drain_timeout=float(os.getenv("SHUTDOWN_DRAIN_TIMEOUT", "30")))
+db_timings = QueryTimings()
+# Optional write-behind buffering of actions/proofs/events inserts (Postgres only)
+WRITE_BEHIND = os.getenv("WRITE_BEHIND", "false").lower() == "true"
+write_buffer: Optional[WriteBehindBuffer] = None
+# Per-agent analytics rollups, updated as actions are written (agent_rollups table with Postgres)
+analytics = AgentRollups(flush_interval=float(os.getenv("ANALYTICS_FLUSH_INTERVAL", "1")))
+ANALYTICS_BACKFILL_ON_START = os.getenv("ANALYTICS_BACKFILL_ON_START", "false").lower() == "true"
+# With SCHEDULER_DISTRIBUTED=true (Postgres) workers split schedules by leased partitions
+SCHEDULER_DISTRIBUTED = os.getenv("SCHEDULER_DISTRIBUTED", "false").lower() == "true"
+SCHEDULER_PARTITIONS = int(os.getenv("SCHEDULER_PARTITIONS", "64"))
+schedule_leases: Optional[ScheduleLeaseManager] = None
+schedule_notify: Optional[PgNotifyChannel] = None
+# Agent runs go through a bounded queue with per-user / per-provider concurrency caps
+run_engine = RunEngine(
+    workers=int(os.getenv("RUN_WORKERS", "16")),
+    max_queue=int(os.getenv("RUN_QUEUE_MAX", "1000")),
+    per_user=int(os.getenv("RUN_PER_USER", "4")),
+    per_provider=int(os.getenv("RUN_PER_PROVIDER", "8")),
+    provider_limits=parse_limits(os.getenv("RUN_PROVIDER_LIMITS", "")),
+)
 REGISTRY_CONTRACT = os.getenv("REGISTRY_CONTRACT", "0x049d36570d4e46f48e99674bd3fcc84644ddd6b96f7c741b1562b82f9e004dc7")
 VERIFIER_CONTRACT = os.getenv("VERIFIER_CONTRACT", "0x04a8f2e9c36f5b8d3e1234567890abcdef1234567890abcdef1234567890abcd")
 MARKETPLACE_CONTRACT = os.getenv("MARKETPLACE_CONTRACT", "0x05b9e3d0f47a6c8e2d3456789abcdef0123456789abcdef0123456789abcdef")
+# Shared keep-alive HTTP clients for LLM providers (one pool per provider)
+llm_clients = LLMClientRegistry(load_provider_configs())
+# Per-(provider, key) RPM/TPM throttling, Retry-After aware retries and a per-provider
+# circuit breaker; LLM_RATE_LIMITS="groqcloud=rpm:30,tpm:6000;gemini=rpm:15"
+llm_guard = ProviderGuard(
+    llm_clients,
+    quotas=parse_quotas(os.getenv("LLM_RATE_LIMITS", "")),
+    max_retries=int(os.getenv("LLM_MAX_RETRIES", "3")),
+    backoff_base=float(os.getenv("LLM_BACKOFF_BASE", "0.5")),
+    backoff_max=float(os.getenv("LLM_BACKOFF_MAX", "20")),
+    max_retry_after=float(os.getenv("LLM_MAX_RETRY_AFTER", "60")),
+    max_queue_wait=float(os.getenv("LLM_MAX_QUEUE_WAIT", "30")),
+    breaker_threshold=int(os.getenv("LLM_BREAKER_THRESHOLD", "5")),
+    breaker_reset=float(os.getenv("LLM_BREAKER_RESET", "30")),
+)
+# Providers: groqcloud, gemini, the offline "local" simulator (LOCAL_LLM_*) and any
+# registered by modules in LLM_PROVIDER_PLUGINS. LLM_EST_OUTPUT_TOKENS is the
+# completion size assumed when reserving TPM before the provider reports usage.
+load_providers(
+    llm_clients,
+    est_output_tokens=int(os.getenv("LLM_EST_OUTPUT_TOKENS", "256")),
+    plugins=os.getenv("LLM_PROVIDER_PLUGINS", ""),
+)
+# Starknet submitter (in-process simulated chain unless CHAIN_BACKEND says otherwise),
+# with registry/verifier/marketplace calls aggregated into per-account multicalls
+chain_submitter = create_batcher(create_submitter())
+# Merkle batching of action proofs for agents that opt in via rules.aggregate_proofs
+proof_aggregator = ProofAggregator(
+    chain_submitter,
+    VERIFIER_CONTRACT,
+    batch_size=int(os.getenv("PROOF_BATCH_SIZE", "256")),
+    max_age=float(os.getenv("PROOF_BATCH_MAX_AGE", "10")),
+    per_agent=os.getenv("PROOF_BATCH_SCOPE", "agent") == "agent",
+)
 
 # CORS
 app.add_middleware(
@@ -56,16 +289,25 @@ app.add_middleware(
 # ==========================================
 # IN-MEMORY STORAGE
 # ==========================================
-agents_db = {}
-proofs_db = {}
+agents_db = IndexedTable()
+proofs_db = IndexedTable()
 api_keys_db = {}
 subscriptions_db = {}
-actions_db = {}
+actions_db = IndexedTable()
 listings_db = {}
 purchases_db = {}
-schedules_db = {}
+schedules_db = IndexedTable()
 events_db = {}
 
+# Secondary indexes so per-agent / per-owner reads don't scan whole tables.
+# In-place edits to indexed fields must be followed by <table>.reindex(id).
+agents_db.add_index("creator", lambda a: a.get("creator"))
+# full-text/capability search and sorted views over listed public agents
+marketplace_index = agents_db.attach_index("marketplace", MarketplaceIndex())
+actions_db.add_index("agent", lambda a: a.get("agent_id"), sort_fn=lambda a: a.get("created_at") or a.get("timestamp") or "")
+proofs_db.add_index("agent", lambda p: p.get("agent_id"), sort_fn=lambda p: p.get("created_at") or "")
+schedules_db.add_index("agent", lambda s: s.get("agent_id"))
+
 # ==========================================
 # MODELS
 # ==========================================
@@ -84,6 +326,7 @@ class LLMRequest(BaseModel):
     prompt: str
     provider: str = "groqcloud"
     model: Optional[str] = None
+    stream: bool = False
 
 class ProofRequest(BaseModel):
     agent_id: str
@@ -109,58 +352,140 @@ def decrypt_data(encrypted: str) -> str:
     """Decrypt sensitive data"""
     return cipher.decrypt(encrypted.encode()).decode()
 
+async def get_api_key(user_id: str, provider: str) -> str:
+    """Decrypted API key for a user's provider, served from the secret cache when warm"""
+    if not requires_api_key(provider):
+        return ""
+    async def load() -> Optional[str]:
+        if db_pool:
+            async with db_pool.acquire() as conn:
+                row = await conn.fetchrow("SELECT encrypted_key FROM api_keys WHERE user_id = $1 AND provider = $2", user_id, provider)
+                return decrypt_data(row["encrypted_key"]) if row else None
+        if user_id not in api_keys_db or provider not in api_keys_db[user_id]:
+            return None
+        return decrypt_data(api_keys_db[user_id][provider])
+
+    api_key = await secret_cache.get_or_load(user_id, provider, load)
+    if api_key is None:
+        raise HTTPException(400, f"API key not configured for {provider}")
+    return api_key
+
+async def invalidate_api_key(user_id: str, provider: str):
+    """Drop a cached key locally and, if enabled, on every other worker"""
+    secret_cache.invalidate(user_id, provider)
+    if key_invalidation:
+        await key_invalidation.publish({"user_id": user_id, "provider": provider})
+
 def generate_mock_tx_hash(data: str) -> str:
     """Generate realistic-looking transaction hash"""
     return "0x" + compute_hash(f"{data}{time.time()}")[:64]
 
-def generate_mock_block_number() -> int:
-    """Generate realistic block number"""
-    return int(time.time()) % 1000000 + 500000
-
 async def call_llm(prompt: str, provider: str, api_key: str, model: Optional[str] = None) -> str:
-    """Call LLM provider (GroqCloud or Gemini)"""
+    """Call an LLM provider (see llm_providers), throttled and retried by llm_guard"""
+    text, _ = await complete_llm(prompt, provider, api_key, model)
+    return text
+
+
+async def complete_llm(prompt: str, provider: str, api_key: str, model: Optional[str] = None) -> Tuple[str, int]:
+    """call_llm that also returns the tokens used (the estimate if the provider reports none)"""
+    started = time.perf_counter()
     try:
-        if provider == "groqcloud":
-            url = "https://api.groq.com/openai/v1/chat/completions"
-            headers = {
-                "Authorization": f"Bearer {api_key}",
-                "Content-Type": "application/json"
-            }
-            payload = {
-                "model": model or "llama-3.3-70b-versatile",
-                "messages": [{"role": "user", "content": prompt}],
-                "temperature": 0.7
-            }
-            
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.post(url, json=payload, headers=headers)
-                if response.status_code != 200:
-                    raise HTTPException(500, f"GroqCloud API error: {response.text}")
-                data = response.json()
-                return data["choices"][0]["message"]["content"]
-        
-        elif provider == "gemini":
-            model_name = model or "gemini-1.5-flash"
-            url = f"https://generativelanguage.googleapis.com/v1beta/models/{model_name}:generateContent?key={api_key}"
-            headers = {"Content-Type": "application/json"}
-            payload = {
-                "contents": [{"parts": [{"text": prompt}]}]
-            }
-            
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.post(url, json=payload, headers=headers)
-                if response.status_code != 200:
-                    raise HTTPException(500, f"Gemini API error: {response.text}")
-                data = response.json()
-                return data["candidates"][0]["content"]["parts"][0]["text"]
-        
-        else:
-            raise HTTPException(400, f"Unsupported provider: {provider}")
-    
-    except httpx.TimeoutException:
-        raise HTTPException(504, "LLM provider timeout")
+        text, tokens = await get_provider(provider).complete(llm_guard, prompt, api_key, model)
+    except Exception as e:
+        LLM_REQUEST_SECONDS.observe(time.perf_counter() - started, provider, "complete", "error")
+        raise llm_http_error(e)
+    LLM_REQUEST_SECONDS.observe(time.perf_counter() - started, provider, "complete", "ok")
+    LLM_TOKENS.observe(tokens, provider)
+    return text, tokens
+
+
+async def stream_llm(prompt: str, provider: str, api_key: str, model: Optional[str] = None,
+                     on_chunk: Optional[Callable[[str], None]] = None) -> Tuple[str, str, int]:
+    """Stream a completion, handing each text chunk to on_chunk as it arrives.
+
+    Returns (text, sha256 of text, tokens used); the hash is built up chunk by
+    chunk so the output is never re-hashed after the stream ends.
+    """
+    hasher = hashlib.sha256()
+    parts: List[str] = []
+    usage = None
+    started = time.perf_counter()
+    try:
+        llm = get_provider(provider)
+        async for text, tokens in llm.stream(llm_guard, prompt, api_key, model):
+            usage = tokens or usage
+            if text:
+                if not parts:
+                    LLM_FIRST_TOKEN_SECONDS.observe(time.perf_counter() - started, provider)
+                hasher.update(text.encode())
+                parts.append(text)
+                if on_chunk:
+                    on_chunk(text)
     except Exception as e:
-        raise HTTPException(500, f"LLM call failed: {str(e)}")
+        LLM_REQUEST_SECONDS.observe(time.perf_counter() - started, provider, "stream", "error")
+        raise llm_http_error(e)
+    LLM_REQUEST_SECONDS.observe(time.perf_counter() - started, provider, "stream", "ok")
+    usage = usage or llm.estimate_tokens(prompt)
+    LLM_TOKENS.observe(usage, provider)
+    return "".join(parts), hasher.hexdigest(), usage
+
+
+def response_cache_ttl(agent: Dict[str, Any]) -> Optional[float]:
+    """Agents opt into response caching with rules.cache_responses (true, or a TTL in seconds)"""
+    setting = (agent.get("rules") or {}).get("cache_responses")
+    if setting is True:
+        return response_cache.ttl
+    if isinstance(setting, (int, float)) and not isinstance(setting, bool) and setting > 0:
+        return float(setting)
+    return None
+
+
+async def agent_completion(agent: Dict[str, Any], prompt: str, provider: str, api_key: str, model: Optional[str] = None,
+                           on_chunk: Optional[Callable[[str], None]] = None) -> Tuple[str, str]:
+    """Completion for an agent prompt, served from the response cache when the agent opts in.
+
+    Returns (text, output_hash). A cache hit is passed to on_chunk in one piece.
+    Identical non-streamed prompts for the same agent and API key in flight at
+    the same time share one upstream call.
+    """
+    ttl = response_cache_ttl(agent)
+    key = cache_key(provider, model, agent.get("metadata_hash"), prompt) if ttl else None
+    if key:
+        cached = await response_cache.get(key)
+        if cached:
+            if on_chunk:
+                on_chunk(cached.text)
+            return cached.text, cached.output_hash
+    if on_chunk:
+        text, output_hash, tokens = await stream_llm(prompt, provider, api_key, model, on_chunk)
+        if key:
+            await response_cache.put(key, text, output_hash, tokens, ttl)
+        return text, output_hash
+
+    async def complete() -> Tuple[str, str]:
+        text, tokens = await complete_llm(prompt, provider, api_key, model)
+        output_hash = compute_hash(text)
+        if key:
+            await response_cache.put(key, text, output_hash, tokens, ttl)
+        return text, output_hash
+
+    if LLM_SINGLE_FLIGHT:
+        # only callers with the same key share a call: it is billed to, and fails for, that key
+        flight = (provider, model, agent.get("id"), agent.get("metadata_hash"), key_fingerprint(api_key or ""), prompt)
+        return await llm_flights.do(flight, complete)
+    return await complete()
+
+
+def llm_http_error(e: Exception) -> HTTPException:
+    """Map a provider call failure onto the HTTPException the API returns."""
+    if isinstance(e, HTTPException):
+        return e
+    if isinstance(e, ProviderError):
+        headers = {"Retry-After": str(max(1, round(e.retry_after)))} if e.retry_after is not None else None
+        return HTTPException(e.status, str(e), headers=headers)
+    if isinstance(e, httpx.TimeoutException):
+        return HTTPException(504, "LLM provider timeout")
+    return HTTPException(500, f"LLM call failed: {str(e)}")
 
 
 async def make_tx_receipt(action_desc: str) -> Dict[str, Any]:
@@ -172,44 +497,68 @@ async def make_tx_receipt(action_desc: str) -> Dict[str, Any]:
     }
 
 
-async def run_agent_action(agent_id: str, user_id: str, payload: Dict[str, Any], trigger: str = "manual") -> Dict[str, Any]:
-    """Core runner used by endpoints and scheduler. Calls the agent's LLM provider, stores action, proof, and returns tx receipt."""
-    # load agent
+async def run_agent_action(agent_id: str, user_id: str, payload: Dict[str, Any], trigger: str = "manual",
+                           on_chunk: Optional[Callable[[str], None]] = None) -> Dict[str, Any]:
+    """Core runner used by endpoints and scheduler. Calls the agent's LLM provider, stores action, proof, and returns tx receipt.
+
+    With ``on_chunk`` the completion is streamed and each chunk is passed on as it arrives.
+    """
+    provider = payload.get("provider", "groqcloud")
+    store = AgentRunStore(db_pool, db_timings, write_buffer) if db_pool else None
+
+    # load agent and api key
     agent = None
-    if db_pool:
-        async with db_pool.acquire() as conn:
-            row = await conn.fetchrow("SELECT data FROM agents WHERE id = $1", agent_id)
-            if not row:
-                raise HTTPException(404, "Agent not found")
-            agent = row["data"]
-    else:
-        if agent_id not in agents_db:
+    if store:
+        fetched_key = False
+        encrypted_key = None
+        key_generation = None
+
+        async def load_agent():
+            # on a cache miss, one query for the agent and the caller's encrypted key
+            nonlocal fetched_key, encrypted_key, key_generation
+            # snapshot before the read, so a key write racing the query can't be cached stale
+            key_generation = secret_cache.generation(user_id, provider)
+            with STAGE_SECONDS.time("run", "db_load"):
+                agent, version, encrypted_key = await store.load_agent_and_key(agent_id, user_id, provider)
+            fetched_key = True
+            return agent, version
+
+        agent = await agent_cache.get_or_load(agent_id, load_agent)
+        if not agent:
             raise HTTPException(404, "Agent not found")
-        agent = agents_db[agent_id]
 
-    # determine provider and api key
-    provider = payload.get("provider", "groqcloud")
-    api_key = None
-    if db_pool:
-        async with db_pool.acquire() as conn:
-            row = await conn.fetchrow("SELECT encrypted_key FROM api_keys WHERE user_id = $1 AND provider = $2", user_id, provider)
-            if not row:
+        if fetched_key:
+            async def load_key() -> Optional[str]:
+                with STAGE_SECONDS.time("run", "decrypt"):
+                    return decrypt_data(encrypted_key) if encrypted_key else None
+
+            api_key = await secret_cache.get_or_load(user_id, provider, load_key, key_generation)
+            if api_key is None and requires_api_key(provider):
                 raise HTTPException(400, f"API key not configured for {provider}")
-            api_key = decrypt_data(row["encrypted_key"])
+        else:
+            with STAGE_SECONDS.time("run", "api_key"):
+                api_key = await get_api_key(user_id, provider)
     else:
-        if user_id not in api_keys_db or provider not in api_keys_db[user_id]:
-            raise HTTPException(400, f"API key not configured for {provider}")
-        api_key = decrypt_data(api_keys_db[user_id][provider])
+        if agent_id not in agents_db:
+            raise HTTPException(404, "Agent not found")
+        agent = agents_db[agent_id]
+        with STAGE_SECONDS.time("run", "api_key"):
+            api_key = await get_api_key(user_id, provider)
 
     # build prompt
     prompt = payload.get("prompt", "")
     enhanced_prompt = f"Agent {agent.get('name')} executing trigger={trigger}: {prompt}"
 
     # Call LLM
-    result_text = await call_llm(enhanced_prompt, provider, api_key, payload.get("model"))
+    started = time.perf_counter()
+    result_text, output_hash = await agent_completion(agent, enhanced_prompt, provider, api_key, payload.get("model"), on_chunk)
+    elapsed = time.perf_counter() - started
+    STAGE_SECONDS.observe(elapsed, "run", "llm")
+    latency_ms = round(elapsed * 1000, 3)
 
     # generate proof
-    proof = generate_noir_proof_mock(agent, result_text, payload.get("action_type", "run"))
+    with STAGE_SECONDS.time("run", "proof"):
+        proof = generate_noir_proof_mock(agent, result_text, payload.get("action_type", "run"), output_hash)
 
     # persist action, proof, and event
     action_id = compute_hash(f"{agent_id}{user_id}{time.time()}")[:16]
@@ -220,40 +569,153 @@ async def run_agent_action(agent_id: str, user_id: str, payload: Dict[str, Any],
         "payload": payload,
         "result": result_text,
         "proof_hash": proof["proof_hash"],
+        "latency_ms": latency_ms,
         "created_at": datetime.utcnow().isoformat()
     }
 
-    if db_pool:
-        async with db_pool.acquire() as conn:
-            await conn.execute("INSERT INTO actions (agent_id, user_id, action_type, payload) VALUES ($1,$2,$3,$4)", agent_id, user_id, payload.get("action_type","run"), json.dumps(action_record))
-            await conn.execute("INSERT INTO proofs (proof_hash, agent_id, action_payload_hash, proof) VALUES ($1,$2,$3,$4) ON CONFLICT (proof_hash) DO NOTHING;", proof["proof_hash"], agent_id, proof["action_payload_hash"], json.dumps(proof))
-            await conn.execute("INSERT INTO events (type, payload) VALUES ($1, $2)", "action", json.dumps({"action_id": action_id, "agent_id": agent_id}))
-    else:
-        actions_db[action_id] = action_record
-        proofs_db[proof["proof_hash"]] = {"id": proof["proof_hash"], "agent_id": agent_id, "proof": proof, "created_at": datetime.utcnow().isoformat(), "verified": True}
+    aggregate = wants_proof_aggregation(agent)
+    proof_record = {"id": proof["proof_hash"], "agent_id": agent_id, "proof": proof, "created_at": datetime.utcnow().isoformat(), "verified": not aggregate}
+
+    with STAGE_SECONDS.time("run", "persist"):
+        if store:
+            # action, proof and event in one atomic statement
+            await store.record_run(action_record, proof)
+        else:
+            actions_db[action_id] = action_record
+            proofs_db[proof["proof_hash"]] = proof_record
+        analytics.record(agent_id, runs=1, proofs=1, latency_ms=latency_ms)
+
+    # high-frequency agents commit proofs through a Merkle batch instead of one tx each
+    with STAGE_SECONDS.time("run", "chain"):
+        batch = await enqueue_proof_for_batch(proof["proof_hash"], proof_record) if aggregate else None
 
-    # mock tx
-    tx = await make_tx_receipt(f"run:{agent_id}:{action_id}")
+        # mock tx
+        tx = await make_tx_receipt(f"run:{agent_id}:{action_id}")
 
     return {
         "action_id": action_id,
         "result": result_text,
         "proof": proof,
+        "proof_batch": batch,
         "tx": tx
     }
 
-def generate_noir_proof_mock(agent_config: Dict, action_output: str, action_type: str) -> Dict[str, Any]:
-    """Generate mock ZK proof (simulates Noir circuit)"""
+async def run_scheduled_action(schedule: Dict[str, Any]):
+    """Scheduler callback: one run of the schedule's agent, queued behind manual runs"""
+    user_id = schedule.get("owner", "system")
+    payload = {"prompt": "scheduled run", "provider": "groqcloud"}
+    await run_engine.run(
+        lambda: run_agent_action(schedule["agent_id"], user_id, payload, trigger="scheduled"),
+        user_id=user_id,
+        provider=payload["provider"],
+        lane="scheduled",
+    )
+
+async def claim_schedule(entry, due: float) -> bool:
+    """Persist the next fire time; with Postgres only the worker whose compare-and-set wins runs the tick"""
+    if not db_pool:
+        # in-memory records were already updated in place
+        return True
+    return await claim_tick(db_pool, scheduler, entry, due)
+
+async def load_schedules() -> List[Dict[str, Any]]:
+    """Saved schedules with their persisted next_run_at"""
+    if not db_pool:
+        return list(schedules_db.values())
+    return await fetch_schedules(db_pool)
+
+async def load_schedule_partitions(partitions):
+    """Lease gained: start firing the schedules in these partitions"""
+    for record in await fetch_schedules(db_pool, partitions):
+        try:
+            scheduler.add(record)
+        except (KeyError, ValueError):
+            print(f"⚠️ ignoring invalid schedule {record.get('id')}")
+
+async def drop_schedule_partitions(partitions):
+    """Lease lost or handed back: stop firing the schedules in these partitions"""
+    for schedule_id, entry in list(scheduler.entries.items()):
+        if entry.record.get("partition") in partitions:
+            scheduler.remove(schedule_id)
+
+# schedule loads started from NOTIFY callbacks, held so they aren't collected mid-run
+schedule_load_tasks: set = set()
+
+def on_schedule_load_done(task: asyncio.Task):
+    schedule_load_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.error("loading a notified schedule failed", exc_info=task.exception())
+
+async def finish_schedule_loads():
+    await asyncio.gather(*schedule_load_tasks, return_exceptions=True)
+
+def on_schedule_notice(msg: Dict[str, Any]):
+    """Another worker created a schedule; load it if its partition is ours"""
+    if schedule_leases and msg.get("partition") in schedule_leases.owned:
+        task = asyncio.create_task(load_schedule_partition_row(msg["id"]))
+        schedule_load_tasks.add(task)
+        task.add_done_callback(on_schedule_load_done)
+
+async def reload_owned_schedules():
+    """Schedule notices were missed while the channel was down; re-read our partitions"""
+    if schedule_leases and schedule_leases.owned:
+        await load_schedule_partitions(set(schedule_leases.owned))
+
+async def load_schedule_partition_row(schedule_id: str):
+    for record in await fetch_schedules(db_pool, schedule_id=schedule_id):
+        scheduler.add(record)
+
+# Recurring runs fire from a min-heap keyed by next_run_at instead of a periodic rescan
+scheduler = Scheduler(
+    run_scheduled_action,
+    claim_schedule,
+    max_concurrent=int(os.getenv("SCHEDULER_MAX_CONCURRENT", "32")),
+    min_interval=float(os.getenv("SCHEDULER_MIN_INTERVAL", "1")),
+    on_lag=SCHEDULER_LAG_SECONDS.observe,
+)
+
+def wants_proof_aggregation(agent: Dict[str, Any]) -> bool:
+    """Agents opt into Merkle-batched verification with rules.aggregate_proofs"""
+    return bool((agent.get("rules") or {}).get("aggregate_proofs"))
+
+async def enqueue_proof_for_batch(proof_id: str, proof_record: Dict[str, Any]) -> Dict[str, Any]:
+    """Add a proof to its Merkle batch; the record is marked verified once the root is accepted"""
+    async def on_verified(receipt: TxReceipt):
+        if not receipt.accepted:
+            return
+        # a re-queued proof lands in a later batch than the one it was first added to
+        inclusion = proof_aggregator.inclusion_proof(proof_id)
+        batch_id = inclusion["batch_id"] if inclusion else proof_record.get("batch_id")
+        proof_record["tx_hash"] = receipt.transaction_hash
+        proof_record["block_number"] = receipt.block_number
+        proof_record["batch_id"] = batch_id
+        proof_record["verified"] = True
+        proof_record["verified_at"] = datetime.utcnow().isoformat()
+        if db_pool:
+            store = AgentRunStore(db_pool, db_timings, write_buffer)
+            if not await store.mark_proof_verified(proof_record["proof"]["proof_hash"], receipt.transaction_hash, receipt.block_number, batch_id):
+                logger.warning("verified proof %s has no row to update", proof_id)
+
+    batch = await proof_aggregator.add(proof_id, proof_record["proof"]["proof_hash"], proof_record["agent_id"], on_verified=on_verified)
+    proof_record["batch_id"] = batch["batch_id"]
+    return batch
+
+def generate_noir_proof_mock(agent_config: Dict, action_output: str, action_type: str, output_hash: Optional[str] = None) -> Dict[str, Any]:
+    """Generate mock ZK proof (simulates Noir circuit)
+
+    The proof commits to the output through its hash; pass ``output_hash``
+    when it was already computed (e.g. incrementally while streaming).
+    """
+    action_payload_hash = output_hash or compute_hash(action_output)
     proof_input = {
         "agent_id": agent_config["id"],
         "config_hash": agent_config["metadata_hash"],
         "action_type": action_type,
-        "output": action_output,
+        "action_payload_hash": action_payload_hash,
         "timestamp": datetime.utcnow().isoformat()
     }
     
-    proof_hash = compute_hash(json.dumps(proof_input, sort_keys=True))
-    action_payload_hash = compute_hash(action_output)
+    proof_hash = compute_hash(canonical(proof_input))
     
     return {
         "proof_hash": proof_hash,
@@ -267,166 +729,88 @@ def generate_noir_proof_mock(agent_config: Dict, action_output: str, action_type
         "prover": "garaga_mock"
     }
 
-async def submit_to_starknet_mock(contract_address: str, function: str, calldata: Dict) -> Dict[str, Any]:
-    """Mock Starknet transaction submission"""
-    # Simulate blockchain delay
-    await httpx.AsyncClient().get("http://httpbin.org/delay/2", timeout=3)  # 2 second delay
-    
-    tx_hash = generate_mock_tx_hash(f"{function}{json.dumps(calldata)}")
-    block_number = generate_mock_block_number()
-    
-    return {
-        "transaction_hash": tx_hash,
-        "block_number": block_number,
-        "contract_address": contract_address,
-        "function": function,
-        "status": "ACCEPTED_ON_L2",
-        "explorer_url": f"https://sepolia.starkscan.co/tx/{tx_hash}"
-    }
+async def submit_to_starknet_mock(contract_address: str, function: str, calldata: Dict, on_receipt=None) -> Dict[str, Any]:
+    """Submit a Starknet transaction without waiting for block inclusion.
 
+    Returns the pending tx handle as a dict (block_number is None until the
+    receipt arrives); ``on_receipt`` runs in the background once it does.
+    """
+    pending = await chain_submitter.submit(contract_address, function, calldata)
+    if on_receipt:
+        pending.on_receipt(on_receipt)
+    return pending.to_dict()
 
-    # ---------------------------
-    # Database helper and startup
-    # ---------------------------
-    async def init_db():
-        global db_pool
-        if not DATABASE_URL:
-            return
+# ==========================================
+# DATABASE POOL
+# ==========================================
+async def init_db():
+    """Open the Postgres pool (no-op without DATABASE_URL); schema comes from migrations"""
+    global db_pool
+    if not DATABASE_URL:
+        return
+    pool = await asyncpg.create_pool(
+        DATABASE_URL,
+        min_size=DB_POOL_MIN_SIZE,
+        max_size=DB_POOL_MAX_SIZE,
+        statement_cache_size=DB_STATEMENT_CACHE_SIZE,
+        max_inactive_connection_lifetime=DB_POOL_MAX_INACTIVE,
+        command_timeout=DB_COMMAND_TIMEOUT,
+        # json/jsonb as Python objects, via orjson
+        init=register_json_codecs,
+    )
+    db_pool = InstrumentedPool(pool, DB_POOL_WAIT_SECONDS, DB_POOL_IN_USE) if METRICS_ENABLED else pool
+
+async def warm_pool():
+    """Check out min_size connections at once so the first requests don't pay for connects"""
+    conns = await asyncio.gather(*(db_pool.acquire() for _ in range(DB_POOL_MIN_SIZE)))
+    try:
+        await asyncio.gather(*(conn.fetchval("SELECT 1") for conn in conns))
+    finally:
+        for conn in conns:
+            await db_pool.release(conn)
 
-        db_pool = await asyncpg.create_pool(DATABASE_URL)
-
-        # Create minimal schema if it doesn't exist
-        create_sql = [
-            """
-            CREATE TABLE IF NOT EXISTS agents (
-                id TEXT PRIMARY KEY,
-                owner TEXT NOT NULL,
-                data JSONB NOT NULL,
-                created_at TIMESTAMP WITH TIME ZONE DEFAULT now(),
-                status TEXT
-            );
-            """,
-            """
-            CREATE TABLE IF NOT EXISTS api_keys (
-                user_id TEXT NOT NULL,
-                provider TEXT NOT NULL,
-                encrypted_key TEXT NOT NULL,
-                PRIMARY KEY (user_id, provider)
-            );
-            """,
-            """
-            CREATE TABLE IF NOT EXISTS actions (
-                id SERIAL PRIMARY KEY,
-                agent_id TEXT,
-                user_id TEXT,
-                action_type TEXT,
-                payload JSONB,
-                created_at TIMESTAMP WITH TIME ZONE DEFAULT now()
-            );
-            """,
-            """
-            CREATE TABLE IF NOT EXISTS proofs (
-                id SERIAL PRIMARY KEY,
-                proof_hash TEXT UNIQUE,
-                agent_id TEXT,
-                action_payload_hash TEXT,
-                proof JSONB,
-                created_at TIMESTAMP WITH TIME ZONE DEFAULT now()
-            );
-            """,
-            """
-            CREATE TABLE IF NOT EXISTS listings (
-                id TEXT PRIMARY KEY,
-                seller TEXT NOT NULL,
-                data JSONB NOT NULL,
-                created_at TIMESTAMP WITH TIME ZONE DEFAULT now()
-            );
-            """,
-            """
-            CREATE TABLE IF NOT EXISTS purchases (
-                id SERIAL PRIMARY KEY,
-                listing_id TEXT,
-                buyer TEXT,
-                data JSONB,
-                created_at TIMESTAMP WITH TIME ZONE DEFAULT now()
-            );
-            """,
-            """
-            CREATE TABLE IF NOT EXISTS schedules (
-                id TEXT PRIMARY KEY,
-                owner TEXT,
-                cron TEXT,
-                data JSONB,
-                created_at TIMESTAMP WITH TIME ZONE DEFAULT now()
-            );
-            """,
-            """
-            CREATE TABLE IF NOT EXISTS events (
-                id SERIAL PRIMARY KEY,
-                type TEXT,
-                payload JSONB,
-                created_at TIMESTAMP WITH TIME ZONE DEFAULT now()
-            );
-            """,
-        ]
+async def close_db():
+    global db_pool
+    if db_pool:
+        pool, db_pool = db_pool, None
+        await pool.close()
+
+async def drain_proof_batches():
+    """Seal open Merkle batches so queued proofs are submitted before exit"""
+    await proof_aggregator.flush()
+    await proof_aggregator.close()
+
+async def invalidate_agent(agent_id: str, version: Optional[int] = None):
+    """Drop a cached agent older than ``version`` locally and, if enabled, on every other worker"""
+    agent_cache.invalidate(agent_id, version)
+    if agent_invalidation:
+        await agent_invalidation.publish({"agent_id": agent_id, "version": version})
 
+async def bump_agent_counters(agent_id: str, **deltas):
+    """Atomically add to the agent's counter columns; no-op without Postgres.
+
+    Cached documents carry no counters, so there is nothing to invalidate.
+    """
+    if db_pool:
         async with db_pool.acquire() as conn:
-            for sql in create_sql:
-                await conn.execute(sql)
+            await increment_agent_counters(conn, agent_id, **deltas)
 
+async def persist_agent_document(agent: Dict[str, Any]):
+    """Write the agent's document and flags (never its counters); no-op without Postgres"""
+    if db_pool:
+        async with db_pool.acquire() as conn:
+            version = await conn.fetchval(UPDATE_AGENT_SQL, *update_agent_args(agent))
+        await invalidate_agent(agent["id"], version)
 
-    @app.on_event("startup")
-    async def on_startup():
-        await init_db()
-        # start scheduler loop
-        global scheduler_task
-        if not scheduler_task:
-            scheduler_task = asyncio.create_task(scheduler_loop())
+async def load_agent_document(agent_id: str) -> Optional[Dict[str, Any]]:
+    """Agent document without counters, through the agent cache (Postgres only)"""
+    async def load():
+        async with db_pool.acquire() as conn:
+            row = await conn.fetchrow(f"SELECT {CACHED_DOCUMENT_SQL} AS data, version FROM agent_documents WHERE id = $1", agent_id)
+        return (row["data"], row["version"]) if row else (None, 0)
 
+    return await agent_cache.get_or_load(agent_id, load)
 
-    @app.on_event("shutdown")
-    async def on_shutdown():
-        global db_pool
-        if db_pool:
-            await db_pool.close()
-        global scheduler_task
-        if scheduler_task:
-            scheduler_task.cancel()
-            try:
-                await scheduler_task
-            except asyncio.CancelledError:
-                pass
-
-
-    async def scheduler_loop():
-        """Background loop that triggers scheduled runs."""
-        while True:
-            try:
-                # read schedules from DB or in-memory
-                schedules = []
-                if db_pool:
-                    async with db_pool.acquire() as conn:
-                        rows = await conn.fetch("SELECT data FROM schedules")
-                        schedules = [r["data"] for r in rows]
-                else:
-                    schedules = list(schedules_db.values())
-
-                for sched in schedules:
-                    # sched expected to have agent_id and interval seconds
-                    agent_id = sched.get("agent_id")
-                    interval = int(sched.get("interval", 60))
-                    last_run = sched.get("_last_run", 0)
-                    now_ts = int(time.time())
-                    if now_ts - last_run >= interval:
-                        # mark last run
-                        sched["_last_run"] = now_ts
-                        # trigger run, run as background fire-and-forget
-                        asyncio.create_task(run_agent_action(agent_id, sched.get("owner","system"), {"prompt": "scheduled run", "provider": "groqcloud"}, trigger="scheduled"))
-
-            except Exception:
-                pass
-
-            await asyncio.sleep(5)
 
 # ==========================================
 # MOCK DATA INITIALIZATION
@@ -444,7 +828,7 @@ def initialize_mock_data():
             "personality": "Analytical, data-driven, risk-aware professional trader",
             "capabilities": ["Predict", "Signal", "Transaction"],
             "data_sources": ["CoinGecko", "DeFiLlama", "Twitter Sentiment"],
-            "rules": {"max_trade_size": 1000, "stop_loss": 0.05},
+            "rules": {"max_trade_size": 1000, "stop_loss": 0.05, "aggregate_proofs": True},
             "visibility": "public",
             "pricing": {"model": "subscription", "price_usd": 99},
             "creator": demo_user,
@@ -456,6 +840,7 @@ def initialize_mock_data():
             "tx_hash": "0x1a2b3c4d5e6f",
             "on_chain_id": "agent_crypto_trader",
             "performance": "+22.5%",
+            "rating": 4.8,
             "subscribers": 24,
             "revenue": 2376.0
         },
@@ -498,6 +883,7 @@ def initialize_mock_data():
             "tx_hash": "0x7f8e9d0c1b2a",
             "on_chain_id": "agent_governance",
             "performance": "+15.2%",
+            "rating": 4.6,
             "subscribers": 12,
             "revenue": 588.0
         }
@@ -605,6 +991,19 @@ def root():
 def health():
     return {"status": "healthy", "timestamp": datetime.utcnow().isoformat()}
 
+@app.get("/api/db/stats")
+async def db_stats():
+    """Per-query timings and connection pool usage"""
+    pool = None
+    if db_pool:
+        pool = {"size": db_pool.get_size(), "idle": db_pool.get_idle_size(), "min": db_pool.get_min_size(), "max": db_pool.get_max_size()}
+    return {
+        "pool": pool,
+        "queries": db_timings.stats(),
+        "write_behind": write_buffer.stats() if write_buffer else None,
+        "lifecycle": lifecycle.stats(),
+    }
+
 # ==========================================
 # API KEYS MANAGEMENT
 # ==========================================
@@ -628,6 +1027,7 @@ async def store_api_key(key_data: APIKeyStore, user_id: str = Depends(get_user_i
         if user_id not in api_keys_db:
             api_keys_db[user_id] = {}
         api_keys_db[user_id][key_data.provider] = encrypted_key
+    await invalidate_api_key(user_id, key_data.provider)
 
     return {
         "success": True,
@@ -649,6 +1049,11 @@ async def list_api_keys(user_id: str = Depends(get_user_id)):
 
     return {"providers": list(api_keys_db[user_id].keys())}
 
+@app.get("/api/keys/cache-stats")
+async def api_key_cache_stats():
+    """Hit/miss counters for the decrypted key cache"""
+    return secret_cache.stats()
+
 # ==========================================
 # AGENT MANAGEMENT
 # ==========================================
@@ -659,12 +1064,12 @@ async def create_agent(agent: AgentCreate, user_id: str = Depends(get_user_id)):
     agent_id = compute_hash(f"{user_id}{agent.name}{datetime.utcnow()}")[:16]
     
     # Compute metadata hash (commitment)
-    metadata_string = json.dumps({
+    metadata_string = canonical({
         "name": agent.name,
         "personality": agent.personality,
         "capabilities": agent.capabilities,
         "rules": agent.rules
-    }, sort_keys=True)
+    })
     
     metadata_hash = compute_hash(metadata_string)
     
@@ -691,15 +1096,9 @@ async def create_agent(agent: AgentCreate, user_id: str = Depends(get_user_id)):
     # Persist agent to DB if available
     if db_pool:
         async with db_pool.acquire() as conn:
-            await conn.execute(
-                "INSERT INTO agents (id, owner, data, created_at, status) VALUES ($1, $2, $3, $4, $5) "
-                "ON CONFLICT (id) DO UPDATE SET data = EXCLUDED.data, status = EXCLUDED.status;",
-                agent_id,
-                user_id,
-                json.dumps(agent_config),
-                datetime.utcnow(),
-                agent_config["status"],
-            )
+            version = await conn.fetchval(INSERT_AGENT_SQL, *insert_agent_args(agent_config, user_id, datetime.utcnow()))
+        # also clears a cached 404 for the id
+        await invalidate_agent(agent_id, version)
 
     return {
         "success": True,
@@ -713,25 +1112,30 @@ async def list_agents(user_id: str = Depends(get_user_id)):
     """List user's agents"""
     if db_pool:
         async with db_pool.acquire() as conn:
-            rows = await conn.fetch("SELECT data FROM agents WHERE owner = $1", user_id)
+            rows = await conn.fetch("SELECT data FROM agent_documents WHERE owner = $1", user_id)
             user_agents = [r["data"] for r in rows]
             return {"agents": user_agents, "count": len(user_agents)}
 
-    user_agents = [a for a in agents_db.values() if a["creator"] == user_id]
+    user_agents = agents_db.lookup("creator", user_id)
     return {"agents": user_agents, "count": len(user_agents)}
 
+@app.get("/api/agents/cache-stats")
+async def agent_cache_stats():
+    """Hit/miss counters for the agent document cache"""
+    return agent_cache.stats()
+
 @app.get("/api/agents/{agent_id}")
 async def get_agent(agent_id: str, user_id: str = Depends(get_user_id)):
     """Get agent details"""
     if db_pool:
+        agent = await load_agent_document(agent_id)
+        if not agent:
+            raise HTTPException(404, "Agent not found")
+        if agent.get("creator") != user_id and agent.get("visibility") == "private":
+            raise HTTPException(403, "Access denied")
         async with db_pool.acquire() as conn:
-            row = await conn.fetchrow("SELECT data FROM agents WHERE id = $1", agent_id)
-            if not row:
-                raise HTTPException(404, "Agent not found")
-            agent = row["data"]
-            if agent.get("creator") != user_id and agent.get("visibility") == "private":
-                raise HTTPException(403, "Access denied")
-            return agent
+            counters = await conn.fetchrow(AGENT_COUNTERS_SQL, agent_id)
+        return {**agent, **dict(counters)} if counters else agent
 
     if agent_id not in agents_db:
         raise HTTPException(404, "Agent not found")
@@ -761,32 +1165,38 @@ async def register_agent(agent_id: str, user_id: str = Depends(get_user_id)):
         "creator": user_id
     }
     
+    async def on_registered(receipt: TxReceipt):
+        agent["block_number"] = receipt.block_number
+        agent["tx_status"] = receipt.status
+        await persist_agent_document(agent)
+
     # Submit to Starknet (mock or real)
-    if MOCK_BLOCKCHAIN:
-        result = await submit_to_starknet_mock(REGISTRY_CONTRACT, "register_agent", calldata)
-    else:
-        # Real Starknet submission would go here
-        result = await submit_to_starknet_mock(REGISTRY_CONTRACT, "register_agent", calldata)
+    with STAGE_SECONDS.time("register", "chain"):
+        if MOCK_BLOCKCHAIN:
+            result = await submit_to_starknet_mock(REGISTRY_CONTRACT, "register_agent", calldata, on_receipt=on_registered)
+        else:
+            # Real Starknet submission would go here
+            result = await submit_to_starknet_mock(REGISTRY_CONTRACT, "register_agent", calldata, on_receipt=on_registered)
     
     # Update agent status
     agent["status"] = "registered"
     agent["tx_hash"] = result["transaction_hash"]
+    agent["tx_status"] = result["status"]
     agent["block_number"] = result["block_number"]
     agent["on_chain_id"] = agent_id
 
     # Persist updated agent to DB if enabled
-    if db_pool:
-        async with db_pool.acquire() as conn:
-            await conn.execute(
-                "UPDATE agents SET data = $1 WHERE id = $2",
-                json.dumps(agent),
-                agent_id,
-            )
+    with STAGE_SECONDS.time("register", "persist"):
+        await persist_agent_document(agent)
     
     return {
         "success": True,
         "agent_id": agent_id,
         "tx_hash": result["transaction_hash"],
+        # the hash is the shared multicall's; poll /api/tx/{call_id} for this call
+        "call_id": result.get("call_id"),
+        "call_index": result.get("call_index"),
+        "tx_status": result["status"],
         "block_number": result["block_number"],
         "explorer_url": result["explorer_url"],
         "contract_address": REGISTRY_CONTRACT,
@@ -806,21 +1216,8 @@ async def execute_llm(request: LLMRequest, user_id: str = Depends(get_user_id)):
     agent = agents_db[request.agent_id]
     
     # Check API key
-    api_key = None
-    if db_pool:
-        async with db_pool.acquire() as conn:
-            row = await conn.fetchrow(
-                "SELECT encrypted_key FROM api_keys WHERE user_id = $1 AND provider = $2",
-                user_id,
-                request.provider,
-            )
-            if not row:
-                raise HTTPException(400, f"API key not configured for {request.provider}")
-            api_key = decrypt_data(row["encrypted_key"])
-    else:
-        if user_id not in api_keys_db or request.provider not in api_keys_db[user_id]:
-            raise HTTPException(400, f"API key not configured for {request.provider}")
-        api_key = decrypt_data(api_keys_db[user_id][request.provider])
+    with STAGE_SECONDS.time("execute", "api_key"):
+        api_key = await get_api_key(user_id, request.provider)
     
     # Build enhanced prompt with agent context
     enhanced_prompt = f"""You are {agent['name']}, an AI agent with the following profile:
@@ -833,31 +1230,65 @@ async def execute_llm(request: LLMRequest, user_id: str = Depends(get_user_id)):
 
 Respond according to your personality and capabilities. Be helpful, accurate, and stay in character."""
     
+    if request.stream:
+        # tokens go out as SSE while the completion arrives; the proof follows in the "done" event
+        chunks: asyncio.Queue = asyncio.Queue()
+
+        async def stream_and_record() -> Dict[str, Any]:
+            with STAGE_SECONDS.time("execute", "llm"):
+                response, output_hash = await agent_completion(agent, enhanced_prompt, request.provider, api_key, request.model, chunks.put_nowait)
+            with STAGE_SECONDS.time("execute", "persist"):
+                return await record_llm_execution(request, agent, response, output_hash)
+
+        return sse_response(chunks, stream_and_record())
+
     # Call LLM
-    response = await call_llm(enhanced_prompt, request.provider, api_key, request.model)
-    
+    with STAGE_SECONDS.time("execute", "llm"):
+        response, output_hash = await agent_completion(agent, enhanced_prompt, request.provider, api_key, request.model)
+    with STAGE_SECONDS.time("execute", "persist"):
+        result = await record_llm_execution(request, agent, response, output_hash)
+    # hot path: plain JSON types, so skip FastAPI's jsonable_encoder pass
+    return ORJSONResponse(result)
+
+
+def sse_response(chunks: asyncio.Queue, outcome) -> StreamingResponse:
+    return StreamingResponse(
+        sse_events(chunks, outcome),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+async def record_llm_execution(request: LLMRequest, agent: Dict[str, Any], response: str, output_hash: str) -> Dict[str, Any]:
+    """Proof and stats for a completed /api/llm/execute call."""
     # Generate proof hash
-    proof_hash = compute_hash(f"{request.agent_id}{request.prompt}{response}{datetime.utcnow()}")
+    proof_hash = compute_hash(f"{request.agent_id}{request.prompt}{output_hash}{datetime.utcnow()}")
     # Persist proof and update agent stats
     if db_pool:
+        proof_row = {
+            "proof_hash": proof_hash,
+            "agent_id": request.agent_id,
+            "action_payload_hash": output_hash,
+            "proof": {"provider": request.provider, "response": response},
+        }
+        if write_buffer:
+            await write_buffer.put("proofs", proof_row)
         async with db_pool.acquire() as conn:
             # store proof record
-            await conn.execute(
-                "INSERT INTO proofs (proof_hash, agent_id, action_payload_hash, proof) VALUES ($1, $2, $3, $4) ON CONFLICT (proof_hash) DO NOTHING;",
-                proof_hash,
-                request.agent_id,
-                compute_hash(response),
-                json.dumps({"provider": request.provider, "response": response}),
-            )
-
-            # update agent action_count
-            row = await conn.fetchrow("SELECT data FROM agents WHERE id = $1", request.agent_id)
-            if row:
-                agent_data = row["data"]
-                agent_data["action_count"] = agent_data.get("action_count", 0) + 1
-                await conn.execute("UPDATE agents SET data = $1 WHERE id = $2", json.dumps(agent_data), request.agent_id)
+            if not write_buffer:
+                await conn.execute(
+                    "INSERT INTO proofs (proof_hash, agent_id, action_payload_hash, proof) VALUES ($1, $2, $3, $4) ON CONFLICT (proof_hash) DO NOTHING;",
+                    proof_row["proof_hash"],
+                    proof_row["agent_id"],
+                    proof_row["action_payload_hash"],
+                    proof_row["proof"],
+                )
+
+            # atomic, no read-modify-write of the document (and no cache eviction)
+            await increment_agent_counters(conn, request.agent_id, action_count=1)
     else:
         agent["action_count"] = agent.get("action_count", 0) + 1
+    analytics.record(request.agent_id, proofs=1)
 
     return {
         "success": True,
@@ -868,6 +1299,28 @@ Respond according to your personality and capabilities. Be helpful, accurate, an
         "timestamp": datetime.utcnow().isoformat(),
     }
 
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Prometheus scrape endpoint (404 when METRICS_ENABLED=false)"""
+    if not metrics.enabled:
+        raise HTTPException(404, "Metrics are disabled")
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/api/llm/cache-stats")
+async def llm_cache_stats():
+    """Response cache hit ratio and tokens saved, plus coalesced in-flight calls"""
+    return {**response_cache.stats(), "single_flight": llm_flights.stats()}
+
+@app.get("/api/llm/providers")
+async def llm_providers():
+    """Registered LLM providers and whether each needs a stored API key"""
+    return {"providers": [{"name": name, "requires_api_key": requires_api_key(name)} for name in provider_names()]}
+
+@app.get("/api/llm/pool-stats")
+async def llm_pool_stats():
+    """Connection pool utilization per LLM provider"""
+    return {"providers": llm_clients.stats(), "limits": llm_guard.stats()}
+
 # ==========================================
 # ZERO-KNOWLEDGE PROOFS
 # ==========================================
@@ -884,6 +1337,7 @@ async def generate_proof(request: ProofRequest, user_id: str = Depends(get_user_
         raise HTTPException(403, "Not authorized")
     
     # Generate proof (mock Noir circuit)
+    # hashed into action_payload_hash, so keep the stdlib bytes
     action_output = json.dumps(request.action_data)
     proof = generate_noir_proof_mock(agent, action_output, request.action_type)
     
@@ -901,6 +1355,12 @@ async def generate_proof(request: ProofRequest, user_id: str = Depends(get_user_
     
     # Update agent stats
     agent["proof_count"] = agent.get("proof_count", 0) + 1
+    await bump_agent_counters(request.agent_id, proof_count=1)
+    analytics.record(request.agent_id, proofs=1)
+
+    batch = None
+    if wants_proof_aggregation(agent):
+        batch = await enqueue_proof_for_batch(proof_id, proofs_db[proof_id])
     
     return {
         "success": True,
@@ -909,17 +1369,61 @@ async def generate_proof(request: ProofRequest, user_id: str = Depends(get_user_
         "action_payload_hash": proof["action_payload_hash"],
         "public_inputs": proof["public_inputs"],
         "circuit": proof["circuit_used"],
-        "prover": proof["prover"]
+        "prover": proof["prover"],
+        "proof_batch": batch
     }
 
+@app.post("/api/proofs/batches/flush")
+async def flush_proof_batches():
+    """Seal all open proof batches and submit their roots now"""
+    sealed = await proof_aggregator.flush()
+    return {"batches": [b.to_dict() for b in sealed]}
+
+@app.get("/api/proofs/batches/{batch_id}")
+async def get_proof_batch(batch_id: str):
+    """Get a proof batch and its Merkle root"""
+    batch = proof_aggregator.batches.get(batch_id)
+    if not batch:
+        raise HTTPException(404, "Batch not found")
+    return {**batch.to_dict(), "proof_ids": batch.proof_ids}
+
+@app.post("/api/proofs/verify-inclusion")
+async def verify_proof_inclusion(body: Dict[str, Any]):
+    """Check a leaf against a batch root with its Merkle path.
+    Expects: { leaf, path, root } as returned by /api/proofs/{proof_id}/inclusion
+    """
+    try:
+        included = verify_inclusion(body["leaf"], body["path"], body["root"])
+    except (KeyError, TypeError, ValueError):
+        raise HTTPException(400, "leaf, path and root are required")
+    return {"included": included}
+
+@app.get("/api/proofs/{proof_id}/inclusion")
+async def get_proof_inclusion(proof_id: str):
+    """Merkle inclusion proof for an aggregated proof"""
+    inclusion = proof_aggregator.inclusion_proof(proof_id)
+    if not inclusion:
+        raise HTTPException(404, "Proof is not part of a batch")
+    return inclusion
+
 @app.post("/api/proofs/{proof_id}/submit")
-async def submit_proof(proof_id: str, user_id: str = Depends(get_user_id)):
-    """Submit proof to Starknet verifier"""
+async def submit_proof(proof_id: str, aggregate: bool = False, user_id: str = Depends(get_user_id)):
+    """Submit proof to Starknet verifier (or to a Merkle batch with ?aggregate=true)"""
     if proof_id not in proofs_db:
         raise HTTPException(404, "Proof not found")
     
     proof_data = proofs_db[proof_id]
     proof = proof_data["proof"]
+
+    if aggregate:
+        batch = await enqueue_proof_for_batch(proof_id, proof_data)
+        return {
+            "success": True,
+            "proof_id": proof_id,
+            "batch_id": batch["batch_id"],
+            "batch_status": batch["status"],
+            "message": "✅ Proof queued for batched verification"
+        }
     
     # Prepare calldata
     calldata = {
@@ -929,36 +1433,46 @@ async def submit_proof(proof_id: str, user_id: str = Depends(get_user_id)):
         "submitter": user_id
     }
     
+    def on_verified(receipt: TxReceipt):
+        proof_data["block_number"] = receipt.block_number
+        proof_data["tx_status"] = receipt.status
+        proof_data["verified"] = True
+        proof_data["verified_at"] = datetime.utcnow().isoformat()
+
     # Submit to Starknet (mock or real)
     if MOCK_BLOCKCHAIN:
-        result = await submit_to_starknet_mock(VERIFIER_CONTRACT, "submit_action_proof", calldata)
+        result = await submit_to_starknet_mock(VERIFIER_CONTRACT, "submit_action_proof", calldata, on_receipt=on_verified)
     else:
         # Real Starknet submission
-        result = await submit_to_starknet_mock(VERIFIER_CONTRACT, "submit_action_proof", calldata)
+        result = await submit_to_starknet_mock(VERIFIER_CONTRACT, "submit_action_proof", calldata, on_receipt=on_verified)
     
-    # Update proof status
+    # Update proof status; verified flips once the receipt lands
     proof_data["tx_hash"] = result["transaction_hash"]
+    proof_data["tx_status"] = result["status"]
     proof_data["block_number"] = result["block_number"]
-    proof_data["verified"] = True
-    proof_data["verified_at"] = datetime.utcnow().isoformat()
     
     return {
         "success": True,
         "proof_id": proof_id,
         "tx_hash": result["transaction_hash"],
+        # the hash is the shared multicall's; poll /api/tx/{call_id} for this call
+        "call_id": result.get("call_id"),
+        "call_index": result.get("call_index"),
+        "tx_status": result["status"],
         "block_number": result["block_number"],
         "explorer_url": result["explorer_url"],
-        "message": "✅ Proof verified on Starknet"
+        "message": "✅ Proof submitted to Starknet verifier"
     }
 
 @app.get("/api/proofs/{agent_id}")
-async def get_agent_proofs(agent_id: str):
-    """Get all proofs for an agent"""
-    agent_proofs = [p for p in proofs_db.values() if p["agent_id"] == agent_id]
-    return {
-        "proofs": agent_proofs,
-        "count": len(agent_proofs)
-    }
+async def get_agent_proofs(
+    agent_id: str,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    fmt: str = Query("json", alias="format"),
+):
+    """Get an agent's proofs, newest first, one keyset page at a time (or all as NDJSON with ?format=ndjson)"""
+    return await agent_history_response("proofs", "proof", proofs_db, agent_id, limit, cursor, fmt)
 
 # ==========================================
 # MARKETPLACE
@@ -986,27 +1500,54 @@ async def list_on_marketplace(
         "creator": user_id
     }
     
+    def on_listed(receipt: TxReceipt):
+        agent["listing_tx_status"] = receipt.status
+
     # Submit to Starknet
     if MOCK_BLOCKCHAIN:
-        result = await submit_to_starknet_mock(MARKETPLACE_CONTRACT, "list_agent", calldata)
+        result = await submit_to_starknet_mock(MARKETPLACE_CONTRACT, "list_agent", calldata, on_receipt=on_listed)
     else:
-        result = await submit_to_starknet_mock(MARKETPLACE_CONTRACT, "list_agent", calldata)
+        result = await submit_to_starknet_mock(MARKETPLACE_CONTRACT, "list_agent", calldata, on_receipt=on_listed)
     
     # Update agent
     agent["marketplace_listed"] = True
     agent["price"] = price
     agent["listing_tx_hash"] = result["transaction_hash"]
+    agent["listing_tx_status"] = result["status"]
+    agents_db.reindex(agent_id)
+    await persist_agent_document(agent)
     
     return {
         "success": True,
         "agent_id": agent_id,
         "price": price,
         "tx_hash": result["transaction_hash"],
+        # the hash is the shared multicall's; poll /api/tx/{call_id} for this call
+        "call_id": result.get("call_id"),
+        "call_index": result.get("call_index"),
+        "tx_status": result["status"],
         "explorer_url": result["explorer_url"],
         "message": "✅ Agent listed on marketplace"
     }
 
 
+@app.get("/api/tx/{tx_hash}")
+async def get_transaction(tx_hash: str):
+    """Poll a submitted transaction for its receipt"""
+    pending = chain_submitter.get(tx_hash)
+    if not pending:
+        raise HTTPException(404, "Transaction not found")
+    return pending.to_dict()
+
+
+@app.get("/api/chain/stats")
+async def chain_stats():
+    """Multicall batch size, queue depth and submit latency"""
+    if isinstance(chain_submitter, MulticallBatcher):
+        return {"multicall": True, **chain_submitter.stats()}
+    return {"multicall": False}
+
+
 # ---------------------------
 # Non-/api compatibility endpoints (user requested paths)
 # ---------------------------
@@ -1028,22 +1569,105 @@ async def agents_register(body: Dict[str, Any], user_id: str = Depends(get_user_
 
 @app.post("/agents/{agent_id}/run")
 async def agents_run(agent_id: str, payload: Dict[str, Any], user_id: str = Depends(get_user_id)):
-    """Run an agent: triggers LLM, stores action, proof, returns tx receipt"""
-    result = await run_agent_action(agent_id, user_id, payload, trigger=payload.get("trigger","manual"))
-    return result
+    """Run an agent: triggers LLM, stores action, proof, returns tx receipt
+
+    With ``"stream": true`` the response is SSE: ``token`` events while the
+    model generates, then ``done`` with the usual result (or ``error``).
+    """
+    chunks: Optional[asyncio.Queue] = asyncio.Queue() if payload.get("stream") else None
+    try:
+        # submit before answering so a full queue is still a plain 429
+        result = run_engine.submit(
+            lambda: run_agent_action(agent_id, user_id, payload, trigger=payload.get("trigger","manual"),
+                                     on_chunk=chunks.put_nowait if chunks else None),
+            user_id=user_id,
+            provider=payload.get("provider", "groqcloud"),
+            lane="manual",
+        )
+    except QueueFullError as e:
+        raise HTTPException(429, str(e), headers={"Retry-After": "1"})
+    if chunks:
+        return sse_response(chunks, result)
+    # hot path: plain JSON types, so skip FastAPI's jsonable_encoder pass
+    return ORJSONResponse(await asyncio.shield(result))
+
+
+@app.get("/api/runs/stats")
+async def run_queue_stats():
+    """Run queue depth, wait times and per-provider concurrency"""
+    return run_engine.stats()
 
 
 @app.get("/agents/{agent_id}/actions")
-async def agents_actions(agent_id: str):
-    # Return actions for agent
+async def agents_actions(
+    agent_id: str,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    fmt: str = Query("json", alias="format"),
+):
+    # Return actions for agent, newest first, one keyset page at a time (or all as NDJSON with ?format=ndjson)
+    return await agent_history_response("actions", "payload", actions_db, agent_id, limit, cursor, fmt)
+
+
+async def agent_history_response(table: str, column: str, store: IndexedTable, agent_id: str, limit: Optional[int], cursor: Optional[str], fmt: str):
+    """Keyset-paginated (created_at, id) listing of an agent's actions or proofs"""
+    if fmt not in ("json", "ndjson"):
+        raise HTTPException(400, "format must be json or ndjson")
+    try:
+        # typed here so a bad cursor is a 400, not a failure mid-stream
+        after = history_position(decode_cursor(cursor), db=bool(db_pool))
+    except ValueError:
+        raise HTTPException(400, "Invalid cursor")
+
+    if fmt == "ndjson":
+        return StreamingResponse(stream_agent_history(table, column, store, agent_id, after, limit), media_type="application/x-ndjson")
+
+    page_size = clamp_limit(limit)
     if db_pool:
+        if after:
+            sql = (f"SELECT id, created_at, {column} FROM {table} WHERE agent_id = $1 AND (created_at, id) < ($2, $3) "
+                   f"ORDER BY created_at DESC, id DESC LIMIT $4")
+            args = (agent_id, after[0], after[1], page_size)
+        else:
+            sql = f"SELECT id, created_at, {column} FROM {table} WHERE agent_id = $1 ORDER BY created_at DESC, id DESC LIMIT $2"
+            args = (agent_id, page_size)
         async with db_pool.acquire() as conn:
-            rows = await conn.fetch("SELECT payload FROM actions WHERE agent_id = $1 ORDER BY created_at DESC", agent_id)
-            actions = [r["payload"] for r in rows]
-            return {"actions": actions}
+            rows = await conn.fetch(sql, *args)
+        items = [r[column] for r in rows]
+        next_position = (rows[-1]["created_at"], rows[-1]["id"]) if len(rows) == page_size else None
+    else:
+        items, next_position = store.page("agent", agent_id, after=after, limit=page_size)
 
-    agent_actions = [a for a in actions_db.values() if a["agent_id"] == agent_id]
-    return {"actions": agent_actions}
+    return {table: items, "count": len(items), "next_cursor": encode_cursor(next_position)}
+
+
+async def stream_agent_history(table: str, column: str, store: IndexedTable, agent_id: str, after, limit: Optional[int]):
+    """Yield an agent's history as NDJSON without materializing it (server-side cursor in Postgres)"""
+    if db_pool:
+        sql = f"SELECT {column} FROM {table} WHERE agent_id = $1"
+        args = [agent_id]
+        if after:
+            sql += " AND (created_at, id) < ($2, $3)"
+            args += list(after)
+        sql += " ORDER BY created_at DESC, id DESC"
+        if limit:
+            sql += f" LIMIT {int(limit)}"
+        async with db_pool.acquire() as conn:
+            async with conn.transaction():
+                async for row in conn.cursor(sql, *args, prefetch=500):
+                    yield ndjson_line(row[column])
+        return
+
+    remaining = limit
+    while remaining is None or remaining > 0:
+        chunk = 500 if remaining is None else min(500, remaining)
+        items, after = store.page("agent", agent_id, after=after, limit=chunk)
+        for item in items:
+            yield ndjson_line(item)
+        if remaining is not None:
+            remaining -= len(items)
+        if after is None:
+            break
 
 
 @app.get("/proofs/{proof_id}")
@@ -1071,8 +1695,12 @@ async def marketplace_purchase(listing_id: str, user_id: str = Depends(get_user_
             if not row:
                 raise HTTPException(404, "Listing not found")
             purchase_id = compute_hash(f"{listing_id}{user_id}{time.time()}")[:16]
-            await conn.execute("INSERT INTO purchases (listing_id, buyer, data) VALUES ($1,$2,$3)", listing_id, user_id, json.dumps({"purchase_id": purchase_id}))
-            await conn.execute("INSERT INTO events (type, payload) VALUES ($1,$2)", "purchase", json.dumps({"purchase_id": purchase_id, "listing_id": listing_id}))
+            await conn.execute("INSERT INTO purchases (listing_id, buyer, data) VALUES ($1,$2,$3)", listing_id, user_id, {"purchase_id": purchase_id})
+            event = {"purchase_id": purchase_id, "listing_id": listing_id}
+            if write_buffer:
+                await write_buffer.put("events", {"type": "purchase", "payload": event})
+            else:
+                await conn.execute("INSERT INTO events (type, payload) VALUES ($1,$2)", "purchase", event)
             tx = await make_tx_receipt(f"purchase:{listing_id}:{purchase_id}")
             return {"success": True, "purchase_id": purchase_id, "tx": tx}
 
@@ -1119,25 +1747,55 @@ async def keys_delete(body: Dict[str, Any], user_id: str = Depends(get_user_id))
     if db_pool:
         async with db_pool.acquire() as conn:
             await conn.execute("DELETE FROM api_keys WHERE user_id = $1 AND provider = $2", user_id, provider)
-            return {"success": True}
-    if user_id in api_keys_db and provider in api_keys_db[user_id]:
+    elif user_id in api_keys_db and provider in api_keys_db[user_id]:
         del api_keys_db[user_id][provider]
+    await invalidate_api_key(user_id, provider)
     return {"success": True}
 
 
 @app.post("/scheduler/set")
 async def scheduler_set(body: Dict[str, Any], user_id: str = Depends(get_user_id)):
-    # body should include agent_id and cron or interval (we'll store simple interval seconds)
+    # body should include agent_id and either cron (5-field, UTC) or interval seconds
     agent_id = body.get("agent_id")
-    interval = int(body.get("interval", 60))
     sched_id = compute_hash(f"{agent_id}{user_id}{time.time()}")[:16]
-    record = {"id": sched_id, "agent_id": agent_id, "owner": user_id, "interval": interval, "created_at": datetime.utcnow().isoformat()}
+    record = {"id": sched_id, "agent_id": agent_id, "owner": user_id, "created_at": datetime.utcnow().isoformat()}
+    try:
+        if body.get("cron"):
+            record["cron"] = str(body["cron"])
+        else:
+            record["interval"] = float(body.get("interval", 60))
+        entry = scheduler.add(record)
+    except (TypeError, ValueError) as e:
+        raise HTTPException(400, f"Invalid schedule: {e}")
     if db_pool:
-        async with db_pool.acquire() as conn:
-            await conn.execute("INSERT INTO schedules (id, owner, cron, data) VALUES ($1,$2,$3,$4)", sched_id, user_id, str(interval), json.dumps(record))
-            return {"success": True, "schedule_id": sched_id}
+        try:
+            async with db_pool.acquire() as conn:
+                record["partition"] = await conn.fetchval(
+                    "INSERT INTO schedules (id, owner, cron, data, next_run_at, partition) "
+                    f"VALUES ($1,$2,$3,$4,$5,{partition_sql('$1', SCHEDULER_PARTITIONS)}) RETURNING partition",
+                    sched_id, user_id, record.get("cron") or str(record["interval"]), record,
+                    datetime.fromtimestamp(entry.next_run_at, timezone.utc),
+                )
+        except Exception:
+            scheduler.remove(sched_id)
+            raise
+        if schedule_leases and record["partition"] not in schedule_leases.owned:
+            # the worker holding this partition's lease picks it up
+            scheduler.remove(sched_id)
+            await schedule_notify.publish({"id": sched_id, "partition": record["partition"]})
+        return {"success": True, "schedule_id": sched_id, "next_run_at": record["next_run_at"]}
     schedules_db[sched_id] = record
-    return {"success": True, "schedule_id": sched_id}
+    return {"success": True, "schedule_id": sched_id, "next_run_at": record["next_run_at"]}
+
+
+@app.get("/scheduler/stats")
+async def scheduler_stats():
+    """Scheduler queue state plus per-schedule fire lag"""
+    return {
+        **scheduler.stats(),
+        "leases": schedule_leases.stats() if schedule_leases else None,
+        "per_schedule": [e.stats() for e in scheduler.entries.values()],
+    }
 
 
 @app.get("/scheduler/{agent_id}")
@@ -1146,33 +1804,40 @@ async def scheduler_for_agent(agent_id: str):
         async with db_pool.acquire() as conn:
             rows = await conn.fetch("SELECT data FROM schedules WHERE data->>'agent_id' = $1", agent_id)
             return {"schedules": [r["data"] for r in rows]}
-    return {"schedules": [s for s in schedules_db.values() if s["agent_id"] == agent_id]}
+    return {"schedules": schedules_db.lookup("agent", agent_id)}
 
 
 @app.get("/analytics/agent/{agent_id}")
 async def analytics_agent(agent_id: str):
-    # Return usage_count, mock accuracy, ROI, run_history
-    usage_count = 0
+    # usage_count and rollups are precomputed; run_history is an index-backed LIMIT 50
+    rollups = await analytics.load(agent_id)
     run_history = []
     if db_pool:
         async with db_pool.acquire() as conn:
-            row = await conn.fetchrow("SELECT count(*)::int FROM actions WHERE agent_id = $1", agent_id)
-            usage_count = row["count"] if row else 0
-            rows = await conn.fetch("SELECT payload FROM actions WHERE agent_id = $1 ORDER BY created_at DESC LIMIT 50", agent_id)
+            rows = await conn.fetch("SELECT payload FROM actions WHERE agent_id = $1 ORDER BY created_at DESC, id DESC LIMIT 50", agent_id)
             run_history = [r["payload"] for r in rows]
     else:
-        entries = [a for a in actions_db.values() if a["agent_id"] == agent_id]
-        usage_count = len(entries)
-        run_history = entries
+        run_history = actions_db.lookup("agent", agent_id, newest_first=True, limit=50)
 
     return {
-        "usage_count": usage_count,
+        "usage_count": rollups["totals"]["runs"],
         "accuracy_score": 0.9,  # mocked
         "roi": 1.5,  # mocked
-        "run_history": run_history
+        "run_history": run_history,
+        "rollups": rollups
     }
 
 
+@app.post("/analytics/backfill")
+async def analytics_backfill():
+    """Rebuild the analytics rollups from stored actions and proofs"""
+    if db_pool:
+        await analytics.backfill_db(write_buffer)
+    else:
+        analytics.backfill_memory(actions_db.values(), proofs_db.values(), agents_db.values())
+    return {"success": True}
+
+
 # ==========================================
 # DEMO/SIMULATION ENDPOINTS
 # ==========================================
@@ -1189,6 +1854,8 @@ async def demo_add_revenue(body: Dict[str, Any], user_id: str = Depends(get_user
     agent = agents_db[agent_id]
     agent["revenue"] = agent.get("revenue", 0) + amount
     agent["action_count"] = agent.get("action_count", 0) + 1
+    agents_db.reindex(agent_id)
+    await bump_agent_counters(agent_id, action_count=1, revenue=amount)
     
     # Create a demo action
     action_id = compute_hash(f"{agent_id}{user_id}{time.time()}")[:16]
@@ -1204,6 +1871,7 @@ async def demo_add_revenue(body: Dict[str, Any], user_id: str = Depends(get_user
         "status": "verified"
     }
     actions_db[action_id] = action
+    analytics.record(agent_id, runs=1, revenue=amount)
     
     return {
         "success": True,
@@ -1269,6 +1937,9 @@ async def demo_simulate_action(body: Dict[str, Any], user_id: str = Depends(get_
     import random
     revenue_amount = random.uniform(10, 50)
     agent["revenue"] = agent.get("revenue", 0) + revenue_amount
+    agents_db.reindex(agent_id)
+    await bump_agent_counters(agent_id, action_count=1, proof_count=1, revenue=revenue_amount)
+    analytics.record(agent_id, runs=1, proofs=1, revenue=revenue_amount)
     
     return {
         "success": True,
@@ -1279,13 +1950,41 @@ async def demo_simulate_action(body: Dict[str, Any], user_id: str = Depends(get_
     }
 
 @app.get("/api/marketplace/agents")
-async def get_marketplace_agents():
-    """Get all marketplace listed agents"""
-    listed = [a for a in agents_db.values() if a.get("marketplace_listed", False) and a["visibility"] == "public"]
-    return {
-        "agents": listed,
-        "count": len(listed)
-    }
+async def get_marketplace_agents(
+    q: Optional[str] = None,
+    capability: Optional[List[str]] = Query(None),
+    min_price: Optional[float] = None,
+    max_price: Optional[float] = None,
+    min_rating: Optional[float] = None,
+    sort: str = "newest",
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+):
+    """Search marketplace listed agents, one keyset page of the top matches at a time"""
+    if sort not in MARKETPLACE_SORTS:
+        raise HTTPException(400, f"sort must be one of: {', '.join(MARKETPLACE_SORTS)}")
+    try:
+        after = parse_position(sort, decode_cursor(cursor))
+    except ValueError:
+        raise HTTPException(400, "Invalid cursor")
+    page_size = clamp_limit(limit)
+    search = {"tokens": tokenize(q), "capabilities": capability or [], "min_price": min_price, "max_price": max_price,
+              "min_rating": min_rating, "sort": sort, "after": after, "limit": page_size}
+
+    if db_pool:
+        try:
+            sql, args = marketplace_sql(**search)
+        except ValueError:
+            raise HTTPException(400, "Invalid cursor")
+        async with db_pool.acquire() as conn:
+            # served by the partial GIN (search_tsv, capabilities) and per-sort btree indexes
+            rows = await conn.fetch(sql, *args)
+        listed = [r["data"] for r in rows[:page_size]]
+        next_position = (rows[page_size - 1]["sort_value"], rows[page_size - 1]["id"]) if len(rows) > page_size else None
+    else:
+        ids, next_position = marketplace_index.search(**search)
+        listed = [agents_db[agent_id] for agent_id in ids]
+    return {"agents": listed, "count": len(listed), "sort": sort, "next_cursor": encode_cursor(next_position)}
 
 
 @app.get("/api/marketplace/{listing_id}")
@@ -1326,6 +2025,9 @@ async def subscribe_to_agent(
         "created_at": datetime.utcnow().isoformat(),
         "active": True
     }
+    agent["subscribers"] = agent.get("subscribers", 0) + 1
+    agents_db.reindex(agent_id)
+    await bump_agent_counters(agent_id, subscribers=1)
     
     return {
         "success": True,
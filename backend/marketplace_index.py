@@ -0,0 +1,297 @@
+"""Search and ranking over marketplace listed agents.
+
+``MarketplaceIndex`` covers the public, marketplace listed agents of the
+no-database mode. It is attached to ``agents_db`` like any other index
+(``IndexedTable.attach_index``), so it follows every ``__setitem__`` and
+``reindex``. It keeps:
+
+- an inverted index from full-text tokens (of ``name`` and ``description``)
+  and from capabilities to agent ids; a query intersects the posting sets,
+  smallest first
+- one sorted ``[(value, id)]`` list per sort key in ``SORTS``
+
+A search picks a plan. When the text and capability filters match only a
+small part of the listings, it ranks just those matches with a heap.
+Otherwise it walks the sorted view from the cursor and stops after
+``limit`` hits. Either way it returns a top-k page and the ``(value, id)``
+position to resume from, the same keyset cursor the history endpoints use.
+
+The Postgres path has the same semantics. ``MARKETPLACE_SEARCH_SQL`` adds
+generated columns for search and ranking to ``agents``: a ``simple``
+tsvector, capabilities, price and rating. It gives them GIN and btree
+indexes, partial on the marketplace predicate, and ``marketplace_sql``
+builds the matching keyset query against ``agent_documents``.
+"""
+import heapq
+import re
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+from typing import Any, Dict, FrozenSet, Hashable, Iterable, List, Optional, Sequence, Set, Tuple
+
+# sort name -> (agent_documents column, descending)
+SORTS: Dict[str, Tuple[str, bool]] = {
+    "newest": ("created_at", True),
+    "rating": ("rating", True),
+    "subscribers": ("subscribers", True),
+    "revenue": ("revenue", True),
+    "price": ("price", False),
+}
+
+# rank the filtered matches directly once they are under 1/8 of the listings
+SELECTIVE_RATIO = 8
+
+Position = Tuple[Any, Hashable]
+
+_TOKEN_RE = re.compile(r"[^\W_]+")
+
+
+def tokenize(text: Optional[str]) -> List[str]:
+    """Lowercased word tokens, roughly what the ``simple`` text search config produces."""
+    return _TOKEN_RE.findall(text.lower()) if text else []
+
+
+def is_listed(agent: Dict[str, Any]) -> bool:
+    return bool(agent.get("marketplace_listed")) and agent.get("visibility") == "public"
+
+
+def _number(value: Any) -> Optional[float]:
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return None
+    return float(value)
+
+
+def listing_price(agent: Dict[str, Any]) -> float:
+    """The listed ``price``, else ``pricing.price_usd``, else 0."""
+    price = _number(agent.get("price"))
+    if price is None and isinstance(agent.get("pricing"), dict):
+        price = _number(agent["pricing"].get("price_usd"))
+    return price if price is not None else 0.0
+
+
+def sort_values(agent: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "newest": str(agent.get("created_at") or ""),
+        "rating": _number(agent.get("rating")) or 0.0,
+        "subscribers": _number(agent.get("subscribers")) or 0.0,
+        "revenue": _number(agent.get("revenue")) or 0.0,
+        "price": listing_price(agent),
+    }
+
+
+def parse_position(sort: str, position: Optional[Sequence[Any]]) -> Optional[Position]:
+    """Type a decoded cursor for ``sort``; raises ValueError if it doesn't fit."""
+    if position is None:
+        return None
+    value, agent_id = position
+    if not isinstance(agent_id, str):
+        raise ValueError("Invalid cursor")
+    if sort == "newest":
+        if not isinstance(value, str):
+            raise ValueError("Invalid cursor")
+        return value, agent_id
+    if _number(value) is None:
+        raise ValueError("Invalid cursor")
+    return float(value), agent_id
+
+
+class MarketplaceIndex:
+    """Inverted index plus sorted views over listed agents; same add/remove protocol as memory_store's indexes."""
+
+    def __init__(self):
+        # id -> (tokens, capabilities, sort values) as last indexed
+        self.entries: Dict[Hashable, Tuple[FrozenSet[str], FrozenSet[str], Dict[str, Any]]] = {}
+        self.tokens: Dict[str, Set[Hashable]] = {}
+        self.capabilities: Dict[str, Set[Hashable]] = {}
+        self.sorted: Dict[str, List[Position]] = {name: [] for name in SORTS}
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def add(self, record_id: Hashable, record: Dict[str, Any]):
+        if not is_listed(record):
+            return
+        text = " ".join(v for v in (record.get("name"), record.get("description")) if isinstance(v, str))
+        tokens = frozenset(tokenize(text))
+        capabilities = record.get("capabilities")
+        capabilities = frozenset(c for c in capabilities if isinstance(c, str)) if isinstance(capabilities, list) else frozenset()
+        values = sort_values(record)
+        for token in tokens:
+            self.tokens.setdefault(token, set()).add(record_id)
+        for capability in capabilities:
+            self.capabilities.setdefault(capability, set()).add(record_id)
+        for name, view in self.sorted.items():
+            position = (values[name], record_id)
+            view.insert(bisect_left(view, position), position)
+        self.entries[record_id] = (tokens, capabilities, values)
+
+    def remove(self, record_id: Hashable):
+        entry = self.entries.pop(record_id, None)
+        if entry is None:
+            return
+        tokens, capabilities, values = entry
+        for postings, keys in ((self.tokens, tokens), (self.capabilities, capabilities)):
+            for key in keys:
+                ids = postings[key]
+                ids.discard(record_id)
+                if not ids:
+                    del postings[key]
+        for name, view in self.sorted.items():
+            del view[bisect_left(view, (values[name], record_id))]
+
+    def clear(self):
+        self.entries.clear()
+        self.tokens.clear()
+        self.capabilities.clear()
+        for view in self.sorted.values():
+            view.clear()
+
+    def _matches(self, tokens: Iterable[str], capabilities: Iterable[str]) -> Optional[Set[Hashable]]:
+        """Ids having every token and capability; None when neither filter is given."""
+        postings = [self.tokens.get(t, set()) for t in set(tokens)]
+        postings += [self.capabilities.get(c, set()) for c in set(capabilities)]
+        if not postings:
+            return None
+        postings.sort(key=len)
+        matches = set(postings[0])
+        for ids in postings[1:]:
+            if not matches:
+                break
+            matches &= ids
+        return matches
+
+    def search(
+        self,
+        tokens: Iterable[str] = (),
+        capabilities: Iterable[str] = (),
+        min_price: Optional[float] = None,
+        max_price: Optional[float] = None,
+        min_rating: Optional[float] = None,
+        sort: str = "newest",
+        after: Optional[Position] = None,
+        limit: int = 100,
+    ) -> Tuple[List[Hashable], Optional[Position]]:
+        """Top ``limit`` ids in ``sort`` order after ``after``, and the position to resume from (None when done)."""
+        descending = SORTS[sort][1]
+        view = self.sorted[sort]
+        matches = self._matches(tokens, capabilities)
+
+        def keep(record_id: Hashable) -> bool:
+            values = self.entries[record_id][2]
+            return ((min_price is None or values["price"] >= min_price)
+                    and (max_price is None or values["price"] <= max_price)
+                    and (min_rating is None or values["rating"] >= min_rating))
+
+        if matches is not None and len(matches) * SELECTIVE_RATIO < len(view):
+            positions = [(self.entries[i][2][sort], i) for i in matches if keep(i)]
+            if after is not None:
+                positions = [p for p in positions if (p < after if descending else p > after)]
+            top = (heapq.nlargest if descending else heapq.nsmallest)(limit + 1, positions)
+        else:
+            top = []
+            if descending:
+                end = bisect_left(view, after) if after is not None else len(view)
+                walk = (view[i] for i in range(end - 1, -1, -1))
+            else:
+                start = bisect_right(view, after) if after is not None else 0
+                if sort == "price" and min_price is not None:
+                    start = max(start, bisect_left(view, (min_price,)))
+                walk = (view[i] for i in range(start, len(view)))
+            for position in walk:
+                if sort == "price" and max_price is not None and position[0] > max_price:
+                    break
+                if (matches is None or position[1] in matches) and keep(position[1]):
+                    top.append(position)
+                    if len(top) > limit:
+                        break
+        more = len(top) > limit
+        top = top[:limit]
+        return [record_id for _, record_id in top], (top[-1] if more and top else None)
+
+
+_LISTED = "marketplace_listed AND visibility = 'public'"
+
+MARKETPLACE_SEARCH_SQL = [
+    # derived from the document, so every write keeps them current
+    """
+    ALTER TABLE agents
+        ADD COLUMN IF NOT EXISTS search_tsv TSVECTOR GENERATED ALWAYS AS (
+            to_tsvector('simple', COALESCE(data->>'name', '') || ' ' || COALESCE(data->>'description', ''))
+        ) STORED,
+        ADD COLUMN IF NOT EXISTS capabilities JSONB GENERATED ALWAYS AS (
+            CASE WHEN jsonb_typeof(data->'capabilities') = 'array' THEN data->'capabilities' ELSE '[]'::jsonb END
+        ) STORED,
+        ADD COLUMN IF NOT EXISTS price DOUBLE PRECISION GENERATED ALWAYS AS (COALESCE(
+            CASE WHEN jsonb_typeof(data->'price') = 'number' THEN (data->>'price')::double precision END,
+            CASE WHEN jsonb_typeof(data->'pricing'->'price_usd') = 'number' THEN (data->'pricing'->>'price_usd')::double precision END,
+            0
+        )) STORED,
+        ADD COLUMN IF NOT EXISTS rating DOUBLE PRECISION GENERATED ALWAYS AS (
+            CASE WHEN jsonb_typeof(data->'rating') = 'number' THEN (data->>'rating')::double precision ELSE 0 END
+        ) STORED;
+    """,
+    f"CREATE INDEX IF NOT EXISTS agents_search_idx ON agents USING GIN (search_tsv) WHERE {_LISTED};",
+    f"CREATE INDEX IF NOT EXISTS agents_capabilities_idx ON agents USING GIN (capabilities jsonb_path_ops) WHERE {_LISTED};",
+    # one btree per sort, with id as the keyset tie-breaker
+    "DROP INDEX IF EXISTS agents_marketplace_idx;",
+    f"CREATE INDEX IF NOT EXISTS agents_marketplace_idx ON agents (created_at DESC, id DESC) WHERE {_LISTED};",
+    f"CREATE INDEX IF NOT EXISTS agents_market_rating_idx ON agents (rating DESC, id DESC) WHERE {_LISTED};",
+    f"CREATE INDEX IF NOT EXISTS agents_market_subscribers_idx ON agents (subscribers DESC, id DESC) WHERE {_LISTED};",
+    f"CREATE INDEX IF NOT EXISTS agents_market_revenue_idx ON agents (revenue DESC, id DESC) WHERE {_LISTED};",
+    f"CREATE INDEX IF NOT EXISTS agents_market_price_idx ON agents (price, id) WHERE {_LISTED};",
+    # the ranking columns are appended so searches can filter and sort on them through the view
+    """
+    CREATE OR REPLACE VIEW agent_documents AS
+    SELECT id, owner, created_at, status, visibility, marketplace_listed,
+           data || jsonb_strip_nulls(jsonb_build_object(
+               'action_count', action_count,
+               'proof_count', proof_count,
+               'revenue', revenue,
+               'subscribers', subscribers,
+               'status', status,
+               'visibility', visibility,
+               'marketplace_listed', marketplace_listed
+           )) AS data,
+           version, subscribers, revenue, price, rating, capabilities, search_tsv
+    FROM agents;
+    """,
+]
+
+
+def marketplace_sql(
+    tokens: Sequence[str] = (),
+    capabilities: Sequence[str] = (),
+    min_price: Optional[float] = None,
+    max_price: Optional[float] = None,
+    min_rating: Optional[float] = None,
+    sort: str = "newest",
+    after: Optional[Position] = None,
+    limit: int = 100,
+) -> Tuple[str, list]:
+    """``(sql, args)`` for the Postgres equivalent of ``MarketplaceIndex.search``; fetches ``limit + 1`` rows."""
+    column, descending = SORTS[sort]
+    clauses = [_LISTED]
+    args: list = []
+
+    def param(value) -> str:
+        args.append(value)
+        return f"${len(args)}"
+
+    if tokens:
+        clauses.append(f"search_tsv @@ plainto_tsquery('simple', {param(' '.join(tokens))})")
+    if capabilities:
+        clauses.append(f"capabilities @> {param(list(capabilities))}")
+    if min_price is not None:
+        clauses.append(f"price >= {param(float(min_price))}")
+    if max_price is not None:
+        clauses.append(f"price <= {param(float(max_price))}")
+    if min_rating is not None:
+        clauses.append(f"rating >= {param(float(min_rating))}")
+    if after is not None:
+        value, agent_id = after
+        if sort == "newest":
+            value = datetime.fromisoformat(value)
+        clauses.append(f"({column}, id) {'<' if descending else '>'} ({param(value)}, {param(agent_id)})")
+    direction = "DESC" if descending else "ASC"
+    sql = (f"SELECT id, data, {column} AS sort_value FROM agent_documents WHERE {' AND '.join(clauses)} "
+           f"ORDER BY {column} {direction}, id {direction} LIMIT {param(limit + 1)}")
+    return sql, args
@@ -0,0 +1,164 @@
+"""Indexed in-memory tables for the no-database mode.
+
+``IndexedTable`` is a dict (id -> record) that also maintains secondary
+indexes, so lookups such as "actions for agent X, newest first" cost
+O(matches) instead of a scan over every record. Indexes are updated on
+every ``__setitem__``/``__delitem__``; code that mutates an indexed field
+of a stored record in place must call ``reindex(id)`` afterwards.
+"""
+from bisect import bisect_left, bisect_right, insort
+from typing import Any, Callable, Dict, Hashable, Iterator, List, Optional, Tuple
+
+KeyFn = Callable[[Dict[str, Any]], Optional[Hashable]]
+SortFn = Callable[[Dict[str, Any]], Any]
+
+
+class _Index:
+    def __init__(self, key_fn: KeyFn, sort_fn: Optional[SortFn] = None):
+        self.key_fn = key_fn
+        self.sort_fn = sort_fn
+        # key -> {id: None} (insertion ordered) or sorted [(sort_value, id)]
+        self.buckets: Dict[Hashable, Any] = {}
+        # id -> (key, sort_value) as last indexed, so removal needs no scan
+        self.entries: Dict[Hashable, Tuple[Hashable, Any]] = {}
+
+    def add(self, record_id: Hashable, record: Dict[str, Any]):
+        key = self.key_fn(record)
+        if key is None:
+            return
+        if self.sort_fn is None:
+            self.buckets.setdefault(key, {})[record_id] = None
+            self.entries[record_id] = (key, None)
+        else:
+            sort_value = self.sort_fn(record)
+            insort(self.buckets.setdefault(key, []), (sort_value, record_id))
+            self.entries[record_id] = (key, sort_value)
+
+    def remove(self, record_id: Hashable):
+        entry = self.entries.pop(record_id, None)
+        if entry is None:
+            return
+        key, sort_value = entry
+        bucket = self.buckets[key]
+        if self.sort_fn is None:
+            del bucket[record_id]
+        else:
+            del bucket[bisect_left(bucket, (sort_value, record_id))]
+        if not bucket:
+            del self.buckets[key]
+
+    def ids(self, key: Hashable, newest_first: bool = False) -> List[Hashable]:
+        bucket = self.buckets.get(key)
+        if not bucket:
+            return []
+        if self.sort_fn is None:
+            ids = list(bucket)
+        else:
+            ids = [record_id for _, record_id in bucket]
+        if newest_first:
+            ids.reverse()
+        return ids
+
+    def clear(self):
+        self.buckets.clear()
+        self.entries.clear()
+
+
+class IndexedTable(dict):
+    """dict of records with secondary indexes kept in sync on mutation."""
+
+    def __init__(self):
+        super().__init__()
+        self._indexes: Dict[str, Any] = {}
+
+    def add_index(self, name: str, key_fn: KeyFn, sort_fn: Optional[SortFn] = None):
+        """Index records by ``key_fn`` (None = not indexed), optionally ordered by ``sort_fn``."""
+        index = self._indexes[name] = _Index(key_fn, sort_fn)
+        for record_id, record in self.items():
+            index.add(record_id, record)
+
+    def attach_index(self, name: str, index: Any):
+        """Keep a custom index (anything with ``add``/``remove``/``clear``) in sync; query it directly."""
+        self._indexes[name] = index
+        for record_id, record in self.items():
+            index.add(record_id, record)
+        return index
+
+    def __setitem__(self, record_id, record):
+        if record_id in self:
+            for index in self._indexes.values():
+                index.remove(record_id)
+        super().__setitem__(record_id, record)
+        for index in self._indexes.values():
+            index.add(record_id, record)
+
+    def __delitem__(self, record_id):
+        super().__delitem__(record_id)
+        for index in self._indexes.values():
+            index.remove(record_id)
+
+    def pop(self, record_id, *default):
+        if record_id in self:
+            for index in self._indexes.values():
+                index.remove(record_id)
+        return super().pop(record_id, *default)
+
+    def popitem(self):
+        record_id, record = super().popitem()
+        for index in self._indexes.values():
+            index.remove(record_id)
+        return record_id, record
+
+    def setdefault(self, record_id, default=None):
+        if record_id not in self:
+            self[record_id] = default
+        return self[record_id]
+
+    def update(self, *args, **kwargs):
+        for record_id, record in dict(*args, **kwargs).items():
+            self[record_id] = record
+
+    def clear(self):
+        super().clear()
+        for index in self._indexes.values():
+            index.clear()
+
+    def reindex(self, record_id):
+        """Refresh a record's index entries after it was mutated in place."""
+        record = self[record_id]
+        for index in self._indexes.values():
+            index.remove(record_id)
+            index.add(record_id, record)
+
+    def lookup(self, index: str, key: Hashable, newest_first: bool = False, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Records under ``key`` in ``index`` (sorted indexes: oldest first unless ``newest_first``)."""
+        ids = self._indexes[index].ids(key, newest_first)
+        if limit is not None:
+            ids = ids[:limit]
+        return [super(IndexedTable, self).__getitem__(record_id) for record_id in ids]
+
+    def page(self, index: str, key: Hashable, after: Optional[Tuple[Any, Hashable]] = None, limit: int = 100, newest_first: bool = True) -> Tuple[List[Dict[str, Any]], Optional[Tuple[Any, Hashable]]]:
+        """Keyset page of a sorted index.
+
+        ``after`` is the ``(sort_value, id)`` position of the last record of the
+        previous page; returns the records and the position to resume from
+        (None once the bucket is exhausted).
+        """
+        bucket = self._indexes[index].buckets.get(key) or []
+        if newest_first:
+            end = bisect_left(bucket, tuple(after)) if after else len(bucket)
+            start = max(0, end - limit)
+            positions = bucket[start:end][::-1]
+            more = start > 0
+        else:
+            start = bisect_right(bucket, tuple(after)) if after else 0
+            positions = bucket[start:start + limit]
+            more = start + limit < len(bucket)
+        records = [super(IndexedTable, self).__getitem__(record_id) for _, record_id in positions]
+        return records, (positions[-1] if more and positions else None)
+
+    def count(self, index: str, key: Hashable) -> int:
+        return len(self._indexes[index].buckets.get(key, ()))
+
+    def iter_keys(self, index: str) -> Iterator[Hashable]:
+        return iter(self._indexes[index].buckets)
@@ -0,0 +1,280 @@
+"""Prometheus metrics, rendered in the text exposition format.
+
+Counters, gauges and histograms keep plain floats in dicts keyed by label
+values, so recording costs a dict lookup (and a bisect for histograms);
+nothing is formatted until ``/metrics`` is scraped. Gauges can also be
+computed at scrape time from a callback (pool sizes, queue depths) so they
+cost nothing in between.
+
+Turn it off with ``METRICS_ENABLED=false``: the registry then hands out
+no-op instruments, the request middleware is not installed and
+``/metrics`` answers 404.
+"""
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+TOKEN_BUCKETS = (16, 64, 128, 256, 512, 1024, 2048, 4096, 8192)
+
+Labels = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Labels, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(str(v))}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _num(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, doc: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.doc = doc
+        self.labelnames = tuple(labelnames)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} {self.kind}"]
+
+    def render(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, doc, labelnames=()):
+        super().__init__(name, doc, labelnames)
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1.0):
+        self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def render(self):
+        return self.header() + [f"{self.name}{_labels(self.labelnames, k)} {_num(v)}" for k, v in self._values.items()]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name, doc, labelnames=(), collect: Optional[Callable[[], Dict[Labels, float]]] = None):
+        super().__init__(name, doc, labelnames)
+        self._values: Dict[Labels, float] = {}
+        self._collect = collect
+
+    def set(self, value: float, *labels: str):
+        self._values[labels] = value
+
+    def inc(self, *labels: str, amount: float = 1.0):
+        self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def dec(self, *labels: str, amount: float = 1.0):
+        self._values[labels] = self._values.get(labels, 0.0) - amount
+
+    def render(self):
+        values = dict(self._values)
+        if self._collect:
+            values.update(self._collect())
+        return self.header() + [f"{self.name}{_labels(self.labelnames, k)} {_num(v)}" for k, v in values.items()]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, doc, labelnames=(), buckets: Iterable[float] = LATENCY_BUCKETS):
+        super().__init__(name, doc, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # per label set: [count per bucket..., +Inf count, sum]
+        self._series: Dict[Labels, List[float]] = {}
+
+    def observe(self, value: float, *labels: str):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [0.0] * (len(self.buckets) + 2)
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def time(self, *labels: str) -> "_Timer":
+        """``with hist.time("label"):`` observes the block's wall time in seconds."""
+        return _Timer(self, labels)
+
+    def render(self):
+        lines = self.header()
+        for labels, series in self._series.items():
+            cumulative = 0.0
+            for bound, count in zip(self.buckets + (float("inf"),), series):
+                cumulative += count
+                le = 'le="' + _num(bound) + '"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {_num(cumulative)}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {_num(series[-1])}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {_num(cumulative)}")
+        return lines
+
+
+class _Timer:
+    __slots__ = ("hist", "labels", "started")
+
+    def __init__(self, hist: Histogram, labels: Labels):
+        self.hist = hist
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.hist.observe(time.perf_counter() - self.started, *self.labels)
+        return False
+
+
+class _NullMetric:
+    """Stands in for every instrument when metrics are disabled."""
+
+    def inc(self, *labels, amount=1.0):
+        pass
+
+    dec = inc
+
+    def set(self, value, *labels):
+        pass
+
+    def observe(self, value, *labels):
+        pass
+
+    def time(self, *labels):
+        return _NULL_TIMER
+
+    def render(self):
+        return []
+
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL = _NullMetric()
+_NULL_TIMER = _NullTimer()
+
+
+class MetricsRegistry:
+    def __init__(self, enabled: bool = True, namespace: str = ""):
+        self.enabled = enabled
+        self.namespace = namespace
+        self._metrics: List[_Metric] = []
+
+    def _add(self, metric: _Metric):
+        if not self.enabled:
+            return _NULL
+        metric.name = f"{self.namespace}_{metric.name}" if self.namespace else metric.name
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, doc: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._add(Counter(name, doc, labelnames))
+
+    def gauge(self, name: str, doc: str, labelnames: Sequence[str] = (), collect=None) -> Gauge:
+        return self._add(Gauge(name, doc, labelnames, collect))
+
+    def histogram(self, name: str, doc: str, labelnames: Sequence[str] = (), buckets: Iterable[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, doc, labelnames, buckets))
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+class RequestMetricsMiddleware:
+    """ASGI middleware timing each HTTP request by method, route template and status."""
+
+    def __init__(self, app, histogram: Histogram, skip: Iterable[str] = ("/metrics",)):
+        self.app = app
+        self.histogram = histogram
+        self.skip = set(skip)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.skip:
+            await self.app(scope, receive, send)
+            return
+        status = 500
+        started = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            # templated path keeps label cardinality bounded
+            path = getattr(route, "path", None) or "unmatched"
+            self.histogram.observe(time.perf_counter() - started, scope["method"], path, str(status))
+
+
+class InstrumentedPool:
+    """asyncpg pool proxy recording checkout wait and connections in use.
+
+    Handles ``async with pool.acquire()`` and ``await pool.acquire()`` /
+    ``pool.release()``; everything else is delegated to the wrapped pool.
+    """
+
+    def __init__(self, pool, wait: Histogram, in_use: Gauge):
+        self._pool = pool
+        self._wait = wait
+        self._in_use = in_use
+
+    def __getattr__(self, name):
+        return getattr(self._pool, name)
+
+    def acquire(self, *, timeout: Optional[float] = None) -> "_TimedAcquire":
+        return _TimedAcquire(self, timeout)
+
+    async def _checkout(self, timeout: Optional[float]):
+        started = time.perf_counter()
+        conn = await self._pool.acquire(timeout=timeout)
+        self._wait.observe(time.perf_counter() - started)
+        self._in_use.inc()
+        return conn
+
+    async def release(self, conn, *, timeout: Optional[float] = None):
+        self._in_use.dec()
+        await self._pool.release(conn, timeout=timeout)
+
+
+class _TimedAcquire:
+    __slots__ = ("owner", "timeout", "conn")
+
+    def __init__(self, owner: InstrumentedPool, timeout: Optional[float]):
+        self.owner = owner
+        self.timeout = timeout
+        self.conn = None
+
+    def __await__(self):
+        return self.owner._checkout(self.timeout).__await__()
+
+    async def __aenter__(self):
+        self.conn = await self.owner._checkout(self.timeout)
+        return self.conn
+
+    async def __aexit__(self, *exc):
+        await self.owner.release(self.conn)
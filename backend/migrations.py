@@ -0,0 +1,149 @@
+"""Versioned schema migrations, applied once per database.
+
+``MIGRATIONS`` is an ordered list of ``(version, name, statements)``.
+``migrate`` takes a transaction-level advisory lock, so when several
+workers start together one applies the pending versions and the rest wait
+and then find nothing to do; each version runs in its own transaction and
+is recorded in ``schema_migrations``. Append new versions, never edit an
+applied one.
+"""
+import logging
+import time
+from typing import Dict, List, Sequence, Tuple
+
+from agent_rows import AGENT_COLUMNS_SQL, AGENT_VERSION_SQL
+from analytics import CREATE_ROLLUPS_SQL
+from db_access import PROOF_VERIFICATION_SQL
+from marketplace_index import MARKETPLACE_SEARCH_SQL
+from schedule_leases import CREATE_LEASE_TABLES_SQL
+
+logger = logging.getLogger(__name__)
+
+# arbitrary constant shared by every worker
+MIGRATION_LOCK_ID = 0x5048414E
+
+Migration = Tuple[int, str, Sequence[str]]
+
+BASE_SCHEMA_SQL = [
+    """
+    CREATE TABLE IF NOT EXISTS agents (
+        id TEXT PRIMARY KEY,
+        owner TEXT NOT NULL,
+        data JSONB NOT NULL,
+        created_at TIMESTAMP WITH TIME ZONE DEFAULT now(),
+        status TEXT
+    );
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS api_keys (
+        user_id TEXT NOT NULL,
+        provider TEXT NOT NULL,
+        encrypted_key TEXT NOT NULL,
+        PRIMARY KEY (user_id, provider)
+    );
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS actions (
+        id SERIAL PRIMARY KEY,
+        agent_id TEXT,
+        user_id TEXT,
+        action_type TEXT,
+        payload JSONB,
+        created_at TIMESTAMP WITH TIME ZONE DEFAULT now()
+    );
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS proofs (
+        id SERIAL PRIMARY KEY,
+        proof_hash TEXT UNIQUE,
+        agent_id TEXT,
+        action_payload_hash TEXT,
+        proof JSONB,
+        created_at TIMESTAMP WITH TIME ZONE DEFAULT now()
+    );
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS listings (
+        id TEXT PRIMARY KEY,
+        seller TEXT NOT NULL,
+        data JSONB NOT NULL,
+        created_at TIMESTAMP WITH TIME ZONE DEFAULT now()
+    );
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS purchases (
+        id SERIAL PRIMARY KEY,
+        listing_id TEXT,
+        buyer TEXT,
+        data JSONB,
+        created_at TIMESTAMP WITH TIME ZONE DEFAULT now()
+    );
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS schedules (
+        id TEXT PRIMARY KEY,
+        owner TEXT,
+        cron TEXT,
+        data JSONB,
+        next_run_at TIMESTAMP WITH TIME ZONE,
+        created_at TIMESTAMP WITH TIME ZONE DEFAULT now()
+    );
+    """,
+    "ALTER TABLE schedules ADD COLUMN IF NOT EXISTS next_run_at TIMESTAMP WITH TIME ZONE;",
+    """
+    CREATE TABLE IF NOT EXISTS events (
+        id SERIAL PRIMARY KEY,
+        type TEXT,
+        payload JSONB,
+        created_at TIMESTAMP WITH TIME ZONE DEFAULT now()
+    );
+    """,
+    # keyset pagination of per-agent history on (created_at, id)
+    "CREATE INDEX IF NOT EXISTS actions_agent_created_idx ON actions (agent_id, created_at DESC, id DESC);",
+    "CREATE INDEX IF NOT EXISTS proofs_agent_created_idx ON proofs (agent_id, created_at DESC, id DESC);",
+]
+
+# Statements are idempotent (IF NOT EXISTS) so databases created before
+# schema_migrations existed are adopted without errors.
+MIGRATIONS: List[Migration] = [
+    (1, "base schema", BASE_SCHEMA_SQL),
+    (2, "agent rollups", [CREATE_ROLLUPS_SQL]),
+    (3, "schedule leases", CREATE_LEASE_TABLES_SQL),
+    (4, "agent hot columns", AGENT_COLUMNS_SQL),
+    (5, "agent versions", AGENT_VERSION_SQL),
+    (6, "marketplace search", MARKETPLACE_SEARCH_SQL),
+    (7, "proof verification", PROOF_VERIFICATION_SQL),
+]
+
+CREATE_MIGRATIONS_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS schema_migrations (
+    version INT PRIMARY KEY,
+    name TEXT NOT NULL,
+    applied_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+    duration_ms DOUBLE PRECISION
+);
+"""
+
+
+async def migrate(pool, migrations: Sequence[Migration] = MIGRATIONS) -> Dict[str, object]:
+    """Apply pending migrations; returns the versions applied and the schema version."""
+    applied: List[int] = []
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            await conn.execute("SELECT pg_advisory_xact_lock($1)", MIGRATION_LOCK_ID)
+            await conn.execute(CREATE_MIGRATIONS_TABLE_SQL)
+            done = {r["version"] for r in await conn.fetch("SELECT version FROM schema_migrations")}
+            for version, name, statements in sorted(migrations, key=lambda m: m[0]):
+                if version in done:
+                    continue
+                started = time.perf_counter()
+                async with conn.transaction():
+                    for sql in statements:
+                        await conn.execute(sql)
+                    await conn.execute(
+                        "INSERT INTO schema_migrations (version, name, duration_ms) VALUES ($1, $2, $3)",
+                        version, name, (time.perf_counter() - started) * 1000,
+                    )
+                applied.append(version)
+                logger.info("applied migration %d (%s)", version, name)
+    return {"applied": applied, "version": max([m[0] for m in migrations], default=0)}
@@ -0,0 +1,67 @@
+"""Keyset cursors and NDJSON helpers for long per-agent histories.
+
+Cursors are opaque, URL-safe encodings of the ``(created_at, id)`` position
+of the last row a client has seen, so the next page is an index range scan
+rather than an OFFSET.
+"""
+import base64
+from datetime import datetime
+from typing import Any, Optional, Tuple
+
+from serialization import dumpb, dumps, loads
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+
+def encode_cursor(position: Optional[Tuple[Any, Any]]) -> Optional[str]:
+    if position is None:
+        return None
+    created_at, row_id = position
+    if isinstance(created_at, datetime):
+        created_at = created_at.isoformat()
+    raw = dumpb([created_at, row_id])
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: Optional[str]) -> Optional[Tuple[str, Any]]:
+    """Return ``(created_at_iso, id)``; raises ValueError on a malformed cursor."""
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, row_id = loads(raw)
+    except Exception as exc:
+        raise ValueError("Invalid cursor") from exc
+    return created_at, row_id
+
+
+def history_position(position: Optional[Tuple[Any, Any]], db: bool) -> Optional[Tuple[Any, Any]]:
+    """Type a decoded ``(created_at, id)`` cursor for the store it pages; raises ValueError if it doesn't fit.
+
+    Postgres rows page on ``(timestamptz, serial)``, in-memory records on
+    ``(iso string, string id)``.
+    """
+    if position is None:
+        return None
+    created_at, row_id = position
+    if not isinstance(created_at, str):
+        raise ValueError("Invalid cursor")
+    if db:
+        if isinstance(row_id, bool) or not isinstance(row_id, int):
+            raise ValueError("Invalid cursor")
+        return datetime.fromisoformat(created_at), row_id
+    if not isinstance(row_id, str):
+        raise ValueError("Invalid cursor")
+    return created_at, row_id
+
+
+def clamp_limit(limit: Optional[int]) -> int:
+    if limit is None:
+        return DEFAULT_PAGE_SIZE
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+
+def ndjson_line(value: Any) -> str:
+    """One NDJSON line."""
+    return dumps(value) + "\n"
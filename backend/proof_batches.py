@@ -0,0 +1,257 @@
+"""Merkle aggregation of action proofs for the verifier contract.
+
+Instead of verifying every proof in its own transaction, proofs are
+collected into batches (per agent, or one shared batch across agents),
+committed to with a Merkle root, and only the root is submitted to the
+verifier. ``inclusion_proof`` lets anyone check that a single action is
+covered by a submitted root.
+
+A batch whose root could not be submitted, or whose transaction was not
+accepted, is not dropped: its proofs are re-queued into the next batch for
+the same key, so every proof is eventually covered by an accepted root.
+"""
+import asyncio
+import hashlib
+import inspect
+import logging
+import time
+from typing import Any, Dict, List, Optional
+
+from chain import ChainSubmitter, TxReceipt
+
+logger = logging.getLogger(__name__)
+
+
+def _h(data: bytes) -> bytes:
+    return hashlib.sha256(data).digest()
+
+
+def leaf_hash(proof_hash: str) -> str:
+    """Leaf commitment for a proof (domain-separated from inner nodes)."""
+    return _h(b"\x00" + proof_hash.encode()).hex()
+
+
+def _node(left: bytes, right: bytes) -> bytes:
+    return _h(b"\x01" + left + right)
+
+
+def merkle_levels(leaves: List[str]) -> List[List[bytes]]:
+    """All tree levels from leaves to root; odd nodes are paired with themselves."""
+    if not leaves:
+        raise ValueError("Cannot build a Merkle tree without leaves")
+    level = [bytes.fromhex(leaf) for leaf in leaves]
+    levels = [level]
+    while len(level) > 1:
+        if len(level) % 2:
+            level = level + [level[-1]]
+        level = [_node(level[i], level[i + 1]) for i in range(0, len(level), 2)]
+        levels.append(level)
+    return levels
+
+
+def merkle_path(levels: List[List[bytes]], index: int) -> List[Dict[str, str]]:
+    """Sibling hashes needed to recompute the root from leaf ``index``."""
+    path = []
+    for level in levels[:-1]:
+        sibling = index ^ 1
+        sibling_hash = level[sibling] if sibling < len(level) else level[index]
+        path.append({"hash": sibling_hash.hex(), "position": "right" if index % 2 == 0 else "left"})
+        index //= 2
+    return path
+
+
+def verify_inclusion(leaf: str, path: List[Dict[str, str]], root: str) -> bool:
+    """Check a leaf against a root using the sibling path from ``merkle_path``."""
+    node = bytes.fromhex(leaf)
+    for step in path:
+        sibling = bytes.fromhex(step["hash"])
+        node = _node(node, sibling) if step["position"] == "right" else _node(sibling, node)
+    return node.hex() == root
+
+
+class ProofBatch:
+    def __init__(self, batch_id: str, key: str):
+        self.batch_id = batch_id
+        self.key = key
+        self.proof_ids: List[str] = []
+        self.proof_hashes: List[str] = []
+        self.member_agents: List[str] = []
+        self.leaves: List[str] = []
+        self.agent_ids: set = set()
+        self.opened_at = time.time()
+        self.root: Optional[str] = None
+        self.levels: Optional[List[List[bytes]]] = None
+        self.tx_hash: Optional[str] = None
+        self.status = "OPEN"
+        self.block_number: Optional[int] = None
+        # proof_id -> on_verified
+        self.callbacks: Dict[str, Any] = {}
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "batch_id": self.batch_id,
+            "root": self.root,
+            "size": len(self.proof_ids),
+            "agent_ids": sorted(self.agent_ids),
+            "status": self.status,
+            "tx_hash": self.tx_hash,
+            "block_number": self.block_number,
+            "opened_at": self.opened_at,
+        }
+
+
+class ProofAggregator:
+    """Collects proofs into Merkle batches and submits one root per batch.
+
+    With ``per_agent`` each agent fills its own batch; otherwise all agents
+    share one. A batch is sealed at ``batch_size`` proofs or after
+    ``max_age`` seconds, whichever comes first.
+    """
+
+    def __init__(self, submitter: ChainSubmitter, verifier_contract: str, batch_size: int = 256, max_age: float = 10.0, per_agent: bool = True, max_batches: int = 10000):
+        self.submitter = submitter
+        self.verifier_contract = verifier_contract
+        self.batch_size = batch_size
+        self.max_age = max_age
+        self.per_agent = per_agent
+        self.max_batches = max_batches
+        self._open: Dict[str, ProofBatch] = {}
+        self._timers: Dict[str, asyncio.Task] = {}
+        self.batches: Dict[str, ProofBatch] = {}
+        self._membership: Dict[str, tuple] = {}
+        self._seq = 0
+        self.requeued = 0
+
+    def _new_batch(self, key: str) -> ProofBatch:
+        self._seq += 1
+        batch_id = "batch_" + hashlib.sha256(f"{key}{self._seq}{time.time()}".encode()).hexdigest()[:16]
+        batch = ProofBatch(batch_id, key)
+        self.batches[batch_id] = batch
+        # forget the oldest sealed batches so membership stays bounded
+        while len(self.batches) > self.max_batches:
+            oldest = next(iter(self.batches.values()))
+            if oldest.status == "OPEN":
+                break
+            del self.batches[oldest.batch_id]
+            for proof_id in oldest.proof_ids:
+                # a re-queued proof belongs to a newer batch now
+                if self._membership.get(proof_id, (None,))[0] == oldest.batch_id:
+                    del self._membership[proof_id]
+        return batch
+
+    async def add(self, proof_id: str, proof_hash: str, agent_id: str, on_verified=None) -> Dict[str, Any]:
+        """Queue a proof; ``on_verified(receipt)`` runs when its root is accepted."""
+        if proof_id in self._membership:
+            return self.batches[self._membership[proof_id][0]].to_dict()
+        key = agent_id if self.per_agent else "*"
+        batch = self._append(key, proof_id, proof_hash, agent_id, on_verified)
+        if len(batch.leaves) >= self.batch_size:
+            await self.seal(key)
+        return batch.to_dict()
+
+    def _append(self, key: str, proof_id: str, proof_hash: str, agent_id: str, on_verified) -> ProofBatch:
+        batch = self._open.get(key)
+        if batch is None:
+            batch = self._open[key] = self._new_batch(key)
+            self._timers[key] = asyncio.create_task(self._seal_after(key, batch))
+        self._membership[proof_id] = (batch.batch_id, len(batch.leaves))
+        batch.proof_ids.append(proof_id)
+        batch.proof_hashes.append(proof_hash)
+        batch.member_agents.append(agent_id)
+        batch.leaves.append(leaf_hash(proof_hash))
+        batch.agent_ids.add(agent_id)
+        if on_verified:
+            batch.callbacks[proof_id] = on_verified
+        return batch
+
+    def _requeue(self, batch: ProofBatch):
+        """Move a failed batch's proofs into the open batch for its key.
+
+        The open batch's age timer seals it, so a failing verifier is retried
+        at most every ``max_age`` seconds rather than in a tight loop.
+        """
+        for proof_id, proof_hash, agent_id in zip(batch.proof_ids, batch.proof_hashes, batch.member_agents):
+            if self._membership.get(proof_id, (None,))[0] == batch.batch_id:
+                self._append(batch.key, proof_id, proof_hash, agent_id, batch.callbacks.get(proof_id))
+        self.requeued += len(batch.proof_ids)
+
+    async def _seal_after(self, key: str, batch: ProofBatch):
+        await asyncio.sleep(self.max_age)
+        if self._open.get(key) is batch:
+            self._timers.pop(key, None)
+            await self.seal(key)
+
+    async def seal(self, key: str) -> Optional[ProofBatch]:
+        """Close the open batch for ``key`` and submit its root."""
+        batch = self._open.pop(key, None)
+        if batch is None:
+            return None
+        timer = self._timers.pop(key, None)
+        if timer and timer is not asyncio.current_task():
+            timer.cancel()
+        batch.levels = merkle_levels(batch.leaves)
+        batch.root = batch.levels[-1][0].hex()
+        batch.status = "SUBMITTED"
+        calldata = {"batch_id": batch.batch_id, "root": batch.root, "count": len(batch.leaves)}
+        try:
+            pending = await self.submitter.submit(self.verifier_contract, "submit_batch_root", calldata)
+        except Exception:
+            batch.status = "FAILED"
+            logger.exception("failed to submit proof batch %s; re-queueing %d proofs", batch.batch_id, len(batch.leaves))
+            self._requeue(batch)
+            return batch
+        batch.tx_hash = pending.tx_hash
+
+        async def on_receipt(receipt: TxReceipt):
+            batch.status = receipt.status
+            batch.block_number = receipt.block_number
+            if not receipt.accepted:
+                logger.warning("proof batch %s not accepted (%s); re-queueing %d proofs", batch.batch_id, receipt.status, len(batch.leaves))
+                self._requeue(batch)
+                return
+            for proof_id, callback in batch.callbacks.items():
+                try:
+                    result = callback(receipt)
+                    if inspect.isawaitable(result):
+                        await result
+                except Exception:
+                    logger.exception("on_verified failed for proof %s in batch %s", proof_id, batch.batch_id)
+
+        pending.on_receipt(on_receipt)
+        return batch
+
+    async def flush(self) -> List[ProofBatch]:
+        """Seal every open batch now."""
+        sealed = []
+        for key in list(self._open):
+            batch = await self.seal(key)
+            if batch:
+                sealed.append(batch)
+        return sealed
+
+    def inclusion_proof(self, proof_id: str) -> Optional[Dict[str, Any]]:
+        """Merkle path proving ``proof_id`` is committed to by its batch root."""
+        membership = self._membership.get(proof_id)
+        if membership is None:
+            return None
+        batch_id, index = membership
+        batch = self.batches[batch_id]
+        result = {
+            "proof_id": proof_id,
+            "batch_id": batch_id,
+            "index": index,
+            "leaf": batch.leaves[index],
+            "status": batch.status,
+            "root": batch.root,
+            "path": None,
+            "tx_hash": batch.tx_hash,
+            "block_number": batch.block_number,
+        }
+        if batch.levels is not None:
+            result["path"] = merkle_path(batch.levels, index)
+        return result
+
+    async def close(self):
+        for timer in self._timers.values():
+            timer.cancel()
+        self._timers.clear()
@@ -0,0 +1,178 @@
+"""TTL/LRU cache of LLM completions for agents that opt in.
+
+Keyed on (provider, model, agent metadata_hash, normalized prompt), so an
+agent config change naturally misses. The in-memory tier is a bounded LRU;
+with ``disk_path`` set, misses fall through to a SQLite file that survives
+restarts and is shared by workers on the same host. Hits are promoted back
+into memory.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_prompt(prompt: str) -> str:
+    return _WHITESPACE.sub(" ", prompt).strip()
+
+
+def cache_key(provider: str, model: Optional[str], metadata_hash: Optional[str], prompt: str) -> str:
+    raw = json.dumps([provider, model or "", metadata_hash or "", normalize_prompt(prompt)])
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+@dataclass
+class CachedResponse:
+    text: str
+    output_hash: str
+    tokens: int
+    expires_at: float  # wall clock, so disk entries stay meaningful across restarts
+
+
+class _DiskTier:
+    """SQLite store; calls are blocking and run in a thread by ResponseCache."""
+
+    def __init__(self, path: str, max_entries: int):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS llm_responses ("
+            " key TEXT PRIMARY KEY, text TEXT NOT NULL, output_hash TEXT NOT NULL,"
+            " tokens INTEGER NOT NULL, expires_at REAL NOT NULL, used_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS llm_responses_used_idx ON llm_responses (used_at)")
+        self._conn.commit()
+        self._writes = 0
+
+    def get(self, key: str) -> Optional[CachedResponse]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT text, output_hash, tokens, expires_at FROM llm_responses WHERE key = ? AND expires_at > ?",
+                (key, now),
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("UPDATE llm_responses SET used_at = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+        return CachedResponse(*row)
+
+    def put(self, key: str, entry: CachedResponse):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_responses VALUES (?, ?, ?, ?, ?, ?)",
+                (key, entry.text, entry.output_hash, entry.tokens, entry.expires_at, time.time()),
+            )
+            self._writes += 1
+            if self._writes % 100 == 0:
+                self._trim()
+            self._conn.commit()
+
+    def _trim(self):
+        self._conn.execute("DELETE FROM llm_responses WHERE expires_at <= ?", (time.time(),))
+        self._conn.execute(
+            "DELETE FROM llm_responses WHERE key IN ("
+            " SELECT key FROM llm_responses ORDER BY used_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        )
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT count(*) FROM llm_responses").fetchone()[0]
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM llm_responses")
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class ResponseCache:
+    def __init__(self, max_entries: int = 10000, ttl: float = 3600.0, disk_path: Optional[str] = None, disk_max_entries: int = 100000):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, CachedResponse]" = OrderedDict()
+        self._disk = _DiskTier(disk_path, disk_max_entries) if disk_path else None
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.tokens_saved = 0
+
+    async def get(self, key: str) -> Optional[CachedResponse]:
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry.expires_at > time.time():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                self.tokens_saved += entry.tokens
+                return entry
+            del self._entries[key]
+            self.expirations += 1
+        if self._disk:
+            entry = await asyncio.to_thread(self._disk.get, key)
+            if entry is not None:
+                self._remember(key, entry)
+                self.disk_hits += 1
+                self.tokens_saved += entry.tokens
+                return entry
+        self.misses += 1
+        return None
+
+    async def put(self, key: str, text: str, output_hash: str, tokens: int, ttl: Optional[float] = None):
+        entry = CachedResponse(text, output_hash, tokens, time.time() + (ttl or self.ttl))
+        self._remember(key, entry)
+        self.stores += 1
+        if self._disk:
+            await asyncio.to_thread(self._disk.put, key, entry)
+
+    def _remember(self, key: str, entry: CachedResponse):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    async def clear(self):
+        self._entries.clear()
+        if self._disk:
+            await asyncio.to_thread(self._disk.clear)
+
+    def close(self):
+        if self._disk:
+            self._disk.close()
+            self._disk = None
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+            "disk_entries": self._disk.count() if self._disk else None,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_ratio": round((self.hits + self.disk_hits) / lookups, 4) if lookups else 0.0,
+            "stores": self.stores,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "tokens_saved": self.tokens_saved,
+        }
@@ -0,0 +1,184 @@
+"""Bounded execution engine for agent runs.
+
+Runs are queued in priority lanes (``manual`` ahead of ``scheduled``) and
+started only while the global worker count and the caller's per-user and
+per-provider limits all have room. A job that is blocked on its user or
+provider limit is passed over rather than holding a worker, so one busy
+user cannot stall everyone else. ``submit`` raises ``QueueFullError`` once
+``max_queue`` runs are waiting; the API maps that to HTTP 429.
+"""
+import asyncio
+import itertools
+import logging
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+LANES = ("manual", "scheduled")
+
+
+class QueueFullError(Exception):
+    """The run queue is at capacity."""
+
+
+@dataclass
+class _Job:
+    fn: Callable[[], Awaitable[Any]]
+    user_id: str
+    provider: str
+    lane: str
+    seq: int
+    future: asyncio.Future
+    enqueued_at: float = field(default_factory=time.perf_counter)
+
+
+def parse_limits(spec: str) -> Dict[str, int]:
+    """``"groqcloud=8,gemini=4"`` -> ``{"groqcloud": 8, "gemini": 4}``"""
+    limits = {}
+    for part in filter(None, (p.strip() for p in spec.split(","))):
+        name, _, value = part.partition("=")
+        limits[name.strip()] = int(value)
+    return limits
+
+
+class RunEngine:
+    def __init__(self, workers: int = 16, max_queue: int = 1000, per_user: int = 4, per_provider: int = 8, provider_limits: Optional[Dict[str, int]] = None):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.per_user = per_user
+        self.per_provider = per_provider
+        self.provider_limits = provider_limits or {}
+        self._lanes: Dict[str, Deque[_Job]] = {lane: deque() for lane in LANES}
+        self._seq = itertools.count()
+        self._active = 0
+        self._active_by_user: Dict[str, int] = {}
+        self._active_by_provider: Dict[str, int] = {}
+        self._tasks = set()
+        self._closed = False
+        self._waits: Dict[str, Deque[float]] = {lane: deque(maxlen=1000) for lane in LANES}
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+
+    def queued(self) -> int:
+        return sum(len(q) for q in self._lanes.values())
+
+    def provider_limit(self, provider: str) -> int:
+        return self.provider_limits.get(provider, self.per_provider)
+
+    # submission ------------------------------------------------------------
+
+    def submit(self, fn: Callable[[], Awaitable[Any]], user_id: str, provider: str, lane: str = "manual") -> asyncio.Future:
+        """Queue ``fn``; the returned future resolves with its result."""
+        if lane not in self._lanes:
+            raise ValueError(f"Unknown lane: {lane}")
+        if self._closed or self.queued() >= self.max_queue:
+            self.rejected += 1
+            raise QueueFullError(f"run queue is full ({self.max_queue} waiting)")
+        future = asyncio.get_running_loop().create_future()
+        self._lanes[lane].append(_Job(fn, user_id, provider, lane, next(self._seq), future))
+        self.submitted += 1
+        self._pump()
+        return future
+
+    async def run(self, fn: Callable[[], Awaitable[Any]], user_id: str, provider: str, lane: str = "manual") -> Any:
+        """Queue ``fn`` and wait for its result; the run continues if the caller goes away."""
+        return await asyncio.shield(self.submit(fn, user_id, provider, lane))
+
+    # dispatch --------------------------------------------------------------
+
+    def _eligible(self, job: _Job) -> bool:
+        return (
+            self._active_by_user.get(job.user_id, 0) < self.per_user
+            and self._active_by_provider.get(job.provider, 0) < self.provider_limit(job.provider)
+        )
+
+    def _next_job(self) -> Optional[_Job]:
+        for lane in LANES:
+            queue = self._lanes[lane]
+            for i, job in enumerate(queue):
+                if self._eligible(job):
+                    del queue[i]
+                    return job
+        return None
+
+    def _pump(self):
+        while self._active < self.workers:
+            job = self._next_job()
+            if job is None:
+                return
+            self._start(job)
+
+    def _start(self, job: _Job):
+        self._active += 1
+        self._active_by_user[job.user_id] = self._active_by_user.get(job.user_id, 0) + 1
+        self._active_by_provider[job.provider] = self._active_by_provider.get(job.provider, 0) + 1
+        self._waits[job.lane].append(time.perf_counter() - job.enqueued_at)
+        task = asyncio.create_task(self._execute(job))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _execute(self, job: _Job):
+        try:
+            result = await job.fn()
+        except BaseException as e:
+            self.failed += 1
+            if not job.future.done():
+                job.future.set_exception(e)
+            if isinstance(e, asyncio.CancelledError):
+                raise
+        else:
+            self.completed += 1
+            if not job.future.done():
+                job.future.set_result(result)
+        finally:
+            self._active -= 1
+            self._release(self._active_by_user, job.user_id)
+            self._release(self._active_by_provider, job.provider)
+            self._pump()
+
+    @staticmethod
+    def _release(counts: Dict[str, int], key: str):
+        counts[key] -= 1
+        if not counts[key]:
+            del counts[key]
+
+    async def close(self):
+        """Reject queued runs and wait for the ones in flight."""
+        self._closed = True
+        for queue in self._lanes.values():
+            while queue:
+                job = queue.popleft()
+                if not job.future.done():
+                    job.future.set_exception(QueueFullError("run engine is shutting down"))
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    # metrics ---------------------------------------------------------------
+
+    def stats(self) -> Dict[str, Any]:
+        def wait_stats(samples: Deque[float]) -> Dict[str, float]:
+            ordered = sorted(samples)
+
+            def pct(p: float) -> float:
+                return round(ordered[min(len(ordered) - 1, int(len(ordered) * p))] * 1000, 3) if ordered else 0.0
+
+            return {"p50": pct(0.5), "p95": pct(0.95), "max": pct(1.0)}
+
+        return {
+            "workers": self.workers,
+            "active": self._active,
+            "queue_depth": {lane: len(q) for lane, q in self._lanes.items()},
+            "max_queue": self.max_queue,
+            "active_by_provider": dict(self._active_by_provider),
+            "active_users": len(self._active_by_user),
+            "limits": {"per_user": self.per_user, "per_provider": self.per_provider, "providers": self.provider_limits},
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "wait_ms": {lane: wait_stats(samples) for lane, samples in self._waits.items()},
+        }
@@ -0,0 +1,248 @@
+"""Lease-based partitioning of the ``schedules`` table across workers/nodes.
+
+Schedules hash into ``partitions`` buckets (``schedules.partition``). Every
+node heartbeats into ``scheduler_nodes`` and, every ``renew_interval``
+seconds, renews its leases in ``schedule_leases``, gives back anything
+above its fair share (``ceil(partitions / live nodes)``) and claims free
+or expired partitions with ``FOR UPDATE SKIP LOCKED``, so concurrent nodes
+never contend for the same rows. When a node dies its leases expire after
+``lease_ttl`` and the survivors pick them up on their next tick.
+
+Leases only spread the work; exactly-once firing per tick comes from the
+scheduler's claim, a compare-and-set on ``next_run_at`` (see
+``CLAIM_SCHEDULE_SQL``), which also fences a node whose lease lapsed
+mid-fire.
+"""
+import asyncio
+import logging
+import math
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+CREATE_LEASE_TABLES_SQL = [
+    """
+    CREATE TABLE IF NOT EXISTS schedule_leases (
+        partition INT PRIMARY KEY,
+        owner TEXT,
+        expires_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()
+    );
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS scheduler_nodes (
+        node_id TEXT PRIMARY KEY,
+        heartbeat_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()
+    );
+    """,
+    "ALTER TABLE schedules ADD COLUMN IF NOT EXISTS partition INT;",
+    "CREATE INDEX IF NOT EXISTS schedules_partition_idx ON schedules (partition);",
+]
+
+# Same bucket function for every writer; keep in sync with partition_sql().
+PARTITION_EXPR = "(((hashtext({id}) % {n}) + {n}) % {n})"
+
+# Fire a tick only if nobody has advanced next_run_at past it yet.
+CLAIM_SCHEDULE_SQL = """
+UPDATE schedules
+SET next_run_at = $3, data = data || $4::jsonb
+WHERE id = $1
+  AND (next_run_at IS NULL OR next_run_at BETWEEN $2::timestamptz - interval '1 millisecond' AND $2::timestamptz + interval '1 millisecond')
+RETURNING id
+"""
+
+CLAIM_PARTITIONS_SQL = """
+WITH free AS (
+    SELECT partition FROM schedule_leases
+    WHERE owner IS NULL OR expires_at < now()
+    ORDER BY partition
+    LIMIT $2
+    FOR UPDATE SKIP LOCKED
+)
+UPDATE schedule_leases l
+SET owner = $1, expires_at = now() + $3::interval
+FROM free
+WHERE l.partition = free.partition
+RETURNING l.partition
+"""
+
+
+def partition_sql(id_expr: str, partitions: int) -> str:
+    return PARTITION_EXPR.format(id=id_expr, n=int(partitions))
+
+
+def default_node_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+
+async def fetch_schedules(pool, partitions: Optional[Iterable[int]] = None, schedule_id: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Schedule records (optionally one partition set or one id) with persisted next_run_at/partition."""
+    sql = "SELECT data, next_run_at, partition FROM schedules"
+    args: list = []
+    if schedule_id is not None:
+        sql += " WHERE id = $1"
+        args.append(schedule_id)
+    elif partitions is not None:
+        sql += " WHERE partition = ANY($1::int[])"
+        args.append(list(partitions))
+    async with pool.acquire() as conn:
+        rows = await conn.fetch(sql, *args)
+    records = []
+    for row in rows:
+        record = dict(row["data"])
+        if row["next_run_at"]:
+            record["next_run_at"] = row["next_run_at"].isoformat()
+        record["partition"] = row["partition"]
+        records.append(record)
+    return records
+
+
+async def claim_tick(pool, scheduler, entry, due: float) -> bool:
+    """Compare-and-set the schedule's next_run_at from ``due``; only one process wins a tick.
+
+    On a lost claim the local entry is moved to whatever the table says, so a
+    node that fell behind (or whose last write failed) resynchronises.
+    """
+    def ts(epoch: float) -> datetime:
+        return datetime.fromtimestamp(epoch, timezone.utc)
+
+    async with pool.acquire() as conn:
+        won = await conn.fetchval(
+            CLAIM_SCHEDULE_SQL,
+            entry.id,
+            ts(due),
+            ts(entry.next_run_at),
+            {"next_run_at": entry.record["next_run_at"], "last_run_at": entry.record.get("last_run_at")},
+        )
+        if won:
+            return True
+        row = await conn.fetchrow("SELECT next_run_at FROM schedules WHERE id = $1", entry.id)
+    if row is None:
+        scheduler.remove(entry.id)
+    elif row["next_run_at"] is not None:
+        scheduler.reschedule(entry.id, row["next_run_at"].timestamp())
+    return False
+
+
+PartitionCallback = Callable[[Set[int]], Awaitable[None]]
+
+
+class ScheduleLeaseManager:
+    def __init__(
+        self,
+        pool,
+        on_acquire: PartitionCallback,
+        on_release: PartitionCallback,
+        partitions: int = 64,
+        lease_ttl: float = 15.0,
+        renew_interval: float = 5.0,
+        node_id: Optional[str] = None,
+    ):
+        self.pool = pool
+        self.on_acquire = on_acquire
+        self.on_release = on_release
+        self.partitions = partitions
+        self.lease_ttl = timedelta(seconds=lease_ttl)
+        self.renew_interval = renew_interval
+        self.node_id = node_id or default_node_id()
+        self.owned: Set[int] = set()
+        self.live_nodes = 0
+        self.acquired_total = 0
+        self.released_total = 0
+        self.lost_total = 0
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        async with self.pool.acquire() as conn:
+            for sql in CREATE_LEASE_TABLES_SQL:
+                await conn.execute(sql)
+            await conn.execute(
+                "INSERT INTO schedule_leases (partition) SELECT generate_series(0, $1 - 1) ON CONFLICT DO NOTHING",
+                self.partitions,
+            )
+            await conn.execute(
+                f"UPDATE schedules SET partition = {partition_sql('id', self.partitions)} WHERE partition IS NULL"
+            )
+        await self.rebalance()
+        self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.renew_interval)
+            try:
+                await self.rebalance()
+            except Exception:
+                logger.exception("schedule lease rebalance failed; will retry")
+
+    async def rebalance(self):
+        """Heartbeat, renew, shed excess and claim free partitions up to the fair share."""
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.execute(
+                    "INSERT INTO scheduler_nodes (node_id) VALUES ($1) "
+                    "ON CONFLICT (node_id) DO UPDATE SET heartbeat_at = now()",
+                    self.node_id,
+                )
+                await conn.execute("DELETE FROM scheduler_nodes WHERE heartbeat_at < now() - $1::interval", self.lease_ttl)
+                self.live_nodes = await conn.fetchval("SELECT count(*) FROM scheduler_nodes")
+                renewed = {
+                    r["partition"]
+                    for r in await conn.fetch(
+                        "UPDATE schedule_leases SET expires_at = now() + $2::interval WHERE owner = $1 RETURNING partition",
+                        self.node_id, self.lease_ttl,
+                    )
+                }
+        lost = self.owned - renewed
+        if lost:
+            # lease expired while we were away and someone else took it
+            self.lost_total += len(lost)
+            self.owned -= lost
+            await self.on_release(lost)
+
+        share = math.ceil(self.partitions / max(1, self.live_nodes))
+        if len(self.owned) > share:
+            excess = set(sorted(self.owned)[share:])
+            # stop firing before giving the partitions away
+            self.owned -= excess
+            await self.on_release(excess)
+            async with self.pool.acquire() as conn:
+                await conn.execute(
+                    "UPDATE schedule_leases SET owner = NULL, expires_at = now() WHERE owner = $1 AND partition = ANY($2::int[])",
+                    self.node_id, list(excess),
+                )
+            self.released_total += len(excess)
+        elif len(self.owned) < share:
+            async with self.pool.acquire() as conn:
+                rows = await conn.fetch(CLAIM_PARTITIONS_SQL, self.node_id, share - len(self.owned), self.lease_ttl)
+            gained = {r["partition"] for r in rows} - self.owned
+            if gained:
+                self.owned |= gained
+                self.acquired_total += len(gained)
+                await self.on_acquire(gained)
+
+    async def close(self):
+        """Hand every lease back so the other nodes can take over immediately."""
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        released, self.owned = self.owned, set()
+        if released:
+            await self.on_release(released)
+        async with self.pool.acquire() as conn:
+            await conn.execute("UPDATE schedule_leases SET owner = NULL, expires_at = now() WHERE owner = $1", self.node_id)
+            await conn.execute("DELETE FROM scheduler_nodes WHERE node_id = $1", self.node_id)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "node_id": self.node_id,
+            "partitions": self.partitions,
+            "owned": len(self.owned),
+            "live_nodes": self.live_nodes,
+            "acquired": self.acquired_total,
+            "released": self.released_total,
+            "lost": self.lost_total,
+        }
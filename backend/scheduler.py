@@ -0,0 +1,328 @@
+"""Heap-based scheduler for recurring agent runs.
+
+Schedules sit in a min-heap keyed by their next fire time, so the loop
+sleeps exactly until the earliest one is due (sub-second precision,
+independent of how many schedules exist) and each fire costs O(log n).
+Schedules fire every ``interval`` seconds or on a five-field cron
+expression (UTC). Before each run the tick is handed to ``claim``, which
+writes the new ``next_run_at`` back (so restarts resume where they left
+off) and may refuse the tick if another node already fired it. A schedule
+whose previous run is still going is skipped rather than stacked, and
+``max_concurrent`` bounds the runs in flight.
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import deque
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Deque, Dict, FrozenSet, Iterable, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+CRON_ALIASES = {
+    "@yearly": "0 0 1 1 *",
+    "@annually": "0 0 1 1 *",
+    "@monthly": "0 0 1 * *",
+    "@weekly": "0 0 * * 0",
+    "@daily": "0 0 * * *",
+    "@midnight": "0 0 * * *",
+    "@hourly": "0 * * * *",
+}
+MONTH_NAMES = {name: i for i, name in enumerate(["jan", "feb", "mar", "apr", "may", "jun", "jul", "aug", "sep", "oct", "nov", "dec"], 1)}
+DAY_NAMES = {name: i for i, name in enumerate(["sun", "mon", "tue", "wed", "thu", "fri", "sat"])}
+
+
+def _parse_field(text: str, low: int, high: int, names: Dict[str, int]) -> FrozenSet[int]:
+    values: Set[int] = set()
+    for part in text.lower().split(","):
+        body, _, step_text = part.partition("/")
+        step = int(step_text) if step_text else 1
+        if step < 1:
+            raise ValueError(f"invalid cron step: {part}")
+        if body == "*":
+            start, end = low, high
+        else:
+            first, _, last = body.partition("-")
+            start = names[first] if first in names else int(first)
+            end = (names[last] if last in names else int(last)) if last else (high if step_text else start)
+        if not low <= start <= end <= high:
+            raise ValueError(f"cron value out of range: {part}")
+        values.update(range(start, end + 1, step))
+    return frozenset(values)
+
+
+class CronExpr:
+    """Standard five-field cron expression (minute hour day-of-month month day-of-week)."""
+
+    def __init__(self, expr: str):
+        self.expr = expr.strip()
+        fields = CRON_ALIASES.get(self.expr.lower(), self.expr).split()
+        if len(fields) != 5:
+            raise ValueError(f"cron expression needs 5 fields: {expr!r}")
+        self.minutes = _parse_field(fields[0], 0, 59, {})
+        self.hours = _parse_field(fields[1], 0, 23, {})
+        self.days = _parse_field(fields[2], 1, 31, {})
+        self.months = _parse_field(fields[3], 1, 12, MONTH_NAMES)
+        # 7 is an alias for Sunday
+        self.weekdays = frozenset(d % 7 for d in _parse_field(fields[4], 0, 7, DAY_NAMES))
+        self._any_day = fields[2] == "*"
+        self._any_weekday = fields[4] == "*"
+
+    def _day_matches(self, t: datetime) -> bool:
+        day_ok = t.day in self.days
+        weekday_ok = (t.weekday() + 1) % 7 in self.weekdays
+        if self._any_day or self._any_weekday:
+            return day_ok and weekday_ok
+        # both restricted: cron fires when either matches
+        return day_ok or weekday_ok
+
+    def next_after(self, after: datetime) -> datetime:
+        """First matching minute strictly after ``after`` (UTC)."""
+        t = after.astimezone(timezone.utc).replace(second=0, microsecond=0) + timedelta(minutes=1)
+        horizon = t.year + 5
+        while t.year <= horizon:
+            if t.month not in self.months:
+                t = (t.replace(day=1, hour=0, minute=0) + timedelta(days=32)).replace(day=1)
+            elif not self._day_matches(t):
+                t = t.replace(hour=0, minute=0) + timedelta(days=1)
+            elif t.hour not in self.hours:
+                t = t.replace(minute=0) + timedelta(hours=1)
+            elif t.minute not in self.minutes:
+                t += timedelta(minutes=1)
+            else:
+                return t
+        raise ValueError(f"cron expression never fires: {self.expr!r}")
+
+
+def _epoch_to_iso(ts: Optional[float]) -> Optional[str]:
+    return datetime.fromtimestamp(ts, timezone.utc).isoformat() if ts is not None else None
+
+
+@dataclass
+class ScheduleEntry:
+    id: str
+    record: Dict[str, Any]
+    interval: Optional[float] = None
+    cron: Optional[CronExpr] = None
+    next_run_at: float = 0.0
+    last_run_at: Optional[float] = None
+    running: bool = False
+    runs: int = 0
+    failures: int = 0
+    skipped: int = 0
+    lost_claims: int = 0
+    last_lag: float = 0.0
+    max_lag: float = 0.0
+    lag_total: float = 0.0
+
+    def following(self, due: float, now: float) -> float:
+        """Next fire time after a fire that was due at ``due``; missed slots are not replayed."""
+        if self.cron is not None:
+            return self.cron.next_after(datetime.fromtimestamp(now, timezone.utc)).timestamp()
+        nxt = due + self.interval
+        if nxt <= now:
+            nxt += ((now - nxt) // self.interval + 1) * self.interval
+        return nxt
+
+    def stats(self) -> Dict[str, Any]:
+        fired = self.runs + self.skipped
+        return {
+            "schedule_id": self.id,
+            "agent_id": self.record.get("agent_id"),
+            "interval": self.interval,
+            "cron": self.cron.expr if self.cron else None,
+            "next_run_at": _epoch_to_iso(self.next_run_at),
+            "last_run_at": _epoch_to_iso(self.last_run_at),
+            "running": self.running,
+            "runs": self.runs,
+            "failures": self.failures,
+            "skipped_overlap": self.skipped,
+            "lost_claims": self.lost_claims,
+            "lag_ms": {
+                "last": round(self.last_lag * 1000, 3),
+                "avg": round(self.lag_total / fired * 1000, 3) if fired else 0.0,
+                "max": round(self.max_lag * 1000, 3),
+            },
+        }
+
+
+Fire = Callable[[Dict[str, Any]], Awaitable[Any]]
+# claim(entry, due) -> whether this process may run the tick that was due at ``due``
+Claim = Callable[[ScheduleEntry, float], Awaitable[bool]]
+
+
+class Scheduler:
+    def __init__(self, fire: Fire, claim: Optional[Claim] = None, max_concurrent: int = 32, min_interval: float = 1.0,
+                 on_lag: Optional[Callable[[float], None]] = None):
+        self.fire = fire
+        self.claim = claim
+        # called with each dispatch's lag in seconds (e.g. a metrics histogram)
+        self.on_lag = on_lag
+        self.min_interval = min_interval
+        self.entries: Dict[str, ScheduleEntry] = {}
+        self._heap: List[Tuple[float, int, str]] = []
+        self._seq = itertools.count()
+        self._wake = asyncio.Event()
+        self._slots = asyncio.Semaphore(max_concurrent)
+        self.max_concurrent = max_concurrent
+        self._tasks: Set[asyncio.Task] = set()
+        self._task: Optional[asyncio.Task] = None
+        self._lags: Deque[float] = deque(maxlen=1000)
+        self.fired = 0
+
+    # schedule management -------------------------------------------------
+
+    def parse(self, record: Dict[str, Any]) -> Tuple[Optional[float], Optional[CronExpr]]:
+        """Validate a schedule record's ``cron`` or ``interval``; raises ValueError."""
+        if record.get("cron"):
+            return None, CronExpr(str(record["cron"]))
+        interval = float(record.get("interval", 60))
+        if interval < self.min_interval:
+            raise ValueError(f"interval must be at least {self.min_interval} seconds")
+        return interval, None
+
+    def add(self, record: Dict[str, Any]) -> ScheduleEntry:
+        """Add or replace a schedule, resuming from the record's ``next_run_at`` if it has one."""
+        interval, cron = self.parse(record)
+        entry = ScheduleEntry(id=record["id"], record=record, interval=interval, cron=cron)
+        now = time.time()
+        next_run_at = datetime.fromisoformat(record["next_run_at"]).timestamp() if record.get("next_run_at") else None
+        if next_run_at is None:
+            next_run_at = cron.next_after(datetime.fromtimestamp(now, timezone.utc)).timestamp() if cron else now + interval
+        entry.next_run_at = next_run_at
+        record["next_run_at"] = _epoch_to_iso(next_run_at)
+        old = self.entries.get(entry.id)
+        if old is not None:
+            entry.running = old.running
+        self.entries[entry.id] = entry
+        self._push(entry)
+        return entry
+
+    def reschedule(self, schedule_id: str, next_run_at: float):
+        """Move a schedule to an externally decided fire time (e.g. another node's claim)."""
+        entry = self.entries.get(schedule_id)
+        if entry is None or entry.next_run_at == next_run_at:
+            return
+        entry.next_run_at = next_run_at
+        entry.record["next_run_at"] = _epoch_to_iso(next_run_at)
+        self._push(entry)
+
+    def remove(self, schedule_id: str) -> bool:
+        # the heap entry goes stale and is dropped when it surfaces
+        return self.entries.pop(schedule_id, None) is not None
+
+    def _push(self, entry: ScheduleEntry):
+        heapq.heappush(self._heap, (entry.next_run_at, next(self._seq), entry.id))
+        if self._heap[0][2] == entry.id:
+            self._wake.set()
+
+    # loop -----------------------------------------------------------------
+
+    async def start(self, records: Iterable[Dict[str, Any]] = ()):
+        """Load saved schedule records and start the timer loop."""
+        for record in records:
+            try:
+                self.add(record)
+            except (KeyError, ValueError):
+                logger.warning("ignoring invalid schedule %s", record.get("id"))
+        self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            self._wake.clear()
+            if not self._heap:
+                await self._wake.wait()
+                continue
+            due, _, schedule_id = self._heap[0]
+            entry = self.entries.get(schedule_id)
+            if entry is None or entry.next_run_at != due:
+                heapq.heappop(self._heap)
+                continue
+            delay = due - time.time()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            heapq.heappop(self._heap)
+            self._dispatch(entry, due)
+
+    def _dispatch(self, entry: ScheduleEntry, due: float):
+        now = time.time()
+        lag = now - due
+        entry.last_lag = lag
+        entry.max_lag = max(entry.max_lag, lag)
+        entry.lag_total += lag
+        self._lags.append(lag)
+        if self.on_lag:
+            self.on_lag(lag)
+        self.fired += 1
+        entry.next_run_at = entry.following(due, now)
+        entry.record["next_run_at"] = _epoch_to_iso(entry.next_run_at)
+        self._push(entry)
+        if entry.running:
+            entry.skipped += 1
+            run = False
+        else:
+            entry.running = True
+            entry.last_run_at = now
+            entry.record["last_run_at"] = _epoch_to_iso(now)
+            run = True
+        task = asyncio.create_task(self._execute(entry, due, run))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _execute(self, entry: ScheduleEntry, due: float, run: bool):
+        if self.claim:
+            try:
+                claimed = await self.claim(entry, due)
+            except Exception:
+                logger.exception("failed to claim schedule %s", entry.id)
+                claimed = False
+            if not claimed:
+                entry.lost_claims += 1
+                if run:
+                    entry.running = False
+                return
+        if not run:
+            return
+        try:
+            async with self._slots:
+                await self.fire(entry.record)
+            entry.runs += 1
+        except Exception:
+            entry.failures += 1
+            logger.exception("scheduled run %s failed", entry.id)
+        finally:
+            entry.running = False
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    # metrics --------------------------------------------------------------
+
+    def stats(self) -> Dict[str, Any]:
+        lags = sorted(self._lags)
+
+        def pct(p: float) -> float:
+            return round(lags[min(len(lags) - 1, int(len(lags) * p))] * 1000, 3) if lags else 0.0
+
+        return {
+            "schedules": len(self.entries),
+            "heap_size": len(self._heap),
+            "fired": self.fired,
+            "running": sum(1 for e in self.entries.values() if e.running),
+            "max_concurrent": self.max_concurrent,
+            "next_due_in": round(self._heap[0][0] - time.time(), 3) if self._heap else None,
+            "lag_ms": {"p50": pct(0.5), "p95": pct(0.95), "max": pct(1.0)},
+        }
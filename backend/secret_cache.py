@@ -0,0 +1,128 @@
+"""Bounded TTL/LRU cache of decrypted provider API keys.
+
+Keeps the ``api_keys`` lookup and Fernet decrypt off the hot path of agent
+runs. Entries are keyed by ``(user_id, provider)``, expire after ``ttl``
+seconds and are dropped on every key write.
+
+A load that races a key write must not cache the old value. Loads take a
+snapshot of a global invalidation sequence; ``put`` refuses the value if
+the key was invalidated after that snapshot. The per-key invalidation map
+is pruned of keys with no entry and no load in flight once it grows past
+twice ``max_entries``. ``_floor`` remembers the newest pruned invalidation,
+so a snapshot taken before it (say, the run path's, which is taken before
+the cache is consulted) is conservatively not cached.
+"""
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+Key = Tuple[str, str]
+
+
+class SecretCache:
+    def __init__(self, max_entries: int = 10000, ttl: float = 300.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[Key, Tuple[str, float]]" = OrderedDict()
+        # key -> sequence number of its last invalidation, so an in-flight load can't repopulate a stale key
+        self._seq = 0
+        self._invalidated: Dict[Key, int] = {}
+        self._floor = 0
+        self._loading: Dict[Key, int] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, user_id: str, provider: str) -> Optional[str]:
+        key = (user_id, provider)
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        value, expires_at = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, user_id: str, provider: str, value: str, generation: Optional[int] = None):
+        key = (user_id, provider)
+        if generation is not None and (generation < self._floor or self._invalidated.get(key, -1) > generation):
+            return
+        self._entries[key] = (value, time.monotonic() + self.ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def generation(self, user_id: str, provider: str) -> int:
+        """Snapshot to pass to ``put``/``get_or_load`` when the key is read before the cache is consulted."""
+        return self._seq
+
+    async def get_or_load(self, user_id: str, provider: str, loader: Callable[[], Awaitable[Optional[str]]],
+                          generation: Optional[int] = None) -> Optional[str]:
+        """Return the cached key or call ``loader`` (lookup + decrypt) and cache it.
+
+        ``generation`` is the snapshot taken when the encrypted key was read,
+        if that happened before this call.
+        """
+        value = self.get(user_id, provider)
+        if value is not None:
+            return value
+        if generation is None:
+            generation = self.generation(user_id, provider)
+        key = (user_id, provider)
+        self._loading[key] = self._loading.get(key, 0) + 1
+        try:
+            value = await loader()
+        finally:
+            if self._loading[key] == 1:
+                del self._loading[key]
+            else:
+                self._loading[key] -= 1
+        if value is not None:
+            self.put(user_id, provider, value, generation)
+        return value
+
+    def invalidate(self, user_id: str, provider: Optional[str] = None):
+        """Drop one provider's key, or all keys for ``user_id`` if provider is None."""
+        if provider is None:
+            keys = {k for k in self._entries if k[0] == user_id} | {k for k in self._loading if k[0] == user_id}
+        else:
+            keys = [(user_id, provider)]
+        for key in keys:
+            self._seq += 1
+            self._invalidated[key] = self._seq
+            if self._entries.pop(key, None) is not None:
+                self.invalidations += 1
+        if len(self._invalidated) > 2 * self.max_entries:
+            self._prune()
+
+    def _prune(self):
+        for key in [k for k in self._invalidated if k not in self._entries and k not in self._loading]:
+            self._floor = max(self._floor, self._invalidated.pop(key))
+
+    def clear(self):
+        # every load in flight predates this
+        self._seq += 1
+        self._floor = self._seq
+        self._invalidated.clear()
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "tracked_invalidations": len(self._invalidated),
+        }
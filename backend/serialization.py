@@ -0,0 +1,78 @@
+"""JSON serialization for Postgres, HTTP responses and content hashes.
+
+Everything except content hashes goes through orjson:
+
+- ``register_json_codecs`` is the asyncpg connection ``init`` hook. It
+  encodes/decodes ``json`` and ``jsonb`` in binary format, so JSONB
+  parameters are plain Python objects (never pre-serialized strings) and
+  rows come back as dicts/lists without a text round trip.
+- ``ORJSONResponse`` is the app's default response class.
+- ``canonical`` is the form hashed into metadata and proof hashes. It
+  stays on stdlib json: those hashes are stored in agents, proofs and on
+  chain, and must keep the exact bytes they were first taken over.
+
+datetimes serialize as RFC 3339 strings; anything else orjson doesn't
+know (Decimal, sets, pydantic models) goes through ``_default``.
+"""
+import json
+from decimal import Decimal
+from typing import Any, Union
+
+import orjson
+from starlette.responses import JSONResponse
+
+_OPTIONS = orjson.OPT_NON_STR_KEYS
+# jsonb's binary wire format is a version byte followed by the JSON text
+_JSONB_VERSION = b"\x01"
+
+
+def _default(obj: Any) -> Any:
+    if isinstance(obj, Decimal):
+        return float(obj)
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    if hasattr(obj, "model_dump"):
+        return obj.model_dump()
+    return str(obj)
+
+
+def dumpb(obj: Any) -> bytes:
+    return orjson.dumps(obj, default=_default, option=_OPTIONS)
+
+
+def dumps(obj: Any) -> str:
+    return orjson.dumps(obj, default=_default, option=_OPTIONS).decode()
+
+
+def canonical(obj: Any) -> str:
+    """Deterministic JSON for hashing, byte-identical to ``json.dumps(obj, sort_keys=True)``."""
+    return json.dumps(obj, sort_keys=True)
+
+
+def loads(data: Union[str, bytes, bytearray, memoryview]) -> Any:
+    return orjson.loads(data)
+
+
+def _encode_jsonb(value: Any) -> bytes:
+    return _JSONB_VERSION + dumpb(value)
+
+
+def _decode_jsonb(data: bytes) -> Any:
+    return orjson.loads(memoryview(data)[1:])
+
+
+async def register_json_codecs(conn):
+    """asyncpg ``init`` hook: json/jsonb <-> Python objects via orjson."""
+    await conn.set_type_codec("jsonb", encoder=_encode_jsonb, decoder=_decode_jsonb, schema="pg_catalog", format="binary")
+    await conn.set_type_codec("json", encoder=dumpb, decoder=orjson.loads, schema="pg_catalog", format="binary")
+
+
+class ORJSONResponse(JSONResponse):
+    """JSONResponse rendered with orjson.
+
+    FastAPI ships one too, but it is deprecated in favour of response
+    models, which these endpoints don't declare.
+    """
+
+    def render(self, content: Any) -> bytes:
+        return dumpb(content)
@@ -0,0 +1,235 @@
+"""Multicall aggregation in front of a ``ChainSubmitter``.
+
+Calls queued for the same account within ``max_wait`` seconds (or until
+``max_batch_size`` calls are waiting) are sent as one ``__execute__``
+multicall. Nonces are tracked locally per account, failed submissions are
+retried with exponential backoff, and the batch receipt is fanned back out
+to every original caller as a per-call ``PendingTx``. Calls share the
+batch's tx hash, so each handle also has a ``call_id`` (``<tx hash>:<index>``)
+that ``get`` resolves back to it.
+"""
+import asyncio
+import logging
+import os
+import random
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field, replace
+from typing import Any, Deque, Dict, List, Optional
+
+from chain import ChainSubmitter, PendingTx, TxReceipt
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ACCOUNT = os.getenv("STARKNET_ACCOUNT", "0x0phantom_backend_account")
+
+
+@dataclass
+class _QueuedCall:
+    contract_address: str
+    function: str
+    calldata: Dict[str, Any]
+    future: asyncio.Future
+    enqueued_at: float = field(default_factory=time.perf_counter)
+
+
+class _AccountQueue:
+    def __init__(self):
+        self.calls: List[_QueuedCall] = []
+        # the batch being submitted (possibly between retries)
+        self.in_flight: List[_QueuedCall] = []
+        self.nonce = 0
+        self.full = asyncio.Event()
+        self.worker: Optional[asyncio.Task] = None
+
+
+class CallHandle(PendingTx):
+    """A single call inside a multicall; shares the batch's tx hash."""
+
+    def __init__(self, batch: PendingTx, call: _QueuedCall, call_index: int, batch_size: int):
+        super().__init__(batch.tx_hash, call.contract_address, call.function)
+        self.call_index = call_index
+        self.batch_size = batch_size
+        self.call_id = f"{batch.tx_hash}:{call_index}"
+        batch.on_receipt(self._fan_out)
+
+    async def _fan_out(self, receipt: TxReceipt):
+        await self.resolve(replace(receipt, contract_address=self.contract_address, function=self.function))
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = super().to_dict()
+        data["call_id"] = self.call_id
+        data["call_index"] = self.call_index
+        data["batch_size"] = self.batch_size
+        return data
+
+
+def _percentile(samples: Deque[float], pct: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct))]
+
+
+class SubmitterClosedError(RuntimeError):
+    """The batcher shut down before the call was submitted."""
+
+
+class MulticallBatcher(ChainSubmitter):
+    """Groups queued calls into one multicall transaction per account."""
+
+    def __init__(
+        self,
+        inner: ChainSubmitter,
+        max_batch_size: int = 50,
+        max_wait: float = 0.05,
+        max_retries: int = 3,
+        backoff_base: float = 0.1,
+        backoff_max: float = 2.0,
+        account: str = DEFAULT_ACCOUNT,
+        max_handles: int = 10000,
+    ):
+        self.inner = inner
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.account = account
+        self.max_handles = max_handles
+        # call_id -> per-call handle, for get()
+        self._handles: "OrderedDict[str, CallHandle]" = OrderedDict()
+        self._queues: Dict[str, _AccountQueue] = {}
+        self._batch_sizes: Deque[int] = deque(maxlen=1000)
+        self._submit_latency: Deque[float] = deque(maxlen=1000)
+        self.batches = 0
+        self.calls = 0
+        self.retries = 0
+        self.failures = 0
+
+    async def submit(self, contract_address: str, function: str, calldata: Dict[str, Any], account: Optional[str] = None) -> PendingTx:
+        account = account or self.account
+        queue = self._queues.get(account)
+        if queue is None:
+            queue = self._queues[account] = _AccountQueue()
+        call = _QueuedCall(contract_address, function, calldata, asyncio.get_running_loop().create_future())
+        queue.calls.append(call)
+        if len(queue.calls) >= self.max_batch_size:
+            queue.full.set()
+        if queue.worker is None:
+            queue.worker = asyncio.create_task(self._drain(account, queue))
+        return await call.future
+
+    async def _drain(self, account: str, queue: _AccountQueue):
+        try:
+            while queue.calls:
+                if len(queue.calls) < self.max_batch_size:
+                    try:
+                        await asyncio.wait_for(queue.full.wait(), self.max_wait)
+                    except asyncio.TimeoutError:
+                        pass
+                queue.full.clear()
+                batch = queue.in_flight = queue.calls[:self.max_batch_size]
+                queue.calls = queue.calls[self.max_batch_size:]
+                await self._submit_batch(account, queue, batch)
+                queue.in_flight = []
+        finally:
+            queue.worker = None
+
+    async def _submit_batch(self, account: str, queue: _AccountQueue, batch: List[_QueuedCall]):
+        calldata = {
+            "nonce": queue.nonce,
+            "calls": [
+                {"to": c.contract_address, "selector": c.function, "calldata": c.calldata}
+                for c in batch
+            ],
+        }
+        attempt = 0
+        while True:
+            try:
+                pending = await self.inner.submit(account, "__execute__", calldata)
+                break
+            except Exception as exc:
+                attempt += 1
+                if attempt > self.max_retries:
+                    self.failures += 1
+                    logger.warning("multicall for %s failed after %d attempts: %s", account, attempt, exc)
+                    for call in batch:
+                        if not call.future.done():
+                            call.future.set_exception(exc)
+                    return
+                self.retries += 1
+                delay = min(self.backoff_max, self.backoff_base * (2 ** (attempt - 1)))
+                await asyncio.sleep(delay * random.uniform(0.5, 1.0))
+
+        # the nonce is consumed only once the multicall was accepted for submission
+        queue.nonce += 1
+        self.batches += 1
+        self.calls += len(batch)
+        self._batch_sizes.append(len(batch))
+        now = time.perf_counter()
+        for index, call in enumerate(batch):
+            self._submit_latency.append(now - call.enqueued_at)
+            if not call.future.done():
+                handle = CallHandle(pending, call, index, len(batch))
+                self._handles[handle.call_id] = handle
+                call.future.set_result(handle)
+        while len(self._handles) > self.max_handles:
+            self._handles.popitem(last=False)
+
+    def get(self, tx_hash: str) -> Optional[PendingTx]:
+        """The per-call handle for a ``call_id``; a bare hash can only name the whole multicall."""
+        handle = self._handles.get(tx_hash)
+        if handle is not None:
+            return handle
+        return self.inner.get(tx_hash)
+
+    async def start(self):
+        await self.inner.start()
+
+    async def close(self):
+        workers = [q.worker for q in self._queues.values() if q.worker]
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        # queued calls and a batch cut off mid-retry alike: nobody may be left waiting
+        closed = SubmitterClosedError("chain submitter closed before the call was submitted")
+        for queue in self._queues.values():
+            for call in queue.in_flight + queue.calls:
+                if not call.future.done():
+                    call.future.set_exception(closed)
+            queue.in_flight = []
+            queue.calls = []
+        await self.inner.close()
+
+    def stats(self) -> Dict[str, Any]:
+        sizes = self._batch_sizes
+        return {
+            "batches": self.batches,
+            "calls": self.calls,
+            "retries": self.retries,
+            "failures": self.failures,
+            "queue_depth": sum(len(q.calls) for q in self._queues.values()),
+            "accounts": {a: {"queue_depth": len(q.calls), "nonce": q.nonce} for a, q in self._queues.items()},
+            "batch_size": {
+                "avg": round(sum(sizes) / len(sizes), 2) if sizes else 0.0,
+                "max": max(sizes) if sizes else 0,
+            },
+            "submit_latency_ms": {
+                "p50": round(_percentile(self._submit_latency, 0.5) * 1000, 2),
+                "p95": round(_percentile(self._submit_latency, 0.95) * 1000, 2),
+                "p99": round(_percentile(self._submit_latency, 0.99) * 1000, 2),
+            },
+        }
+
+
+def create_batcher(inner: ChainSubmitter) -> ChainSubmitter:
+    """Wrap ``inner`` in a multicall batcher unless ``CHAIN_MULTICALL=false``."""
+    if os.getenv("CHAIN_MULTICALL", "true").lower() != "true":
+        return inner
+    return MulticallBatcher(
+        inner,
+        max_batch_size=int(os.getenv("CHAIN_BATCH_SIZE", "50")),
+        max_wait=float(os.getenv("CHAIN_BATCH_WAIT", "0.05")),
+        max_retries=int(os.getenv("CHAIN_SUBMIT_RETRIES", "3")),
+    )
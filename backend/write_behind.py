@@ -0,0 +1,268 @@
+"""Write-behind buffer for high-volume ``actions`` / ``proofs`` / ``events`` rows.
+
+Rows are acknowledged once they are fsynced to an append-only journal and
+are then flushed to Postgres in batches with ``copy_records_to_table`` when
+``max_batch`` rows are waiting or every ``flush_interval`` seconds. The
+in-memory queue is bounded: ``put`` waits until its rows fit under
+``max_queue``. Journal segments are deleted only after their rows are
+committed, and any segments left over from a crash are replayed on start,
+so delivery is at-least-once (proofs are deduplicated on ``proof_hash``).
+"""
+import asyncio
+import glob
+import logging
+import os
+import time
+from collections import deque
+from datetime import datetime, timezone
+from typing import Any, Deque, Dict, Iterable, List, Optional, Tuple
+
+from serialization import dumps, loads
+
+logger = logging.getLogger(__name__)
+
+# table -> (columns, conflict clause). Tables with a conflict clause are
+# staged in a temp table first because COPY cannot skip duplicates.
+TABLES = {
+    "actions": (("agent_id", "user_id", "action_type", "payload", "created_at"), None),
+    "proofs": (("proof_hash", "agent_id", "action_payload_hash", "proof", "created_at"), "ON CONFLICT (proof_hash) DO NOTHING"),
+    "events": (("type", "payload", "created_at"), None),
+}
+
+
+class WriteBehindBuffer:
+    def __init__(self, pool, journal_dir: str, max_batch: int = 500, flush_interval: float = 0.2, max_queue: int = 10000):
+        self.pool = pool
+        self.journal_dir = journal_dir
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self._rows: List[Dict[str, Any]] = []
+        self._space = asyncio.Condition()
+        self._wake = asyncio.Event()
+        self._sync_lock = asyncio.Lock()
+        # serialises flushes, so one returning means every row put before it is committed
+        self._flush_lock = asyncio.Lock()
+        self._journal = None
+        self._segment = 0
+        self._sealed_segments: List[str] = []
+        self._written = 0
+        self._synced = 0
+        self._task: Optional[asyncio.Task] = None
+        self._flush_latency: Deque[float] = deque(maxlen=1000)
+        self._batch_sizes: Deque[int] = deque(maxlen=1000)
+        self.flushed_rows = 0
+        self.flush_errors = 0
+        self.backpressure_waits = 0
+
+    # journal -------------------------------------------------------------
+
+    def _segment_path(self, n: int) -> str:
+        return os.path.join(self.journal_dir, f"wb-{n:010d}.jsonl")
+
+    def _open_segment(self):
+        self._segment += 1
+        self._journal = open(self._segment_path(self._segment), "a", encoding="utf-8")
+
+    async def _sync(self):
+        """Group commit: one fsync covers every line written before it started."""
+        target = self._written
+        async with self._sync_lock:
+            if self._synced >= target:
+                return
+            upto = self._written
+            self._journal.flush()
+            await asyncio.get_running_loop().run_in_executor(None, os.fsync, self._journal.fileno())
+            self._synced = upto
+
+    @staticmethod
+    def _seal(journal):
+        journal.flush()
+        os.fsync(journal.fileno())
+        journal.close()
+
+    async def _rotate(self) -> Tuple[List[Dict[str, Any]], List[str]]:
+        """Seal the current segment; returns the buffered rows and the segments holding them.
+
+        The swap happens before the first await, so rows put while the old
+        segment is being fsynced land in the new one and the next batch.
+        """
+        async with self._sync_lock:
+            journal, upto = self._journal, self._written
+            self._sealed_segments.append(self._segment_path(self._segment))
+            self._open_segment()
+            batch, segments = self._rows, self._sealed_segments
+            self._rows, self._sealed_segments = [], []
+            try:
+                await asyncio.get_running_loop().run_in_executor(None, self._seal, journal)
+            except Exception:
+                self._rows = batch + self._rows
+                self._sealed_segments = segments + self._sealed_segments
+                raise
+            self._synced = max(self._synced, upto)
+        return batch, segments
+
+    # lifecycle -----------------------------------------------------------
+
+    async def start(self):
+        """Replay leftover journal segments, then start the background flusher."""
+        os.makedirs(self.journal_dir, exist_ok=True)
+        leftovers = sorted(glob.glob(os.path.join(self.journal_dir, "wb-*.jsonl")))
+        for path in leftovers:
+            with open(path, encoding="utf-8") as fh:
+                for line in fh:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        self._rows.append(loads(line))
+                    except ValueError:
+                        # torn final write from a crash; it was never acknowledged
+                        logger.warning("skipping partial journal line in %s", path)
+            self._sealed_segments.append(path)
+            self._segment = max(self._segment, int(os.path.basename(path)[3:13]))
+        if leftovers:
+            logger.info("replaying %d journaled rows from %d segments", len(self._rows), len(leftovers))
+        self._open_segment()
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        """Stop the flusher and write out everything still buffered."""
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._rows:
+            await self.flush()
+        if self._journal:
+            self._journal.close()
+            self._journal = None
+            if not self._rows:
+                self._remove(self._segment_path(self._segment))
+
+    # writes --------------------------------------------------------------
+
+    async def put(self, table: str, row: Dict[str, Any]):
+        """Queue one row; returns once the row is durable in the journal."""
+        await self.put_many([(table, row)])
+
+    async def put_many(self, rows: Iterable[Tuple[str, Dict[str, Any]]]):
+        """Queue ``(table, row)`` pairs; returns once all are durable, behind a single fsync."""
+        rows = list(rows)
+        for table, _ in rows:
+            if table not in TABLES:
+                raise ValueError(f"Unsupported write-behind table: {table}")
+        # check and append under the condition, so waiters woken together can't overshoot the bound;
+        # a group larger than max_queue is let in once the queue is empty
+        def fits() -> bool:
+            return not self._rows or len(self._rows) + len(rows) <= self.max_queue
+
+        async with self._space:
+            if not fits():
+                self.backpressure_waits += 1
+                self._wake.set()
+                await self._space.wait_for(fits)
+            now = datetime.now(timezone.utc).isoformat()
+            for table, row in rows:
+                entry = {"table": table, "row": dict(row, created_at=row.get("created_at") or now)}
+                self._journal.write(dumps(entry) + "\n")
+                self._written += 1
+                self._rows.append(entry)
+        if len(self._rows) >= self.max_batch:
+            self._wake.set()
+        await self._sync()
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            if self._rows:
+                try:
+                    await self.flush()
+                except Exception:
+                    logger.exception("write-behind flush failed; will retry")
+                    await asyncio.sleep(self.flush_interval)
+
+    @staticmethod
+    def _record(table: str, row: Dict[str, Any]) -> tuple:
+        values = []
+        for column in TABLES[table][0]:
+            value = row.get(column)
+            # json/jsonb columns take the dicts as-is (connection codec)
+            if column == "created_at" and isinstance(value, str):
+                value = datetime.fromisoformat(value)
+            values.append(value)
+        return tuple(values)
+
+    async def flush(self):
+        """COPY every buffered row to Postgres in one transaction."""
+        async with self._flush_lock:
+            await self._flush()
+
+    async def _flush(self):
+        if not self._rows:
+            return
+        batch, segments = await self._rotate()
+        by_table: Dict[str, List[tuple]] = {}
+        for entry in batch:
+            by_table.setdefault(entry["table"], []).append(self._record(entry["table"], entry["row"]))
+        started = time.perf_counter()
+        try:
+            async with self.pool.acquire() as conn:
+                async with conn.transaction():
+                    for table, records in by_table.items():
+                        columns, conflict = TABLES[table]
+                        if conflict is None:
+                            await conn.copy_records_to_table(table, records=records, columns=columns)
+                            continue
+                        staging = f"_wb_{table}"
+                        await conn.execute(
+                            f"CREATE TEMP TABLE IF NOT EXISTS {staging} "
+                            f"(LIKE {table} INCLUDING DEFAULTS) ON COMMIT DELETE ROWS"
+                        )
+                        await conn.copy_records_to_table(staging, records=records, columns=columns)
+                        cols = ", ".join(columns)
+                        await conn.execute(f"INSERT INTO {table} ({cols}) SELECT {cols} FROM {staging} {conflict}")
+        except Exception:
+            self.flush_errors += 1
+            # put the rows back in front; their segments stay on disk until committed
+            self._rows = batch + self._rows
+            self._sealed_segments = segments + self._sealed_segments
+            raise
+        self._flush_latency.append(time.perf_counter() - started)
+        self._batch_sizes.append(len(batch))
+        self.flushed_rows += len(batch)
+        for path in segments:
+            self._remove(path)
+        async with self._space:
+            self._space.notify_all()
+
+    @staticmethod
+    def _remove(path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def stats(self) -> Dict[str, Any]:
+        latency = sorted(self._flush_latency)
+        sizes = self._batch_sizes
+
+        def pct(p: float) -> float:
+            return round(latency[min(len(latency) - 1, int(len(latency) * p))] * 1000, 3) if latency else 0.0
+
+        return {
+            "queue_depth": len(self._rows),
+            "max_queue": self.max_queue,
+            "flushed_rows": self.flushed_rows,
+            "flushes": len(sizes),
+            "flush_errors": self.flush_errors,
+            "backpressure_waits": self.backpressure_waits,
+            "batch_size_avg": round(sum(sizes) / len(sizes), 2) if sizes else 0.0,
+            "batch_size_max": max(sizes) if sizes else 0,
+            "flush_latency_ms": {"p50": pct(0.5), "p95": pct(0.95), "max": pct(1.0)},
+            "journal_segments_pending": len(self._sealed_segments) + 1,
+        }